@@ -0,0 +1,10 @@
+# Benchmarks for Pytt.
+#
+# Run one with `python -m benchmarks.<name>` from the top of the source tree.
+#
+#   bench_micro    bencode, bdecode, get_peer_list and store_peer_info.
+#   bench_load     announce/scrape mix against an in-process tracker.
+#   bench_bencode  the bencode encoder against the one it replaced.
+#
+# bench_micro and bench_load compare their results with the baseline
+# saved by a previous run with --save.
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#
+# Saved benchmark baselines.
+#
+# A baseline is a JSON file mapping every benchmark to its result. Save
+# one before a change and compare the runs made after it with
+# `--baseline`: lower is better for timings and memory, higher for
+# throughput.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+import json
+import os
+
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def load(path=DEFAULT_PATH):
+    """The saved results, {} if there is no baseline yet.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(results, path=DEFAULT_PATH):
+    """Merge the results into the baseline at path.
+    """
+    saved = load(path)
+    saved.update(results)
+    with open(path, 'w') as f:
+        json.dump(saved, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def report(results, baseline, higher_is_better=()):
+    """Print the results next to the baseline ones.
+    """
+    for name in sorted(results):
+        value = results[name]
+        line = '%-32s %12.2f' % (name, value)
+        old = baseline.get(name)
+        if old:
+            change = (value - old) / old * 100
+            better = change > 0 if name in higher_is_better else change < 0
+            line += '   baseline %12.2f  %+6.1f%%%s' % (
+                old, change, ' (better)' if better else '')
+        print(line)
+
+
+def add_options(parser):
+    """The --save and --baseline options of every benchmark.
+    """
+    parser.add_option('--baseline', default=DEFAULT_PATH,
+                      help='Baseline to compare with')
+    parser.add_option('--save', action='store_true', default=False,
+                      help='Save the results as the new baseline')
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# Micro-benchmark of the bencode encoder.
+#
+# Compares pytt.bencode.bencode with the token-list encoder it replaced,
+# on a 50-peer non-compact announce response.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+import timeit
+
+from pytt.bencode import bencode
+
+
+def legacy_bencode(x):
+    """The previous encoder: a list of mixed tokens joined at the end.
+    """
+    def _to_bytes(x):
+        if isinstance(x, bytes):
+            return x
+        else:
+            return str(x).encode('utf-8')
+
+    def encode_int(x, r):
+        r.extend(('i', x, 'e'))
+
+    def encode_string(x, r):
+        r.extend((len(x), ':', x))
+
+    def encode_list(x, r):
+        r.append(b'l')
+        for i in x:
+            funcs[type(i)](i, r)
+        r.append(b'e')
+
+    def encode_dict(x, r):
+        r.append(b'd')
+        for k, v in sorted(x.items()):
+            r.extend((str(len(k)), b':', k))
+            funcs[type(v)](v, r)
+        r.append(b'e')
+
+    funcs = {int: encode_int, str: encode_string, bytes: encode_string,
+             list: encode_list, dict: encode_dict}
+    r = []
+    funcs[type(x)](x, r)
+    return b''.join(map(_to_bytes, r))
+
+
+def announce_response(peers=50):
+    """A non-compact announce response with `peers` peers.
+    """
+    return {'complete': 30,
+            'incomplete': 20,
+            'interval': 1800,
+            'min interval': 900,
+            'tracker id': '',
+            'peers': [{'peer_id': '-BT7000-%012d' % i,
+                       'ip': '10.0.%d.%d' % (i // 256, i % 256),
+                       'port': 6881 + i} for i in range(peers)]}
+
+
+def run(number=2000):
+    response = announce_response()
+    results = {}
+    for name, func in [('legacy', legacy_bencode), ('bencode', bencode)]:
+        best = min(timeit.repeat(lambda: func(response), number=number,
+                                 repeat=5))
+        results[name] = best / number * 1e6
+        print('%-8s %8.1f us per response' % (name, results[name]))
+    print('speedup  %8.1fx' % (results['legacy'] / results['bencode']))
+    return results
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+#
+# Load benchmark of the Pytt HTTP tracker.
+#
+# Starts the tracker in-process on a loopback port, fills it with
+# synthetic Zipf swarms and replays a mix of announces (started,
+# completed, stopped and regular re-announces, compact or not) and
+# scrapes over keep-alive connections. Every connection is driven by a
+# client process of its own, so `connections` requests are in flight at
+# once and the clients don't compete with the tracker for the GIL.
+# Reports the p50/p99 latency, the requests/s of the whole replay and
+# the RSS of the tracker's process.
+#
+# Run with `python -m benchmarks.bench_load [--save] [--baseline path]`.
+# `--loop uvloop` serves the tracker on uvloop instead of the default
+# asyncio event loop, and `--loop both` compares the two.
+#
+# `--workers 1,2,4` runs the tracker in multi-process mode instead, once
+# for each number of workers: every worker is forked with the swarms of
+# its shard, they share the listening socket and forward the announces
+# of the other shards to their owner. Reports the same figures for each
+# number of workers, the RSS being that of the largest worker.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+import asyncio
+import multiprocessing
+from optparse import OptionParser
+import resource
+import threading
+import time
+
+try:
+    from http.client import HTTPConnection
+    from urllib.parse import urlencode
+except ImportError:
+    from httplib import HTTPConnection
+    from urllib import urlencode
+
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from pytt import utils
+from pytt.tracker import make_app
+from pytt.workers import Shards, shard_of
+
+from . import baseline
+from .swarms import (SyntheticSwarms, TrackerEnvironment, peer_address,
+                     peer_id)
+
+
+# Share of each kind of request in the replayed mix, in percent.
+MIX = [('announce', 80), ('started', 5), ('completed', 3), ('stopped', 3),
+       ('scrape', 9)]
+# Share of the announces asking for a compact peer list, in percent.
+COMPACT = 90
+
+
+class Server(object):
+    """The tracker, served by its own IOLoop in a background thread.
+    """
+
+    def __init__(self, loop='asyncio'):
+        self.loop = loop
+        self.sockets = tornado.netutil.bind_sockets(0, '127.0.0.1')
+        self.port = self.sockets[0].getsockname()[1]
+        self.started = threading.Event()
+        self.io_loop = None
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+
+    def serve(self):
+        if self.loop == 'uvloop':
+            asyncio.set_event_loop(uvloop.new_event_loop())
+        else:
+            asyncio.set_event_loop(asyncio.new_event_loop())
+        self.io_loop = tornado.ioloop.IOLoop.current()
+        server = tornado.httpserver.HTTPServer(make_app())
+        server.add_sockets(self.sockets)
+        self.started.set()
+        self.io_loop.start()
+
+    def start(self):
+        self.thread.start()
+        self.started.wait()
+
+    def stop(self):
+        self.io_loop.add_callback(self.io_loop.stop)
+        self.thread.join()
+
+
+class Workers(object):
+    """The tracker in multi-process mode, `workers` forked processes.
+    """
+
+    def __init__(self, workers, loop='asyncio'):
+        self.workers = workers
+        self.loop = loop
+        self.sockets = tornado.netutil.bind_sockets(0, '127.0.0.1')
+        self.port = self.sockets[0].getsockname()[1]
+        self.base_port, self.shard_sockets = bind_shard_sockets(workers)
+        self.processes = []
+        self.ready = []
+
+    def fork(self, context, swarms):
+        """Fork the workers, each announcing the peers of its shard.
+        """
+        for task_id in range(self.workers):
+            ready = context.Event()
+            process = context.Process(target=self.serve,
+                                      args=(task_id, swarms, ready))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+            self.ready.append(ready)
+        for sock in self.shard_sockets:
+            sock.close()
+
+    def serve(self, task_id, swarms, ready):
+        if self.loop == 'uvloop':
+            asyncio.set_event_loop(uvloop.new_event_loop())
+        else:
+            asyncio.set_event_loop(asyncio.new_event_loop())
+        utils.use_shard_db(task_id)
+        swarms.populate(lambda raw_hash: shard_of(raw_hash, self.workers)
+                        == task_id)
+        shards = Shards(self.workers, task_id, self.base_port)
+        server = tornado.httpserver.HTTPServer(make_app(shards=shards))
+        server.add_sockets(self.sockets)
+        internal = tornado.httpserver.HTTPServer(make_app(internal=True))
+        internal.add_sockets([self.shard_sockets[task_id]])
+        ready.set()
+        tornado.ioloop.IOLoop.current().start()
+
+    def start(self):
+        for ready in self.ready:
+            ready.wait()
+
+    def max_rss(self):
+        """The peak RSS of the largest worker in megabytes, from /proc.
+        """
+        peaks = [0]
+        for process in self.processes:
+            with open('/proc/%d/status' % process.pid) as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        peaks.append(int(line.split()[1]) / 1024.0)
+        return max(peaks)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+            process.join()
+
+
+def bind_shard_sockets(workers):
+    """Loopback sockets on `workers` consecutive free ports, the first
+    one of which is returned with them.
+    """
+    while True:
+        sockets = tornado.netutil.bind_sockets(0, '127.0.0.1')
+        base_port = sockets[0].getsockname()[1]
+        try:
+            for n in range(1, workers):
+                sockets.extend(tornado.netutil.bind_sockets(base_port + n,
+                                                            '127.0.0.1'))
+        except OSError:
+            for sock in sockets:
+                sock.close()
+            continue
+        return base_port, sockets
+
+
+class Replay(object):
+    """Builds the URIs of the replayed requests.
+    """
+
+    def __init__(self, swarms):
+        self.swarms = swarms
+        self.random = swarms.random
+        self.kinds = []
+        for kind, share in MIX:
+            self.kinds.extend([kind] * share)
+
+    def uri(self):
+        raw_hash, members = self.swarms.pick()
+        kind = self.random.choice(self.kinds)
+        if kind == 'scrape':
+            return '/scrape?' + urlencode({'info_hash': raw_hash})
+        if kind == 'started':
+            n = self.swarms.new_peer()
+            members.append(n)
+        else:
+            n = self.random.choice(members)
+        params = {'info_hash': raw_hash,
+                  'peer_id': peer_id(n),
+                  'port': peer_address(n)[1],
+                  'uploaded': 0,
+                  'downloaded': 0,
+                  'left': 0 if kind == 'completed' else 1000,
+                  'compact': int(self.random.randrange(100) < COMPACT)}
+        if kind != 'announce':
+            params['event'] = kind
+        return '/announce?' + urlencode(params)
+
+
+def replay_uris(server, uris, start, results):
+    """Client process: sends the requests for uris one after the other
+    over a keep-alive connection, once `start` is set. Sends back their
+    latencies, and the error that stopped it if any.
+    """
+    for sock in server.sockets:
+        sock.close()
+    latencies = []
+    error = None
+    start.wait()
+    client = HTTPConnection('127.0.0.1', server.port)
+    try:
+        for uri in uris:
+            sent = time.time()
+            client.request('GET', uri)
+            response = client.getresponse()
+            response.read()
+            latencies.append(time.time() - sent)
+            if response.status != 200:
+                error = '%s: HTTP %d' % (uri, response.status)
+                break
+    except Exception as ex:
+        error = '%s' % ex
+    finally:
+        client.close()
+    results.send((latencies, error))
+    results.close()
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(torrents=1000, peers=100000, requests=20000, connections=4,
+        engine='memory', loop='asyncio', peer_table='objects', workers=0):
+    context = multiprocessing.get_context('fork')
+    with TrackerEnvironment(engine, peer_table):
+        swarms = SyntheticSwarms(torrents, peers)
+        if workers:
+            # the workers are forked before the replay adds new peers.
+            server = Workers(workers, loop)
+            server.fork(context, swarms)
+        else:
+            swarms.populate()
+            server = Server(loop)
+        replay = Replay(swarms)
+        uris = [replay.uri() for _ in range(requests)]
+
+        # the clients are forked before the tracker thread starts.
+        start = context.Event()
+        clients, pipes = [], []
+        for n in range(connections):
+            receiver, sender = context.Pipe(duplex=False)
+            client = context.Process(target=replay_uris,
+                                     args=(server, uris[n::connections],
+                                           start, sender))
+            client.daemon = True
+            client.start()
+            sender.close()
+            clients.append(client)
+            pipes.append(receiver)
+        server.start()
+        try:
+            latencies = []
+            started = time.time()
+            start.set()
+            for receiver in pipes:
+                client_latencies, error = receiver.recv()
+                if error is not None:
+                    raise RuntimeError(error)
+                latencies.extend(client_latencies)
+            elapsed = time.time() - started
+            if workers:
+                rss = server.max_rss()
+        finally:
+            for client in clients:
+                client.terminate()
+                client.join()
+            server.stop()
+
+    latencies.sort()
+    if not workers:
+        # ru_maxrss is in kilobytes on Linux.
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return {'load.p50_ms': percentile(latencies, 0.5) * 1000,
+            'load.p99_ms': percentile(latencies, 0.99) * 1000,
+            'load.requests_per_s': requests / elapsed,
+            'load.max_rss_mb': rss}
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-t', '--torrents', type='int', default=1000)
+    parser.add_option('-p', '--peers', type='int', default=100000)
+    parser.add_option('-n', '--requests', type='int', default=20000)
+    parser.add_option('-c', '--connections', type='int', default=4)
+    parser.add_option('-e', '--engine', default='memory',
+                      help='Storage engine')
+    parser.add_option('-l', '--loop', default='asyncio',
+                      choices=['asyncio', 'uvloop', 'both'],
+                      help='Event loop: asyncio, uvloop or both')
+    parser.add_option('--peer-table', default='objects',
+                      help='Peer table: objects or columns')
+    parser.add_option('-w', '--workers', default='',
+                      help='Numbers of workers to compare, e.g. 1,2,4')
+    baseline.add_options(parser)
+    options, _ = parser.parse_args()
+    if options.loop != 'asyncio' and uvloop is None:
+        parser.error('uvloop is not installed')
+    loop = 'asyncio' if options.loop == 'both' else options.loop
+    if options.workers:
+        scaling(options, loop,
+                [int(count) for count in options.workers.split(',')])
+        return
+    results = run(options.torrents, options.peers, options.requests,
+                  options.connections, options.engine, loop,
+                  options.peer_table)
+    baseline.report(results, baseline.load(options.baseline),
+                    higher_is_better=('load.requests_per_s',))
+    if options.loop == 'both':
+        print('uvloop, compared with asyncio:')
+        baseline.report(run(options.torrents, options.peers,
+                            options.requests, options.connections,
+                            options.engine, 'uvloop', options.peer_table),
+                        results, higher_is_better=('load.requests_per_s',))
+    if options.save:
+        baseline.save(results, options.baseline)
+
+
+def scaling(options, loop, counts):
+    """Run the replay for each number of workers, and report the results
+    of each as load.workers<N>.*.
+    """
+    results = {}
+    for count in counts:
+        for name, value in run(options.torrents, options.peers,
+                               options.requests, options.connections,
+                               options.engine, loop, options.peer_table,
+                               count).items():
+            results[name.replace('load.', 'load.workers%d.' % count)] = value
+    baseline.report(results, baseline.load(options.baseline),
+                    higher_is_better=tuple(
+                        name for name in results
+                        if name.endswith('requests_per_s')))
+    if options.save:
+        baseline.save(results, options.baseline)
+
+
+if __name__ == '__main__':
+    main()
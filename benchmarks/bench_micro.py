@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# Micro-benchmarks of the announce building blocks: bencode, bdecode,
+# get_peer_list and store_peer_info, on synthetic Zipf swarms, and the
+# memory taken by every peer tracked.
+#
+# Timings are in microseconds per call. Run with
+# `python -m benchmarks.bench_micro [--save] [--baseline path]`.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+from optparse import OptionParser
+import timeit
+import tracemalloc
+
+from pytt import utils
+from pytt.bencode import bencode, bdecode
+
+from . import baseline
+from .bench_bencode import announce_response
+from .swarms import (SyntheticSwarms, TrackerEnvironment, peer_address,
+                     peer_id)
+
+
+def timed(func, number):
+    """Best time of a call of func, in microseconds.
+    """
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def run(torrents=1000, peers=100000, number=2000, engine='memory',
+        peer_table='objects'):
+    results = {}
+    response = announce_response()
+    encoded = bencode(response)
+    results['bencode_us'] = timed(lambda: bencode(response), number)
+    results['bdecode_us'] = timed(lambda: bdecode(encoded), number)
+
+    with TrackerEnvironment(engine, peer_table):
+        swarms = SyntheticSwarms(torrents, peers)
+        tracemalloc.start()
+        swarms.populate()
+        results['peer_bytes'] = tracemalloc.get_traced_memory()[0] / \
+            float(swarms.next_peer)
+        tracemalloc.stop()
+        key, members = swarms.torrents[0]
+        requester = peer_id(members[0])
+        results['get_peer_list_compact_us'] = timed(
+            lambda: utils.get_peer_list(key, 50, 1, 0, requester), number)
+        results['get_peer_list_us'] = timed(
+            lambda: utils.get_peer_list(key, 50, 0, 0, requester), number)
+
+        # a regular announce only refreshes the peer.
+        ip, port = peer_address(members[0])
+        results['store_peer_info_refresh_us'] = timed(
+            lambda: utils.store_peer_info(key, requester, ip, port),
+            number)
+
+        # a peer joining and leaving the swarm.
+        def churn():
+            n = swarms.new_peer()
+            ip, port = peer_address(n)
+            utils.store_peer_info(key, peer_id(n), ip, port, 'started')
+            utils.store_peer_info(key, peer_id(n), ip, port, 'stopped')
+        results['store_peer_info_churn_us'] = timed(churn, number)
+    return results
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-t', '--torrents', type='int', default=1000)
+    parser.add_option('-p', '--peers', type='int', default=100000)
+    parser.add_option('-n', '--number', type='int', default=2000,
+                      help='Calls per measurement')
+    parser.add_option('-e', '--engine', default='memory',
+                      help='Storage engine')
+    parser.add_option('--peer-table', default='objects',
+                      help='Peer table: objects or columns')
+    baseline.add_options(parser)
+    options, _ = parser.parse_args()
+    results = dict(('micro.' + name, value) for name, value in
+                   run(options.torrents, options.peers, options.number,
+                       options.engine, options.peer_table).items())
+    baseline.report(results, baseline.load(options.baseline))
+    if options.save:
+        baseline.save(results, options.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#
+# Synthetic swarms for the Pytt benchmarks.
+#
+# Torrent popularity follows a Zipf law: the k-th most popular torrent
+# has about 1/k^alpha as many peers as the first one, so a few torrents
+# hold large swarms and most have a handful of peers. Everything is drawn
+# from a seeded random.Random, so runs are reproducible.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+
+try:
+    from ConfigParser import RawConfigParser
+except ImportError:
+    from configparser import RawConfigParser
+
+from pytt import utils
+
+
+def zipf_sizes(torrents, peers, alpha=1.1):
+    """The number of peers of each of `torrents` torrents, summing up to
+    about `peers`, most popular first. Every torrent has at least one.
+    """
+    weights = [1.0 / (rank ** alpha) for rank in range(1, torrents + 1)]
+    total = sum(weights)
+    return [max(1, int(round(peers * weight / total)))
+            for weight in weights]
+
+
+def info_hash(n):
+    """The raw 20-byte info_hash of the n-th torrent.
+    """
+    return hashlib.sha1(b'pytt-benchmark-%d' % n).digest()
+
+
+def peer_id(n):
+    return b'-PB0001-%012d' % n
+
+
+def peer_address(n):
+    """The (ip, port) of the n-th peer, one peer in 16 being IPv6.
+    """
+    if n % 16 == 15:
+        return '2001:db8::%x:%x' % (n >> 16, n & 0xffff), \
+            str(6881 + n % 1000)
+    return '10.%d.%d.%d' % (n >> 16 & 255, n >> 8 & 255, n & 255), \
+        str(6881 + n % 1000)
+
+
+class SyntheticSwarms(object):
+    """N torrents with Zipf-distributed swarm sizes.
+
+    `torrents` is a list of (raw info_hash, [peer numbers]), most popular
+    first. `pick()` draws a torrent with a probability proportional to
+    its swarm size, like the announces of a real tracker.
+    """
+
+    def __init__(self, torrents=1000, peers=100000, alpha=1.1, seed=42):
+        self.random = random.Random(seed)
+        self.torrents = []
+        self.next_peer = 0
+        for n, size in enumerate(zipf_sizes(torrents, peers, alpha)):
+            members = list(range(self.next_peer, self.next_peer + size))
+            self.next_peer += size
+            self.torrents.append((info_hash(n), members))
+        self.cumulative = []
+        total = 0
+        for _, members in self.torrents:
+            total += len(members)
+            self.cumulative.append(total)
+
+    def pick(self):
+        """A torrent, drawn by popularity.
+        """
+        return self.random.choices(self.torrents,
+                                   cum_weights=self.cumulative)[0]
+
+    def new_peer(self):
+        self.next_peer += 1
+        return self.next_peer - 1
+
+    def populate(self, owns=None):
+        """Announce every peer to the tracker, one in five as a seeder.
+        Only the torrents for which owns(raw info_hash) is true, if given.
+        """
+        for raw_hash, members in self.torrents:
+            if owns is not None and not owns(raw_hash):
+                continue
+            for n in members:
+                ip, port = peer_address(n)
+                status = 'completed' if n % 5 == 0 else 'started'
+                utils.store_peer_info(raw_hash, peer_id(n), ip, port,
+                                      status)
+
+
+class TrackerEnvironment(object):
+    """A throwaway Pytt config and database, so the benchmarks never touch
+    ~/.pytt. Use it as a context manager.
+    """
+
+    def __init__(self, engine='memory', peer_table='objects'):
+        self.engine = engine
+        self.peer_table = peer_table
+        self.tmpdir = None
+        self.paths = None
+
+    def __enter__(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='pytt-bench-')
+        self.paths = utils.CONFIG_PATH, utils.DB_PATH
+        utils.CONFIG_PATH = os.path.join(self.tmpdir, 'pytt.conf')
+        utils.DB_PATH = os.path.join(self.tmpdir, 'pytt.db')
+        utils.create_config(utils.CONFIG_PATH)
+        config = RawConfigParser()
+        config.read(utils.CONFIG_PATH)
+        config.set('storage', 'engine', self.engine)
+        config.set('tracker', 'peer_table', self.peer_table)
+        config.set('tracker', 'interval', '1800')
+        config.set('tracker', 'min_interval', '900')
+        # the replayed announces all come from 127.0.0.1.
+        config.set('ratelimit', 'enabled', 'no')
+        with open(utils.CONFIG_PATH, 'w') as f:
+            config.write(f)
+        utils.close_db()
+        utils.Limiter().close()
+        return self
+
+    def __exit__(self, *exc_info):
+        utils.close_db()
+        utils.Config().close()
+        utils.CONFIG_PATH, utils.DB_PATH = self.paths
+        shutil.rmtree(self.tmpdir)
@@ -10,13 +10,25 @@
 
 # Written by Petru Paler
 
-import logging
-import sys
+import math
 
 
-decode_func = {}
 encode_func = {}
-valid_chars = '0123456789.-+eE'
+
+# Default limits of bdecode.
+MAX_DEPTH = 64
+# Deepest max_depth the recursive decoder is used for, well within the
+# recursion limit of Python; input allowed to nest deeper is decoded
+# iteratively.
+MAX_RECURSION = 256
+MAX_SIZE = 64 * 1024 * 1024
+# Longest integer or string length prefix accepted.
+MAX_DIGITS = 64
+
+# Bytes starting each type of value.
+INT, FLOAT, LIST, DICT, END = b'ifld' + b'e'
+COLON = b':'
+DIGITS = frozenset(b'0123456789')
 
 
 class BTFailure(Exception):
@@ -31,95 +43,237 @@ class Bencached(object):
         self.bencoded = s
 
 
-def bdecode(x):
-    logging.debug('bdecode({})'.format(x))
+def bdecode(x, zero_copy=False, iterative=False, max_depth=MAX_DEPTH,
+            max_string=None, max_size=MAX_SIZE):
+    """Decode the bencoded bytes or memoryview x.
+
+    Strings are returned as bytes, or with zero_copy as memoryview slices
+    of x (dict keys are always bytes). The iterative decoder keeps its own
+    stack instead of recursing, and is always used when max_depth is over
+    MAX_RECURSION. Input nested deeper than max_depth, with
+    a string longer than max_string or larger than max_size bytes is
+    rejected with BTFailure.
+    """
+    if isinstance(x, memoryview):
+        if isinstance(x.obj, bytes) and x.nbytes == len(x.obj):
+            x = x.obj
+        else:
+            x = x.tobytes()
+    elif not isinstance(x, (bytes, bytearray)):
+        raise BTFailure('can only bdecode bytes, not %s' % type(x).__name__)
+    if len(x) > max_size:
+        raise BTFailure('bencoded value larger than %d bytes' % max_size)
+    decoder = Decoder(x, zero_copy, max_depth,
+                      max_size if max_string is None else max_string)
     try:
-        r, l = decode_func[x[0]](x, 0)
-    except (IndexError, KeyError, ValueError):
+        if iterative or max_depth > MAX_RECURSION:
+            r, l = decoder.decode_iterative(0)
+        else:
+            r, l = decoder.decode(0)
+    except (IndexError, KeyError, ValueError, OverflowError):
         raise BTFailure("not a valid bencoded string")
+    except RecursionError:
+        raise BTFailure("bencoded value nested too deep")
     if l != len(x):
         raise BTFailure("invalid bencoded value (data after valid prefix)")
     return r
 
 
-def bencode(x):
-    def _to_bytes(x):
-        if isinstance(x, bytes):
-            return x
-        else:
-            return str(x).encode('utf-8')
-    logging.debug('bencode({})'.format(x))
-    r = []
-    encode_func[type(x)](x, r)
-    return b''.join(map(_to_bytes, r))
-
-
-def decode_int(x, f):
-    f += 1
-    newf = x.index('e', f)
-    n = int(x[f:newf])
-    if x[f] == '-':
-        if x[f + 1] == '0':
-            raise ValueError
-    elif x[f] == '0' and newf != f+1:
-        raise ValueError
-    return (n, newf + 1)
+def raw_value(x, key, max_depth=MAX_DEPTH):
+    """The bencoded bytes of the value of key in the bencoded dict x, as
+    they appear in x, or None if the dict has no such key. Hashes of a
+    value, like the info_hash of a torrent, are taken on these bytes.
+    """
+    decoder = Decoder(x, False, max_depth, len(x))
+    if max_depth > MAX_RECURSION:
+        decode = decoder.decode_iterative
+    else:
+        decode = decoder.decode
+    try:
+        if x[0] != DICT:
+            raise BTFailure('not a bencoded dict')
+        f = 1
+        while x[f] != END:
+            k, start = decoder.decode_string(f, key=True)
+            _, f = decode(start)
+            if k == key:
+                return bytes(x[start:f])
+    except (IndexError, KeyError, ValueError, OverflowError):
+        raise BTFailure("not a valid bencoded string")
+    except RecursionError:
+        raise BTFailure("bencoded value nested too deep")
+    return None
 
 
-def assert_finite(n):
-    """Raises ValueError if n is NaN or infinite."""
+def bencode(x):
+    """Bencode x in a single pass into one bytearray.
+    """
+    r = bytearray()
+    encoder(type(x))(x, r)
+    return bytes(r)
 
-    if translate(repr(n)) != '':
-        raise ValueError('encountered NaN or infinite')
 
+def encoder(t):
+    """The encode function of type t.
 
-def decode_float(x, f):
-    f += 1
-    newf = x.index('e', f)
+    Subclasses of the supported types are resolved through their MRO the
+    first time they are seen, then cached in encode_func.
+    """
     try:
-        n = float(x[f:newf].replace('E', 'e'))
-        assert_finite(n)
-    except (OverflowError, ValueError):
-        raise ValueError('encountered NaN or infinite')
+        return encode_func[t]
+    except KeyError:
+        for base in t.__mro__[1:]:
+            if base in encode_func:
+                encode_func[t] = encode_func[base]
+                return encode_func[t]
+        raise BTFailure('cannot bencode %s' % t.__name__)
 
-    return (n, newf + 1)
 
+def assert_finite(n):
+    """Raises ValueError if n is NaN or infinite."""
 
-def decode_string(x, f):
-    colon = x.index(':', f)
-    n = int(x[f:colon])
-    if x[f] == '0' and colon != f+1:
-        raise ValueError
-    colon += 1
-    return (x[colon:colon+n], colon+n)
+    if math.isinf(n) or math.isnan(n):
+        raise ValueError('encountered NaN or infinite')
 
 
-def decode_list(x, f):
-    r, f = [], f + 1
-    while x[f] != 'e':
-        v, f = decode_func[x[f]](x, f)
-        r.append(v)
-    return (r, f + 1)
+class Decoder(object):
+    """Decodes bencoded values straight out of a bytes buffer.
+
+    Every method takes the offset of a value and returns the decoded
+    value with the offset following it.
+    """
+    __slots__ = ['data', 'view', 'max_depth', 'max_string', 'depth']
+
+    def __init__(self, data, zero_copy, max_depth, max_string):
+        self.data = data
+        self.view = memoryview(data) if zero_copy else data
+        self.max_depth = max_depth
+        self.max_string = max_string
+        self.depth = 0
+
+    def decode(self, f):
+        c = self.data[f]
+        if c in DIGITS:
+            return self.decode_string(f)
+        elif c == INT:
+            return self.decode_int(f)
+        elif c == LIST:
+            return self.decode_list(f)
+        elif c == DICT:
+            return self.decode_dict(f)
+        elif c == FLOAT:
+            return self.decode_float(f)
+        raise ValueError
 
+    def decode_int(self, f):
+        data = self.data
+        f += 1
+        newf = data.index(b'e', f, f + MAX_DIGITS)
+        digits = data[f + 1:newf] if data[f] == 0x2d else data[f:newf]
+        # no sign but '-', no leading zeros and no -0.
+        if not digits.isdigit() or (digits[0] == 0x30 and
+                                    newf - f != 1):
+            raise ValueError
+        return (int(data[f:newf]), newf + 1)
 
-def decode_dict(x, f):
-    r, f = {}, f + 1
-    while x[f] != 'e':
-        k, f = decode_string(x, f)
-        r[k], f = decode_func[x[f]](x, f)
-    return (r, f + 1)
+    def decode_float(self, f):
+        data = self.data
+        f += 1
+        newf = data.index(b'e', f, f + MAX_DIGITS)
+        n = float(data[f:newf].replace(b'E', b'e'))
+        assert_finite(n)
+        return (n, newf + 1)
+
+    def decode_string(self, f, key=False):
+        data = self.data
+        colon = data.index(COLON, f, f + MAX_DIGITS)
+        if not data[f:colon].isdigit() or (data[f] == 0x30 and
+                                           colon != f + 1):
+            raise ValueError
+        n = int(data[f:colon])
+        if n > self.max_string:
+            raise BTFailure('bencoded string longer than %d bytes' %
+                            self.max_string)
+        colon += 1
+        end = colon + n
+        if end > len(data):
+            raise ValueError
+        if key:
+            return (bytes(data[colon:end]), end)
+        return (self.view[colon:end], end)
+
+    def enter(self):
+        self.depth += 1
+        if self.depth > self.max_depth:
+            raise BTFailure('bencoded value nested deeper than %d' %
+                            self.max_depth)
+
+    def decode_list(self, f):
+        self.enter()
+        data, decode = self.data, self.decode
+        r, f = [], f + 1
+        while data[f] != END:
+            v, f = decode(f)
+            r.append(v)
+        self.depth -= 1
+        return (r, f + 1)
+
+    def decode_dict(self, f):
+        self.enter()
+        data, decode = self.data, self.decode
+        r, f = {}, f + 1
+        while data[f] != END:
+            k, f = self.decode_string(f, key=True)
+            r[k], f = decode(f)
+        self.depth -= 1
+        return (r, f + 1)
+
+    def decode_iterative(self, f):
+        """Decode without recursion, the open lists and dicts are kept on
+        an explicit stack of [container, pending dict key] pairs.
+        """
+        data = self.data
+        stack = []
+        while True:
+            c = data[f]
+            if c == END:
+                if not stack or stack[-1][1] is not None:
+                    raise ValueError
+                value = stack.pop()[0]
+                f += 1
+            elif c == LIST or c == DICT:
+                if len(stack) >= self.max_depth:
+                    raise BTFailure('bencoded value nested deeper than %d' %
+                                    self.max_depth)
+                stack.append([[] if c == LIST else {}, None])
+                f += 1
+                continue
+            elif stack and stack[-1][1] is None and \
+                    type(stack[-1][0]) is dict:
+                stack[-1][1], f = self.decode_string(f, key=True)
+                continue
+            else:
+                value, f = self.decode(f)
+            if not stack:
+                return (value, f)
+            top = stack[-1]
+            if top[1] is None:
+                top[0].append(value)
+            else:
+                top[0][top[1]] = value
+                top[1] = None
 
 
 def encode_bencached(x, r):
-    r.append(x.bencoded)
+    r += x.bencoded
 
 
 def encode_int(x, r):
-    r.extend(('i', x, 'e'))
+    r += b'i%de' % x
 
 
 def encode_float(x, r):
-    r.extend(('f', repr(x).replace('e', 'E'), 'e'))
+    r += b'f' + repr(x).replace('e', 'E').encode('ascii') + b'e'
 
 
 def encode_bool(x, r):
@@ -127,22 +281,72 @@ def encode_bool(x, r):
 
 
 def encode_string(x, r):
-    r.extend((len(x), ':', x))
+    x = x.encode('utf-8')
+    r += b'%d:' % len(x)
+    r += x
+
+
+def encode_bytes(x, r):
+    r += b'%d:' % len(x)
+    r += x
 
 
 def encode_list(x, r):
-    r.append(b'l')
+    r += b'l'
     for i in x:
-        encode_func[type(i)](i, r)
-    r.append(b'e')
+        t = type(i)
+        if t is int:
+            r += b'i%de' % i
+        elif t is str:
+            i = i.encode('utf-8')
+            r += b'%d:%s' % (len(i), i)
+        else:
+            encoder(t)(i, r)
+    r += b'e'
+
+
+# Bencoded str dict keys ("<len>:<key>"), the same few keys of the
+# responses keep coming back. Bytes keys, like the info_hashes of a
+# scrape, are never cached: they would soon fill it for good.
+key_cache = {}
+KEY_CACHE_SIZE = 1024
+
+
+def encode_key(k):
+    try:
+        return key_cache[k]
+    except KeyError:
+        pass
+    raw = k.encode('utf-8') if isinstance(k, str) else bytes(k)
+    encoded = b'%d:' % len(raw) + raw
+    if type(k) is str and len(key_cache) < KEY_CACHE_SIZE:
+        key_cache[k] = encoded
+    return encoded
 
 
 def encode_dict(x, r):
-    r.append(b'd')
-    for k, v in sorted(x.items()):
-        r.extend((str(len(k)), b':', k))
-        encode_func[type(v)](v, r)
-    r.append(b'e')
+    r += b'd'
+    try:
+        # utf-8 preserves the code point order, so str keys sort as their
+        # encoded bytes would.
+        items = sorted(x.items())
+    except TypeError:
+        # a mix of str and bytes keys, sort them as raw strings.
+        items = [(k, v) for _, k, v in sorted(
+            (k.encode('utf-8') if isinstance(k, str) else k, k, v)
+            for k, v in x.items())]
+    cache = key_cache
+    for k, v in items:
+        r += cache[k] if k in cache else encode_key(k)
+        t = type(v)
+        if t is int:
+            r += b'i%de' % v
+        elif t is str:
+            v = v.encode('utf-8')
+            r += b'%d:%s' % (len(v), v)
+        else:
+            encoder(t)(v, r)
+    r += b'e'
 
 
 encode_func = {
@@ -150,39 +354,10 @@ encode_func = {
     int: encode_int,
     float: encode_float,
     str: encode_string,
+    bytes: encode_bytes,
+    bytearray: encode_bytes,
     list: encode_list,
     tuple: encode_list,
     dict: encode_dict,
     bool: encode_bool,
 }
-
-
-decode_func = {
-    'l': decode_list,
-    'd': decode_dict,
-    'i': decode_int,
-    'f': decode_float,
-    '0': decode_string,
-    '1': decode_string,
-    '2': decode_string,
-    '3': decode_string,
-    '4': decode_string,
-    '5': decode_string,
-    '6': decode_string,
-    '7': decode_string,
-    '8': decode_string,
-    '9': decode_string,
-}
-
-
-if sys.version_info >= (3, 0):
-    encode_func[bytes] = encode_string
-
-    def translate(value):
-        return value.translate(str.maketrans('', '', valid_chars))
-else:
-    encode_func[unicode] = encode_string
-    import string
-
-    def translate(value):
-        return value.translate(string.maketrans('', ''), valid_chars)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# Cache of bencoded response fragments.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+from collections import OrderedDict
+
+
+class ResponseCache(object):
+    """LRU cache of bencoded fragments, each tagged with the version of
+    the swarm it was built from.
+
+    A lookup with a different version is a miss, so entries never need
+    to be invalidated: they are rebuilt once the swarm changed and the
+    least recently used ones are dropped when the total size of the
+    cached fragments grows past `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, version):
+        """The fragment cached for key at this version, or None.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, version, data):
+        """Cache the fragment built for key at this version.
+        """
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old[1])
+        if len(data) > self.max_bytes:
+            return
+        self.entries[key] = (version, data)
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def fetch(self, key, version, build):
+        """The cached fragment for key, rebuilt with build() on a miss.
+        """
+        data = self.get(key, version)
+        if data is None:
+            data = build()
+            self.put(key, version, data)
+        return data
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        """Hit/miss statistics of the cache.
+        """
+        lookups = self.hits + self.misses
+        return {'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0}
@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+#
+# Federation of Pytt trackers.
+#
+# Several Pytt nodes serving the same torrents, behind DNS round-robin
+# for instance, replicate their swarms to each other so that a client
+# gets the peers of every node, whichever one it announced to. Every
+# node sends the changes of its own announces, peers joining, moving,
+# leaving or expiring, to all the others over TCP every `interval`
+# seconds, and merges theirs into its swarm registry. A node only sends
+# its own changes, never the ones it merged, so a full mesh never loops.
+#
+# Changes are stamped with the time they were made and the id of the
+# node that made them, and merged with last-writer-wins: a change only
+# applies if it is newer than the last change applied to the peer, ties
+# going to the highest node id, so the nodes converge whatever the order
+# the changes arrive in. A removed peer leaves a tombstone until it would
+# have expired anyway, so a late change never brings it back.
+#
+# Changes to the same peer waiting to be sent are coalesced. A batch is
+# a bencoded dict, zlib-compressed and prefixed with its length, followed
+# by its HMAC-SHA256 when the nodes share a secret. When a connection to
+# a node is (re)established, it gets every peer of this node first, so a
+# restart or a lost connection only delays the changes.
+#
+# Every node has a queue of frames of its own, sent by a single task at
+# a time, so a node that is slow or unreachable never holds up the
+# others. Connecting or sending a frame times out, a node that keeps
+# failing is retried less and less often, and one falling too far behind
+# is disconnected: it gets a snapshot again when it reconnects.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+from collections import deque
+from datetime import timedelta
+import hashlib
+import hmac
+import logging
+import socket
+import struct
+import time
+import zlib
+
+import tornado.gen
+import tornado.ioloop
+import tornado.iostream
+import tornado.tcpclient
+import tornado.tcpserver
+
+from .bencode import BTFailure, MAX_SIZE, bdecode, bencode
+from .metrics import FEDERATION_CHANGES
+from .swarm import COMPLETED, STARTED, pack_address
+
+
+_length = struct.Struct('>I')
+
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+# Length of the info_hashes and peer_ids of the changes.
+ID_LEN = 20
+
+# Status of the peers of the changes.
+STATUSES = (STARTED, COMPLETED)
+
+# Seconds to connect to a node, or to send it a frame.
+TIMEOUT = 10.0
+
+# Longest wait in seconds before connecting again to a failing node.
+MAX_BACKOFF = 300.0
+
+# Most frames waiting for a node before it is disconnected.
+MAX_QUEUED = 100
+
+
+def timestamp(now=None):
+    """The time of a change, in milliseconds.
+    """
+    return int((time.time() if now is None else now) * 1000)
+
+
+def parse_change(entry):
+    """The (info_hash, peer_id, timestamp, record) change of a batch
+    entry, the port of the record as text like an announce's. Raises
+    ValueError unless every field is valid.
+    """
+    if not isinstance(entry, list) or len(entry) not in (3, 6):
+        raise ValueError('invalid change')
+    info_hash, peer_id, ts = entry[:3]
+    if not isinstance(info_hash, bytes) or len(info_hash) != ID_LEN or \
+            not isinstance(peer_id, bytes) or len(peer_id) != ID_LEN or \
+            not isinstance(ts, int) or ts < 0:
+        raise ValueError('invalid change')
+    if len(entry) == 3:
+        return info_hash, peer_id, ts, None
+    ip, port, status = entry[3:]
+    ip, status = ip.decode('ascii'), status.decode('ascii')
+    if not isinstance(port, int) or not 0 < port < 65536 or \
+            status not in STATUSES:
+        raise ValueError('invalid peer')
+    try:
+        pack_address(ip, port)
+    except (socket.error, UnicodeError):
+        raise ValueError('invalid ip')
+    return info_hash, peer_id, ts, (ip, str(port), status)
+
+
+class FederationNode(object):
+    """Replicates the swarm registry of a node to the other `nodes`, a
+    list of (host, port), and merges their changes into it.
+
+    `accept`, if given, is called with the info_hash of every change
+    received, and the change is ignored unless it returns True.
+    """
+
+    def __init__(self, registry, nodes=(), node_id='', secret='',
+                 interval=5.0, batch_size=10000, tombstone_ttl=3600,
+                 accept=None, timeout=TIMEOUT):
+        self.registry = registry
+        self.nodes = list(nodes)
+        self.node_id = node_id
+        if not isinstance(secret, bytes):
+            secret = secret.encode('utf-8')
+        self.secret = secret
+        self.interval = interval
+        self.batch_size = batch_size
+        self.tombstone_ttl = tombstone_ttl
+        self.accept = accept
+        self.timeout = timeout
+        # (info_hash, peer_id): (timestamp, node_id) of the last change.
+        self.versions = {}
+        # (info_hash, peer_id): (timestamp, record or None), to be sent.
+        self.pending = {}
+        # (expiry, key, timestamp) of the removed peers, oldest first.
+        self.tombstones = deque()
+        # (host, port): NodeLink to the node.
+        self.links = {}
+        self.server = None
+        self.callback = None
+        self.client = tornado.tcpclient.TCPClient()
+
+    def record(self, info_hash, peer_id, record, now=None):
+        """Queue a change made by an announce to this node: the
+        (ip, port, status) of the peer, or None if it was removed.
+        """
+        key = (info_hash, peer_id)
+        ts = timestamp(now)
+        self.versions[key] = (ts, self.node_id)
+        self.pending[key] = (ts, record)
+        if record is None:
+            self.bury(key, ts)
+
+    def expire(self, info_hash, peer_id, now=None):
+        """A peer expired. Only the node that made its last change tells
+        the others, they expire it on their own meanwhile.
+        """
+        key = (info_hash, peer_id)
+        version = self.versions.get(key)
+        if version is None:
+            return
+        if version[1] == self.node_id:
+            self.record(info_hash, peer_id, None, now)
+        else:
+            self.bury(key, version[0])
+
+    def bury(self, key, ts):
+        self.tombstones.append((time.time() + self.tombstone_ttl, key, ts))
+
+    def collect(self, now=None):
+        """Forget the tombstones past their time.
+        """
+        now = time.time() if now is None else now
+        tombstones = self.tombstones
+        while tombstones and tombstones[0][0] <= now:
+            _, key, ts = tombstones.popleft()
+            version = self.versions.get(key)
+            if version is None or version[0] != ts:
+                continue
+            swarm = self.registry.get(key[0])
+            if swarm is None or key[1] not in swarm:
+                del self.versions[key]
+
+    def merge(self, node_id, changes):
+        """Apply the (info_hash, peer_id, timestamp, record) changes made
+        by another node, unless this node knows of a later one. Returns
+        the number of changes applied.
+        """
+        merged = 0
+        versions = self.versions
+        for info_hash, peer_id, ts, record in changes:
+            key = (info_hash, peer_id)
+            version = versions.get(key)
+            if version is not None and (ts, node_id) <= version:
+                FEDERATION_CHANGES['stale'].inc()
+                continue
+            if self.accept is not None and not self.accept(info_hash):
+                continue
+            versions[key] = (ts, node_id)
+            if record is None:
+                self.registry.remove(info_hash, peer_id)
+                self.bury(key, ts)
+            else:
+                ip, port, status = record
+                self.registry.update(info_hash, peer_id, ip, port, status,
+                                     now=ts / 1000.0)
+            merged += 1
+        FEDERATION_CHANGES['merged'].inc(merged)
+        return merged
+
+    def snapshot(self):
+        """Every peer this node made the last change to, as changes.
+        """
+        changes = {}
+        for key, (ts, node_id) in self.versions.items():
+            if node_id != self.node_id:
+                continue
+            swarm = self.registry.get(key[0])
+            peer = swarm.get(key[1]) if swarm is not None else None
+            changes[key] = (ts, peer.record if peer is not None else None)
+        return changes
+
+    def encode(self, changes):
+        """Frame the changes, a {(info_hash, peer_id): (timestamp, record)}
+        dict, in batches of batch_size. Returns [(number of changes,
+        frame)].
+        """
+        frames = []
+        entries = []
+        for (info_hash, peer_id), (ts, record) in changes.items():
+            entry = [info_hash, peer_id, ts]
+            if record is not None:
+                ip, port, status = record
+                entry.extend([ip, int(port), status])
+            entries.append(entry)
+        for start in range(0, len(entries), self.batch_size):
+            batch = entries[start:start + self.batch_size]
+            payload = zlib.compress(bencode({'node': self.node_id,
+                                             'changes': batch}))
+            frame = _length.pack(len(payload)) + payload
+            if self.secret:
+                frame += hmac.new(self.secret, payload,
+                                  hashlib.sha256).digest()
+            frames.append((len(batch), frame))
+        return frames
+
+    def decode(self, payload, digest=b''):
+        """The (node_id, changes) of a received batch. Raises BTFailure if
+        it is corrupt or its HMAC doesn't match.
+        """
+        if self.secret:
+            expected = hmac.new(self.secret, payload, hashlib.sha256).digest()
+            if not hmac.compare_digest(expected, digest):
+                raise BTFailure('bad HMAC')
+        decompressor = zlib.decompressobj()
+        try:
+            data = decompressor.decompress(payload, MAX_SIZE)
+        except zlib.error as ex:
+            raise BTFailure('not a valid batch: %s' % ex)
+        if decompressor.unconsumed_tail:
+            raise BTFailure('batch larger than %d bytes' % MAX_SIZE)
+        message = bdecode(data)
+        try:
+            node_id = message[b'node'].decode('utf-8')
+            changes = [parse_change(entry) for entry in message[b'changes']]
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise BTFailure('not a valid batch')
+        return node_id, changes
+
+    async def flush(self):
+        """Queue the pending changes for every node, and send them to
+        the nodes not still busy with the previous ones.
+        """
+        self.collect()
+        changes, self.pending = self.pending, {}
+        frames = self.encode(changes)
+        links = []
+        for address in self.nodes:
+            link = self.links.get(address)
+            if link is None:
+                link = self.links[address] = NodeLink(self, address)
+            link.queue(frames)
+            links.append(link)
+        await tornado.gen.multi([link.drain() for link in links])
+
+    def tick(self):
+        tornado.ioloop.IOLoop.current().spawn_callback(self.flush)
+
+    def start(self, port, address='', offset=0):
+        """Serve the other nodes on port + offset and send them the
+        changes every `interval` seconds. Worker n of a node only
+        federates with worker n of the others, at offset n.
+        """
+        if not self.node_id:
+            self.node_id = '%s:%d' % (socket.gethostname(), port + offset)
+        self.nodes = [(host, node_port + offset)
+                      for host, node_port in self.nodes]
+        self.server = FederationServer(self)
+        self.server.listen(port + offset, address)
+        self.callback = tornado.ioloop.PeriodicCallback(
+            self.tick, self.interval * 1000)
+        self.callback.start()
+
+    def stop(self):
+        if self.callback is not None:
+            self.callback.stop()
+            self.callback = None
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+        for link in self.links.values():
+            link.close()
+        self.links.clear()
+
+
+class NodeLink(object):
+    """The connection of a FederationNode to another node, and the frames
+    waiting to be sent to it.
+    """
+
+    def __init__(self, node, address):
+        self.node = node
+        self.address = address
+        self.stream = None
+        # (number of changes, frame) to send, the oldest first.
+        self.frames = deque()
+        self.sending = False
+        self.failures = 0
+        self.retry_at = 0
+
+    def queue(self, frames):
+        """Queue frames for the node. Until it is connected they are
+        dropped, the snapshot sent on connecting has their changes.
+        """
+        if self.stream is None:
+            return
+        self.frames.extend(frames)
+        if len(self.frames) > MAX_QUEUED:
+            logging.warning('federation node %s:%d too far behind, '
+                            'disconnected', *self.address)
+            self.close()
+
+    async def drain(self):
+        """Send the queued frames, connecting to the node first if
+        needed. Only one drain runs at a time, the others return at once.
+        """
+        if self.sending or time.time() < self.retry_at:
+            return
+        self.sending = True
+        timeout = timedelta(seconds=self.node.timeout)
+        try:
+            if self.stream is None:
+                await self.connect()
+            while self.frames:
+                count, frame = self.frames.popleft()
+                await tornado.gen.with_timeout(timeout,
+                                               self.stream.write(frame))
+                FEDERATION_CHANGES['sent'].inc(count)
+            self.failures = 0
+        except (tornado.iostream.StreamClosedError, socket.error,
+                tornado.gen.TimeoutError) as ex:
+            self.close()
+            self.failures += 1
+            backoff = min(self.node.interval * 2 ** self.failures,
+                          MAX_BACKOFF)
+            self.retry_at = time.time() + backoff
+            logging.warning('federation node %s:%d unreachable, retrying '
+                            'in %ds: %s', self.address[0], self.address[1],
+                            backoff, ex)
+        finally:
+            self.sending = False
+
+    async def connect(self):
+        """Connect to the node, and queue the snapshot of this node.
+        """
+        node = self.node
+        stream = await node.client.connect(*self.address,
+                                           timeout=node.timeout)
+        stream.set_nodelay(True)
+        self.stream = stream
+        logging.info('federated with node %s:%d', *self.address)
+        self.frames = deque(node.encode(node.snapshot()))
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        self.frames.clear()
+
+
+class FederationServer(tornado.tcpserver.TCPServer):
+    """Receives the batches of the other nodes and merges them.
+    """
+
+    def __init__(self, node):
+        tornado.tcpserver.TCPServer.__init__(self)
+        self.node = node
+
+    async def handle_stream(self, stream, address):
+        node = self.node
+        trailer = DIGEST_SIZE if node.secret else 0
+        try:
+            while True:
+                length, = _length.unpack(await stream.read_bytes(4))
+                if length > MAX_SIZE:
+                    raise BTFailure('batch larger than %d bytes' % MAX_SIZE)
+                data = await stream.read_bytes(length + trailer)
+                node_id, changes = node.decode(data[:length], data[length:])
+                node.merge(node_id, changes)
+        except tornado.iostream.StreamClosedError:
+            pass
+        except BTFailure as ex:
+            logging.warning('federation batch from %s rejected: %s',
+                            address[0], ex)
+            stream.close()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+#
+# Logging pipeline for Pytt.
+#
+# The handlers only put log records on a bounded queue, a listener thread
+# formats them and writes them to the log file, so a slow disk never
+# stalls the IOLoop. Records are formatted by the listener, not by the
+# thread logging them, and are dropped, and counted, if the queue is full.
+#
+# Under load the access log would write a line per announce: only one
+# request in `access_sample` of every handler is logged, before anything
+# is formatted. Warnings and errors are throttled by call site: the
+# first one is logged, the ones that follow within `error_interval`
+# seconds are only counted and reported along with the next one logged.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+import logging
+import logging.handlers
+import os
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .metrics import LOG_DROPPED, LOG_SUPPRESSED
+
+access_log = logging.getLogger('tornado.access')
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queues the records as they are, dropping them if the queue is
+    full.
+    """
+
+    def prepare(self, record):
+        # formatted by the listener's thread, not the caller's.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+class ThrottlingFilter(logging.Filter):
+    """Lets through one warning or error per call site every `interval`
+    seconds, counting the others.
+    """
+
+    def __init__(self, interval=60.0):
+        logging.Filter.__init__(self)
+        self.interval = interval
+        # (pathname, lineno): [time of the last record let through,
+        #                      records suppressed since]
+        self.sites = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or self.interval <= 0:
+            return True
+        site = (record.pathname, record.lineno)
+        with self.lock:
+            state = self.sites.get(site)
+            if state is None:
+                self.sites[site] = [record.created, 0]
+                return True
+            if record.created - state[0] < self.interval:
+                state[1] += 1
+                LOG_SUPPRESSED.inc()
+                return False
+            suppressed = state[1]
+            state[0], state[1] = record.created, 0
+        if suppressed:
+            record.msg = '%s (%d similar messages suppressed)' % (
+                record.getMessage(), suppressed)
+            record.args = None
+        return True
+
+
+class AccessSampler(object):
+    """The `log_function` of the tracker application: logs one request
+    in `sample` of every handler, and every error.
+    """
+
+    def __init__(self, sample=1):
+        self.sample = sample
+        self.counts = {}
+
+    def __call__(self, handler):
+        status = handler.get_status()
+        if status < 400:
+            name = handler.__class__.__name__
+            count = self.counts.get(name, 0) + 1
+            if count < self.sample:
+                self.counts[name] = count
+                return
+            self.counts[name] = 0
+            log_method = access_log.info
+        elif status < 500:
+            log_method = access_log.warning
+        else:
+            log_method = access_log.error
+        log_method('%d %s %.2fms', status, handler._request_summary(),
+                   1000.0 * handler.request.request_time())
+
+
+class LogPipeline(object):
+    """A DroppingQueueHandler on the root logger, and the QueueListener
+    writing its records to the given handlers.
+
+    A forked process gets a queue and a listener thread of its own.
+    """
+
+    def __init__(self, handlers, queue_size=10000, error_interval=60.0):
+        self.handlers = handlers
+        self.queue_size = queue_size
+        self.handler = DroppingQueueHandler(queue.Queue(queue_size))
+        self.handler.addFilter(ThrottlingFilter(error_interval))
+        self.listener = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.restart)
+
+    def start(self):
+        self.listener = logging.handlers.QueueListener(
+            self.handler.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def restart(self):
+        # the listener thread didn't survive the fork.
+        if self.listener is not None:
+            self.handler.queue = queue.Queue(self.queue_size)
+            self.start()
+
+    def stop(self):
+        """Write the records still queued and stop the listener.
+        """
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+            for handler in self.handlers:
+                handler.flush()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+#
+# Metrics of the Pytt tracker.
+#
+# Counters and histograms are plain objects updated in place from the
+# request path: a histogram has a fixed list of buckets, so recording a
+# value is a bisect and an increment, with nothing allocated. Gauges are
+# functions evaluated when the metrics are collected. `/metrics` serves
+# them in the Prometheus text exposition format and the stats page at `/`
+# renders the same samples.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+from bisect import bisect_left
+from collections import OrderedDict
+import time
+
+
+# Latency buckets, in seconds.
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# The clock of the latency measurements.
+clock = time.perf_counter
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, value)
+                             for name, value in labels)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+class Counter(object):
+    """A value that only goes up.
+    """
+    kind = 'counter'
+    __slots__ = ['labels', 'value']
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name):
+        yield name, self.labels, self.value
+
+
+class Gauge(object):
+    """A value read from a function when the metrics are collected.
+    """
+    kind = 'gauge'
+    __slots__ = ['labels', 'read']
+
+    def __init__(self, labels, read):
+        self.labels = labels
+        self.read = read
+
+    def samples(self, name):
+        yield name, self.labels, self.read()
+
+
+class Histogram(object):
+    """Counts of observed values in fixed buckets, with their sum.
+    """
+    kind = 'histogram'
+    __slots__ = ['labels', 'bounds', 'counts', 'sum']
+
+    def __init__(self, labels, bounds=LATENCY_BUCKETS):
+        self.labels = labels
+        self.bounds = bounds
+        # the last bucket is +Inf.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile.
+        """
+        total = self.count
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self, name):
+        seen = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            seen += count
+            yield (name + '_bucket', self.labels + (('le', bound),), seen)
+        yield name + '_sum', self.labels, self.sum
+        yield name + '_count', self.labels, seen
+
+
+class MetricsRegistry(object):
+    """The metrics of the tracker, grouped by name.
+
+    Every metric of a name has its own fixed labels, so a request only
+    ever updates a metric it already holds.
+    """
+
+    def __init__(self):
+        self.families = OrderedDict()
+
+    def register(self, name, help, metric):
+        kind, _, metrics = self.families.setdefault(
+            name, (metric.kind, help, []))
+        if kind != metric.kind:
+            raise ValueError('%s is a %s' % (name, kind))
+        metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, **labels):
+        return self.register(name, help, Counter(tuple(sorted(
+            labels.items()))))
+
+    def gauge(self, name, help, read, **labels):
+        return self.register(name, help, Gauge(tuple(sorted(
+            labels.items())), read))
+
+    def histogram(self, name, help, bounds=LATENCY_BUCKETS, **labels):
+        return self.register(name, help, Histogram(tuple(sorted(
+            labels.items())), bounds))
+
+    def collect(self):
+        """Yield (name, kind, help, samples) for every metric family,
+        samples being (name, labels, value) tuples.
+        """
+        for name, (kind, help, metrics) in self.families.items():
+            samples = []
+            for metric in metrics:
+                samples.extend(metric.samples(name))
+            yield name, kind, help, samples
+
+    def exposition(self):
+        """The metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for name, kind, help, samples in self.collect():
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for sample, labels, value in samples:
+                labels = tuple((label, format_value(v) if label == 'le'
+                                else v) for label, v in labels)
+                lines.append('%s%s %s' % (sample, format_labels(labels),
+                                          format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+# Requests served, and their latency, by handler.
+HANDLERS = ('announce', 'scrape', 'stats', 'metrics', 'udp')
+REQUESTS = dict((handler, registry.counter(
+    'pytt_requests_total', 'Requests served.', handler=handler))
+    for handler in HANDLERS)
+ERRORS = dict((handler, registry.counter(
+    'pytt_request_errors_total', 'Requests answered with an error.',
+    handler=handler)) for handler in HANDLERS)
+LATENCY = dict((handler, registry.histogram(
+    'pytt_request_duration_seconds', 'Time to serve a request.',
+    handler=handler)) for handler in HANDLERS)
+
+# Time spent in each stage of an announce.
+STAGES = ('validate', 'store_peer_info', 'get_peer_list', 'bencode')
+STAGE_LATENCY = dict((stage, registry.histogram(
+    'pytt_announce_stage_duration_seconds',
+    'Time spent in a stage of an announce.', stage=stage))
+    for stage in STAGES)
+
+# Announces turned down by the rate limiter, by limit.
+RATE_LIMITED = dict((limit, registry.counter(
+    'pytt_rate_limited_total', 'Announces turned down by the rate limiter.',
+    limit=limit)) for limit in ('ip', 'peer'))
+
+# Announces for torrents missing from the whitelist.
+UNREGISTERED = registry.counter(
+    'pytt_unregistered_torrent_total',
+    'Announces for torrents missing from the whitelist.')
+
+# Log records lost to a full queue, and warnings and errors throttled.
+LOG_DROPPED = registry.counter(
+    'pytt_log_dropped_total', 'Log records dropped, the queue being full.')
+LOG_SUPPRESSED = registry.counter(
+    'pytt_log_suppressed_total',
+    'Warnings and errors not logged, a similar one was logged recently.')
+
+# Peer changes exchanged with the other nodes of a federation: sent,
+# merged, or ignored being older than the last change merged.
+FEDERATION_CHANGES = dict((kind, registry.counter(
+    'pytt_federation_changes_total',
+    'Peer changes exchanged with the other nodes, by kind.', kind=kind))
+    for kind in ('sent', 'merged', 'stale'))
+
+# The background storage writer.
+STORAGE_WRITES = registry.counter(
+    'pytt_storage_writes_total', 'Peer changes written to the storage.')
+STORAGE_COALESCED = registry.counter(
+    'pytt_storage_coalesced_total',
+    'Peer changes replaced by a later one before being written.')
+STORAGE_BATCH_LATENCY = registry.histogram(
+    'pytt_storage_batch_duration_seconds',
+    'Time to write a batch of peer changes.')
+STORAGE_BACKPRESSURE = dict((action, registry.counter(
+    'pytt_storage_backpressure_total',
+    'Announces held back by a full storage queue, by action.',
+    action=action)) for action in ('wait', 'drop'))
+
+
+def summary():
+    """Rows of (metric, labels, value) summing up every metric, for the
+    stats page: histograms are shown as their count, mean, median and
+    99th percentile.
+    """
+    rows = []
+    for name, (kind, help, metrics) in registry.families.items():
+        for metric in metrics:
+            labels = ', '.join('%s=%s' % label for label in metric.labels)
+            if kind == 'histogram':
+                count = metric.count
+                mean = metric.sum / count if count else 0.0
+                value = 'count %d, mean %.6fs, p50 <= %ss, p99 <= %ss' % (
+                    count, mean, format_value(metric.quantile(0.5)),
+                    format_value(metric.quantile(0.99)))
+            else:
+                _, _, value = next(metric.samples(name))
+                value = format_value(value)
+            rows.append((name, labels, value))
+    return rows
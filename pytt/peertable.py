@@ -0,0 +1,489 @@
+#!/usr/bin/env python
+#
+# Columnar peer table for Pytt.
+#
+# A Peer object, with its strings and its compact address, takes a few
+# hundred bytes. The TableRegistry keeps every peer of the tracker in a
+# single PeerTable instead: one row per peer, held in parallel columns,
+# the packed IP, the port, the status, the last-seen time, the byte
+# counts and the 20-byte peer_id in a fixed-width buffer. The rows of the
+# peers that left go on a free-list and are reused by the next ones. A
+# swarm only keeps a dict of its peer_ids to their rows, and the packed
+# compact addresses of its peers, so announces still cost the same
+# whatever the size of the swarm.
+#
+# The columns are array.array and bytearray buffers, about 70 bytes a
+# row. With the peer_id to row dicts of the swarms, a peer takes about
+# 200 bytes, half the memory of a Peer object: 10M peers take 2 GB.
+#
+# The rows are filed by their last-seen time, in buckets of a heap
+# ordered by time, so the expired ones are found without scanning the
+# table. A row announced since it was filed is only filed again when its
+# bucket comes due, the cost of a pass is bound by the rows filed at the
+# cutoff or before like the Reaper's heap.
+#
+# Peers are handed out as PeerRow views, with the attributes of a Peer,
+# so the selectors and the statistics work with either registry.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+from array import array
+import heapq
+import itertools
+import socket
+import time
+
+from .swarm import (COMPACT_WIDTH, COMPLETED, STARTED, SwarmRegistry, _port,
+                    _versions, pack_address)
+
+
+# Peer tables, the `peer_table` option: Peer objects or columns.
+OBJECTS = 'objects'
+COLUMNS = 'columns'
+TABLES = (OBJECTS, COLUMNS)
+
+PEER_ID_WIDTH = 20
+IP_WIDTH = 16
+
+# Status of a row, and the family of a free row.
+STATUSES = (STARTED, COMPLETED)
+STATUS_CODES = dict((status, code) for code, status in enumerate(STATUSES))
+FREE = 0
+
+# `filed_at` of a row in no bucket.
+UNFILED = 2 ** 32 - 1
+
+
+class PeerTable(object):
+    """Every peer of the tracker, one row per peer in parallel columns.
+
+    A row is taken from the free-list, or appended to the columns when
+    the free-list is empty. Free rows have the family FREE.
+
+    Every row in use is filed in the bucket of its last-seen time, once:
+    `filed_at` is the time of the bucket holding it. Entries of a bucket
+    whose row was filed elsewhere since are stale, and skipped.
+    """
+
+    def __init__(self):
+        self.peer_ids = bytearray()
+        self.ips = bytearray()
+        self.families = array('B')
+        self.ports = array('H')
+        self.statuses = array('B')
+        self.last_seen = array('I')
+        self.uploaded = array('Q')
+        self.downloaded = array('Q')
+        # the number of the row's swarm, and the row's slot in its RowList.
+        self.swarms = array('I')
+        self.slots = array('I')
+        self.filed_at = array('I')
+        self.free = array('I')
+        # time: rows filed, and the heap of their times.
+        self.buckets = {}
+        self.due = []
+        # entries in the buckets, stale ones included.
+        self.entries = 0
+        # peer_ids other than 20 bytes, by row.
+        self.odd_ids = {}
+
+    def __len__(self):
+        return len(self.ports) - len(self.free)
+
+    def allocate(self, swarm, peer_id, ip, port, status, now=None):
+        """Store a peer in a free row. Returns the row.
+        """
+        compact = pack_address(ip, port)
+        packed_ip = compact[:-2]
+        if self.free:
+            row = self.free.pop()
+        else:
+            row = len(self.ports)
+            self.peer_ids += bytes(PEER_ID_WIDTH)
+            self.ips += bytes(IP_WIDTH)
+            for column in (self.families, self.ports, self.statuses,
+                           self.last_seen, self.uploaded, self.downloaded,
+                           self.swarms, self.slots):
+                column.append(0)
+            self.filed_at.append(UNFILED)
+        self.odd_ids.pop(row, None)
+        if isinstance(peer_id, bytes) and len(peer_id) == PEER_ID_WIDTH:
+            self.peer_ids[row * PEER_ID_WIDTH:
+                          (row + 1) * PEER_ID_WIDTH] = peer_id
+        else:
+            self.odd_ids[row] = peer_id
+        self.ips[row * IP_WIDTH:row * IP_WIDTH + len(packed_ip)] = packed_ip
+        self.families[row] = 4 if len(packed_ip) == 4 else 6
+        self.ports[row] = int(port)
+        self.statuses[row] = STATUS_CODES[status]
+        self.last_seen[row] = int(time.time() if now is None else now)
+        self.uploaded[row] = self.downloaded[row] = 0
+        self.swarms[row] = swarm
+        if self.filed_at[row] != self.last_seen[row]:
+            self.file(row, self.last_seen[row])
+        return row
+
+    def release(self, row):
+        """Put a row back on the free-list. Its columns stay readable
+        until the row is reused.
+        """
+        self.families[row] = FREE
+        self.free.append(row)
+
+    def move(self, row, ip, port):
+        """Change the address of the peer in a row.
+        """
+        compact = pack_address(ip, port)
+        packed_ip = compact[:-2]
+        self.ips[row * IP_WIDTH:row * IP_WIDTH + len(packed_ip)] = packed_ip
+        self.families[row] = 4 if len(packed_ip) == 4 else 6
+        self.ports[row] = int(port)
+
+    def peer_id(self, row):
+        peer_id = self.odd_ids.get(row)
+        if peer_id is None:
+            peer_id = bytes(self.peer_ids[row * PEER_ID_WIDTH:
+                                         (row + 1) * PEER_ID_WIDTH])
+        return peer_id
+
+    def ip(self, row):
+        start = row * IP_WIDTH
+        if self.families[row] == 4:
+            return socket.inet_ntoa(self.ips[start:start + 4])
+        return socket.inet_ntop(socket.AF_INET6,
+                                self.ips[start:start + IP_WIDTH])
+
+    def record(self, row):
+        """The (ip, port, status) tuple kept by the storage engines, the
+        port as text like a Peer's.
+        """
+        return (self.ip(row), str(self.ports[row]),
+                STATUSES[self.statuses[row]])
+
+    def packed_ip(self, row):
+        start = row * IP_WIDTH
+        return bytes(self.ips[start:start + (4 if self.families[row] == 4
+                                             else IP_WIDTH)])
+
+    def compact(self, row):
+        """The packed address of the peer, as in compact peer lists.
+        """
+        return self.packed_ip(row) + _port.pack(self.ports[row])
+
+    def file(self, row, when):
+        """File a row in the bucket of the time `when`.
+        """
+        bucket = self.buckets.get(when)
+        if bucket is None:
+            bucket = self.buckets[when] = array('I')
+            heapq.heappush(self.due, when)
+        bucket.append(row)
+        self.filed_at[row] = when
+        self.entries += 1
+
+    def expired(self, cutoff):
+        """The rows in use last seen at cutoff or before. They are taken
+        out of the buckets, and must be released.
+        """
+        expired = []
+        due, buckets = self.due, self.buckets
+        filed_at, last_seen = self.filed_at, self.last_seen
+        while due and due[0] <= cutoff:
+            when = heapq.heappop(due)
+            bucket = buckets.pop(when)
+            self.entries -= len(bucket)
+            for row in bucket:
+                if filed_at[row] != when:
+                    continue
+                filed_at[row] = UNFILED
+                if self.families[row] == FREE:
+                    continue
+                seen = last_seen[row]
+                if seen <= cutoff:
+                    expired.append(row)
+                else:
+                    # announced since, filed again in a later bucket.
+                    self.file(row, seen)
+        return expired
+
+
+class PeerRow(object):
+    """A view of a row of a PeerTable, with the attributes of a Peer.
+    """
+    __slots__ = ['table', 'row']
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __eq__(self, other):
+        return isinstance(other, PeerRow) and \
+            self.table is other.table and self.row == other.row
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self.row
+
+    @property
+    def peer_id(self):
+        return self.table.peer_id(self.row)
+
+    @property
+    def ip(self):
+        return self.table.ip(self.row)
+
+    @property
+    def port(self):
+        return str(self.table.ports[self.row])
+
+    @property
+    def status(self):
+        return STATUSES[self.table.statuses[self.row]]
+
+    @property
+    def compact(self):
+        return self.table.compact(self.row)
+
+    @property
+    def slot(self):
+        return self.table.slots[self.row]
+
+    @property
+    def family(self):
+        return self.table.families[self.row]
+
+    @property
+    def is_seeder(self):
+        return self.table.statuses[self.row] == STATUS_CODES[COMPLETED]
+
+    @property
+    def record(self):
+        return self.table.record(self.row)
+
+    def _get_last_seen(self):
+        return self.table.last_seen[self.row]
+
+    def _set_last_seen(self, value):
+        self.table.last_seen[self.row] = int(value)
+
+    last_seen = property(_get_last_seen, _set_last_seen)
+
+    def _get_uploaded(self):
+        return self.table.uploaded[self.row]
+
+    def _set_uploaded(self, value):
+        self.table.uploaded[self.row] = value
+
+    uploaded = property(_get_uploaded, _set_uploaded)
+
+    def _get_downloaded(self):
+        return self.table.downloaded[self.row]
+
+    def _set_downloaded(self, value):
+        self.table.downloaded[self.row] = value
+
+    downloaded = property(_get_downloaded, _set_downloaded)
+
+    def __repr__(self):
+        return 'PeerRow(%r, %r, %r, %r)' % (self.peer_id, self.ip,
+                                            self.port, self.status)
+
+
+class Rows(object):
+    """The PeerRows of a RowList, by slot.
+    """
+    __slots__ = ['group']
+
+    def __init__(self, group):
+        self.group = group
+
+    def __len__(self):
+        return len(self.group.rows)
+
+    def __getitem__(self, index):
+        table = self.group.table
+        if isinstance(index, slice):
+            return [PeerRow(table, row) for row in self.group.rows[index]]
+        return PeerRow(table, self.group.rows[index])
+
+
+class RowList(object):
+    """The PeerList of a TableSwarm: rows of the same address family and
+    status, with their compact addresses packed side by side.
+
+    Like in a PeerList, a removed row is replaced by the last one, and
+    the slot of every row is kept in the table's `slots` column.
+    """
+    __slots__ = ['table', 'width', 'rows', 'packed']
+
+    def __init__(self, table, width):
+        self.table = table
+        self.width = width
+        self.rows = array('I')
+        self.packed = bytearray()
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def peers(self):
+        return Rows(self)
+
+    def add(self, row):
+        self.table.slots[row] = len(self.rows)
+        self.rows.append(row)
+        self.packed += self.table.compact(row)
+
+    def remove(self, row):
+        slot, width = self.table.slots[row], self.width
+        last = self.rows.pop()
+        if last != row:
+            self.rows[slot] = last
+            self.table.slots[last] = slot
+            self.packed[slot * width:(slot + 1) * width] = \
+                self.packed[-width:]
+        del self.packed[-width:]
+
+    def repack(self, row):
+        """Refresh the packed address of a row that moved.
+        """
+        slot, width = self.table.slots[row], self.width
+        self.packed[slot * width:(slot + 1) * width] = self.table.compact(row)
+
+
+class TableSwarm(object):
+    """All the peers sharing a single torrent, as rows of a PeerTable.
+
+    The counters, the groups and the version behave like a Swarm's.
+    """
+    __slots__ = ['info_hash', 'number', 'table', 'peers', 'seeders',
+                 'leechers', 'groups', 'version']
+
+    def __init__(self, info_hash, table, number):
+        self.info_hash = info_hash
+        self.table = table
+        self.number = number
+        # peer_id: row
+        self.peers = {}
+        self.seeders = 0
+        self.leechers = 0
+        self.version = next(_versions)
+        self.groups = dict(((family, seeder), RowList(table, width))
+                           for family, width in COMPACT_WIDTH.items()
+                           for seeder in (True, False))
+
+    def __len__(self):
+        return len(self.peers)
+
+    def __contains__(self, peer_id):
+        return peer_id in self.peers
+
+    def __iter__(self):
+        table = self.table
+        return (PeerRow(table, row) for row in self.peers.values())
+
+    def _group(self, row):
+        table = self.table
+        return self.groups[(table.families[row], table.statuses[row] ==
+                            STATUS_CODES[COMPLETED])]
+
+    def _add(self, row):
+        self.version = next(_versions)
+        if self.table.statuses[row] == STATUS_CODES[COMPLETED]:
+            self.seeders += 1
+        else:
+            self.leechers += 1
+        self._group(row).add(row)
+
+    def _remove(self, row):
+        self.version = next(_versions)
+        if self.table.statuses[row] == STATUS_CODES[COMPLETED]:
+            self.seeders -= 1
+        else:
+            self.leechers -= 1
+        self._group(row).remove(row)
+
+    def get(self, peer_id):
+        """Get the PeerRow with this peer_id or None.
+        """
+        row = self.peers.get(peer_id)
+        return PeerRow(self.table, row) if row is not None else None
+
+    def upsert(self, peer_id, ip, port, status, now=None):
+        """Add the peer or update its row in place. Returns the PeerRow.
+        """
+        table = self.table
+        row = self.peers.get(peer_id)
+        if row is None:
+            row = table.allocate(self.number, peer_id, ip, port, status, now)
+            self.peers[peer_id] = row
+            self._add(row)
+            return PeerRow(table, row)
+        table.last_seen[row] = int(time.time() if now is None else now)
+        code = STATUS_CODES[status]
+        compact = pack_address(ip, port)
+        if compact == table.compact(row):
+            if code != table.statuses[row]:
+                self._remove(row)
+                table.statuses[row] = code
+                self._add(row)
+            return PeerRow(table, row)
+        self._remove(row)
+        table.move(row, ip, port)
+        table.statuses[row] = code
+        self._add(row)
+        return PeerRow(table, row)
+
+    def remove(self, peer_id):
+        """Remove the peer and free its row. Returns the PeerRow of the
+        freed row or None.
+        """
+        row = self.peers.pop(peer_id, None)
+        if row is None:
+            return None
+        self._remove(row)
+        self.table.release(row)
+        return PeerRow(self.table, row)
+
+
+class TableRegistry(SwarmRegistry):
+    """A SwarmRegistry keeping all its peers in a single PeerTable.
+    """
+
+    def __init__(self):
+        SwarmRegistry.__init__(self)
+        self.table = PeerTable()
+        self.numbers = itertools.count()
+        # swarm number: info_hash, to find the swarm of a row.
+        self.info_hashes = {}
+
+    def new_swarm(self, info_hash):
+        number = next(self.numbers)
+        self.info_hashes[number] = info_hash
+        return TableSwarm(info_hash, self.table, number)
+
+    def remove(self, info_hash, peer_id):
+        swarm = self.swarms.get(info_hash)
+        peer = SwarmRegistry.remove(self, info_hash, peer_id)
+        if swarm is not None and info_hash not in self.swarms:
+            del self.info_hashes[swarm.number]
+        return peer
+
+    def expired(self, cutoff):
+        """The (info_hash, peer_id) of the peers last seen at cutoff or
+        before.
+        """
+        table = self.table
+        return [(self.info_hashes[table.swarms[row]], table.peer_id(row))
+                for row in table.expired(cutoff)]
+
+
+def make_registry(peer_table=OBJECTS):
+    """A SwarmRegistry of Peer objects or a TableRegistry.
+    """
+    if peer_table not in TABLES:
+        raise ValueError('Unknown peer table %r' % peer_table)
+    return TableRegistry() if peer_table == COLUMNS else SwarmRegistry()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+#
+# Write-behind persistence for Pytt.
+#
+# The swarms live in memory; the journal engine only appends every change
+# to a buffered journal file. The journal is flushed on every sync and
+# fsynced by a background thread, so the IOLoop never waits for the disk.
+# A crash loses at most the changes of the last `sync_interval` seconds.
+#
+# Journals are numbered. Every `snapshot_interval` seconds the journal is
+# rotated and a background thread folds the previous snapshot and the
+# journals written since into a new compact binary snapshot, reading
+# files that are no longer written to, so it shares nothing with the
+# IOLoop. On startup the state is rebuilt from the latest snapshot plus
+# the journals that follow it.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import logging
+import os
+import struct
+import time
+
+from .storage import (StorageEngine, OP_PUT, OP_DELETE, _pack_fields,
+                      _read_log, raw_info_hash)
+
+
+SNAPSHOT_MAGIC = b'PYTTSNAP\x01'
+SNAPSHOT_END = b'PYTTEND'
+JOURNAL_BUFFER_SIZE = 1024 * 1024
+
+STATUSES = ['started', 'completed', 'stopped']
+STATUS_CODES = dict((status, code) for code, status in enumerate(STATUSES))
+
+# info_hash length, peer_id length, ip length, port, status.
+_snapshot_record = struct.Struct('>HHBHB')
+_snapshot_count = struct.Struct('>Q')
+
+
+def write_snapshot(path, state):
+    """Write the {(info_hash, peer_id): record} state to a snapshot file,
+    atomically replacing any previous one.
+    """
+    tmp_path = path + '.tmp'
+    pack = _snapshot_record.pack
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        for (info_hash, peer_id), (ip, port, status) in state.items():
+            ip = ip.encode('utf-8')
+            f.write(pack(len(info_hash), len(peer_id), len(ip), int(port),
+                         STATUS_CODES[status]) + info_hash + peer_id + ip)
+        f.write(SNAPSHOT_END + _snapshot_count.pack(len(state)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
+def read_snapshot(path):
+    """Read a snapshot back as a {(info_hash, peer_id): record} dict.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(SNAPSHOT_MAGIC):
+        raise ValueError('%s is not a Pytt snapshot' % path)
+    end = len(data) - len(SNAPSHOT_END) - _snapshot_count.size
+    if data[end:end + len(SNAPSHOT_END)] != SNAPSHOT_END:
+        raise ValueError('%s is truncated' % path)
+    state = {}
+    unpack = _snapshot_record.unpack_from
+    size = _snapshot_record.size
+    pos = len(SNAPSHOT_MAGIC)
+    while pos < end:
+        ih_len, pid_len, ip_len, port, status = unpack(data, pos)
+        pos += size
+        info_hash = raw_info_hash(data[pos:pos + ih_len])
+        pos += ih_len
+        peer_id = data[pos:pos + pid_len]
+        pos += pid_len
+        ip = data[pos:pos + ip_len].decode('utf-8')
+        pos += ip_len
+        state[(info_hash, peer_id)] = (ip, str(port), STATUSES[status])
+    (count,) = _snapshot_count.unpack_from(data, end + len(SNAPSHOT_END))
+    if count != len(state):
+        raise ValueError('%s is corrupted' % path)
+    return state
+
+
+def replay_journal(path, state):
+    """Apply the changes of a journal to the state dict.
+    """
+    for op, key, record in _read_log(path):
+        if op == OP_PUT:
+            state[key] = record
+        else:
+            state.pop(key, None)
+
+
+class JournalEngine(StorageEngine):
+    """Write-behind journal with periodic snapshots.
+    """
+    name = 'journal'
+
+    def __init__(self, path, snapshot_interval=300):
+        self.base = path
+        self.snapshot_interval = snapshot_interval
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending_fsync = None
+        self.pending_snapshot = None
+        self.last_snapshot = time.time()
+        self.generation = max([0] + self.generations('journal') +
+                              self.generations('snapshot')) + 1
+        self.journal = self.open_journal(self.generation)
+
+    def file(self, kind, generation):
+        return '%s.%s.%d' % (self.base, kind, generation)
+
+    def generations(self, kind):
+        """Numbers of the existing snapshot or journal files, in order.
+        """
+        prefix = '%s.%s.' % (self.base, kind)
+        numbers = []
+        for path in glob.glob(prefix + '*'):
+            suffix = path[len(prefix):]
+            if suffix.isdigit():
+                numbers.append(int(suffix))
+        return sorted(numbers)
+
+    def open_journal(self, generation):
+        return open(self.file('journal', generation), 'ab',
+                    JOURNAL_BUFFER_SIZE)
+
+    def rebuild(self, upto):
+        """The state from the latest snapshot and the journals following
+        it, up to the journal `upto` excluded.
+        """
+        state = {}
+        snapshots = [n for n in self.generations('snapshot') if n < upto]
+        start = 0
+        for generation in reversed(snapshots):
+            try:
+                state = read_snapshot(self.file('snapshot', generation))
+                start = generation
+                break
+            except (IOError, ValueError) as ex:
+                logging.warning('skipping snapshot: %s', ex)
+        for generation in self.generations('journal'):
+            if start <= generation < upto:
+                replay_journal(self.file('journal', generation), state)
+        return state, start
+
+    def load(self):
+        started = time.time()
+        state, _ = self.rebuild(self.generation)
+        logging.info('rebuilt %d peers from the journal in %.2fs',
+                     len(state), time.time() - started)
+        for (info_hash, peer_id), record in state.items():
+            yield info_hash, peer_id, record
+
+    def put(self, info_hash, peer_id, record):
+        self.journal.write(_pack_fields(OP_PUT, (info_hash, peer_id) +
+                                        tuple(record)))
+
+    def delete(self, info_hash, peer_id):
+        self.journal.write(_pack_fields(OP_DELETE, (info_hash, peer_id)))
+
+    def sync(self):
+        """Flush the journal and have it fsynced in the background. Takes
+        a snapshot every snapshot_interval seconds.
+        """
+        self.journal.flush()
+        if self.pending_fsync is None or self.pending_fsync.done():
+            self.pending_fsync = self.executor.submit(
+                os.fsync, self.journal.fileno())
+        if time.time() - self.last_snapshot >= self.snapshot_interval and \
+                (self.pending_snapshot is None or
+                 self.pending_snapshot.done()):
+            self.snapshot()
+
+    def snapshot(self):
+        """Rotate the journal and fold the closed journals into a new
+        snapshot on the background thread.
+        """
+        self.last_snapshot = time.time()
+        old = self.journal
+        self.generation += 1
+        self.journal = self.open_journal(self.generation)
+        old.flush()
+        self.executor.submit(self.close_journal, old)
+        self.pending_snapshot = self.executor.submit(self.write_snapshot,
+                                                     self.generation)
+
+    def close_journal(self, journal):
+        os.fsync(journal.fileno())
+        journal.close()
+
+    def write_snapshot(self, generation):
+        """Write snapshot `generation`, holding everything written before
+        the journal of the same number, and drop the files it replaces.
+        """
+        started = time.time()
+        state, start = self.rebuild(generation)
+        write_snapshot(self.file('snapshot', generation), state)
+        for kind in ('snapshot', 'journal'):
+            for number in self.generations(kind):
+                if number < generation:
+                    os.remove(self.file(kind, number))
+        logging.info('snapshot of %d peers written in %.2fs',
+                     len(state), time.time() - started)
+
+    def close(self):
+        self.journal.flush()
+        self.executor.shutdown(wait=True)
+        os.fsync(self.journal.fileno())
+        self.journal.close()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#
+# Query string parsing for the announce and scrape requests.
+#
+# Announces are by far the most frequent requests of a tracker. Instead
+# of going through RequestHandler.get_argument for every parameter, the
+# raw query string is split once: info_hash and peer_id are unquoted
+# straight to their 20 raw bytes, which are the keys of the swarms, and
+# the numeric fields are checked in the same pass.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+try:
+    from urllib.parse import unquote_plus, unquote_to_bytes
+except ImportError:
+    from urllib import unquote as unquote_to_bytes, unquote_plus
+
+from .utils import (DEFAULT_ALLOWED_PEERS, GENERIC_ERROR, INFO_HASH_LEN,
+                    INVALID_INFO_HASH, INVALID_NUMWANT, INVALID_PEER_ID,
+                    INVALID_PORT, MAX_ALLOWED_PEERS, MISSING_INFO_HASH,
+                    MISSING_PEER_ID, MISSING_PORT, PEER_ID_LEN)
+
+
+# The events a peer can announce. `empty` and any unknown event are
+# handled as a regular announce.
+EVENTS = ('started', 'completed', 'stopped')
+
+# The unsigned integer fields of an announce.
+INTEGERS = ('port', 'uploaded', 'downloaded', 'left', 'compact',
+            'no_peer_id', 'numwant')
+
+# Largest value of those, the byte counters are 64-bit like BEP 15's.
+MAX_INTEGER = 2 ** 64 - 1
+
+
+class QueryError(Exception):
+    """Raised for an invalid request, with the Pytt error code.
+    """
+
+    def __init__(self, code):
+        super(QueryError, self).__init__(code)
+        self.code = code
+
+
+class AnnounceRequest(object):
+    """The parameters of an announce.
+    """
+    __slots__ = ['info_hash', 'peer_id', 'port', 'uploaded', 'downloaded',
+                 'left', 'compact', 'no_peer_id', 'numwant', 'event',
+                 'trackerid']
+
+    def __init__(self):
+        self.info_hash = None
+        self.peer_id = None
+        self.port = None
+        self.uploaded = 0
+        self.downloaded = 0
+        self.left = None
+        self.compact = 0
+        self.no_peer_id = 0
+        self.numwant = DEFAULT_ALLOWED_PEERS
+        self.event = ''
+        self.trackerid = ''
+
+
+def unquote_bytes(value):
+    """A percent-encoded query value as raw bytes.
+    """
+    if '+' in value:
+        value = value.replace('+', ' ')
+    return unquote_to_bytes(value)
+
+
+def parse_announce(query):
+    """Parse the query string of an announce into an AnnounceRequest.
+    Raises QueryError if a parameter is missing or invalid.
+    """
+    request = AnnounceRequest()
+    for field in query.split('&'):
+        name, _, value = field.partition('=')
+        if name == 'info_hash':
+            request.info_hash = unquote_bytes(value)
+        elif name == 'peer_id':
+            request.peer_id = unquote_bytes(value)
+        elif name in INTEGERS:
+            try:
+                number = int(value)
+            except ValueError:
+                number = -1
+            if not 0 <= number <= MAX_INTEGER:
+                raise QueryError(INVALID_PORT if name == 'port'
+                                 else GENERIC_ERROR)
+            setattr(request, name, number)
+        elif name == 'event':
+            request.event = value if value in EVENTS else ''
+        elif name == 'trackerid':
+            request.trackerid = unquote_plus(value)
+
+    if not request.info_hash:
+        raise QueryError(MISSING_INFO_HASH)
+    if not request.peer_id:
+        raise QueryError(MISSING_PEER_ID)
+    if request.port is None:
+        raise QueryError(MISSING_PORT)
+    if len(request.info_hash) != INFO_HASH_LEN:
+        raise QueryError(INVALID_INFO_HASH)
+    if len(request.peer_id) != PEER_ID_LEN:
+        raise QueryError(INVALID_PEER_ID)
+    if not 0 < request.port < 65536:
+        raise QueryError(INVALID_PORT)
+    if request.numwant > MAX_ALLOWED_PEERS:
+        # XXX: cannot request more than MAX_ALLOWED_PEERS.
+        raise QueryError(INVALID_NUMWANT)
+    return request
+
+
+def parse_scrape(query):
+    """The raw info_hashes of a scrape query string, or None if it has
+    no info_hash parameter. The ones of the wrong length are ignored, so
+    the list is empty if none of them is valid.
+    """
+    info_hashes = None
+    for field in query.split('&'):
+        name, _, value = field.partition('=')
+        if name == 'info_hash':
+            if info_hashes is None:
+                info_hashes = []
+            info_hash = unquote_bytes(value)
+            if len(info_hash) == INFO_HASH_LEN:
+                info_hashes.append(info_hash)
+    return info_hashes
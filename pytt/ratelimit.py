@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+# Announce rate limiting for Pytt.
+#
+# Every client IP and every peer of a swarm gets a token bucket. A peer
+# earns one token per `min_interval` seconds, so announcing more often
+# than the interval the tracker advertises runs out of tokens; an IP is
+# allowed `ip_rate` announces per second, for all its peers together.
+#
+# Buckets are kept in LRU order, which is also the order they expire in:
+# a bucket left alone long enough to refill completely is the same as no
+# bucket, so a periodic cleanup drops them from the old end in bulk and
+# the LRU cap bounds the memory in between.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+from collections import OrderedDict
+import time
+
+
+class TokenBuckets(object):
+    """Token buckets filling up at `rate` tokens/s up to `burst`, by key.
+    """
+
+    def __init__(self, rate, burst, max_entries=100000):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_entries = max_entries
+        # key: [tokens, last update], least recently used first.
+        self.buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def allow(self, key, now=None):
+        """Take a token from the bucket of key. False if it is empty.
+        """
+        if now is None:
+            now = time.time()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            self.buckets[key] = [self.burst - 1, now]
+            if len(self.buckets) > self.max_entries:
+                self.buckets.popitem(last=False)
+            return True
+        self.buckets.move_to_end(key)
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    def cleanup(self, now=None):
+        """Drop the buckets that refilled completely. Returns how many.
+        """
+        if now is None:
+            now = time.time()
+        expired = now - self.burst / self.rate
+        dropped = 0
+        buckets = self.buckets
+        while buckets:
+            key, (_, updated) = next(iter(buckets.items()))
+            if updated > expired:
+                break
+            del buckets[key]
+            dropped += 1
+        return dropped
+
+
+class AnnounceLimiter(object):
+    """Limits the announces of every IP and every peer of a swarm.
+
+    `check()` tells whether an announce is allowed. `completed` and
+    `stopped` announces are never turned down by the per-peer limit, so
+    the swarm counts stay right.
+    """
+    # the result of check().
+    ALLOWED = None
+    IP_LIMITED = 'ip'
+    PEER_LIMITED = 'peer'
+
+    def __init__(self, min_interval, ip_rate=20, ip_burst=100,
+                 peer_burst=2, max_entries=100000):
+        self.ips = TokenBuckets(ip_rate, ip_burst, max_entries)
+        self.peers = TokenBuckets(1.0 / max(min_interval, 1), peer_burst,
+                                  max_entries)
+
+    def check(self, ip, info_hash, peer_id, event='', now=None):
+        if now is None:
+            now = time.time()
+        if not self.ips.allow(ip, now):
+            return self.IP_LIMITED
+        if event in ('completed', 'stopped'):
+            return self.ALLOWED
+        if not self.peers.allow((info_hash, peer_id), now):
+            return self.PEER_LIMITED
+        return self.ALLOWED
+
+    def cleanup(self, now=None):
+        return self.ips.cleanup(now) + self.peers.cleanup(now)
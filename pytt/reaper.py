@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#
+# Expiry of peers that stopped announcing.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+import heapq
+import itertools
+import logging
+import time
+
+import tornado.ioloop
+
+
+class Reaper(object):
+    """Evicts the peers not seen for `timeout` seconds.
+
+    Every peer has a single entry in a heap ordered by its expiry time.
+    A pass only pops the entries that are due: a peer announced since is
+    pushed back with its new expiry, the others are evicted. The cost of
+    a pass is bound by the number of due peers, never the swarm sizes.
+    """
+
+    def __init__(self, registry, timeout, evict):
+        self.registry = registry
+        self.timeout = timeout
+        self.evict = evict
+        self.heap = []
+        self.counter = itertools.count()
+        self.callback = None
+        # statistics
+        self.passes = 0
+        self.evicted = 0
+        self.last_evicted = 0
+        self.last_duration = 0.0
+        self.total_duration = 0.0
+        self.watch(registry)
+
+    def watch(self, registry):
+        """Schedule the expiry of the peers of the registry, and of every
+        peer joining it.
+        """
+        registry.on_add.append(self.schedule)
+        for swarm in registry:
+            for peer in swarm:
+                self.schedule(swarm.info_hash, peer)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def schedule(self, info_hash, peer):
+        """Schedule the expiry of a newly added peer.
+        """
+        heapq.heappush(self.heap, (peer.last_seen + self.timeout,
+                                   next(self.counter), info_hash, peer))
+
+    def reap(self, now=None):
+        """Evict the expired peers. Returns how many were evicted.
+        """
+        start = time.time()
+        evicted = self.sweep(start if now is None else now)
+        self.passes += 1
+        self.evicted += evicted
+        self.last_evicted = evicted
+        self.last_duration = time.time() - start
+        self.total_duration += self.last_duration
+        if evicted:
+            logging.info('reaper evicted %d peers in %.3fs',
+                         evicted, self.last_duration)
+        return evicted
+
+    def sweep(self, now):
+        """Evict the peers expired at `now`. Returns how many were
+        evicted.
+        """
+        heap = self.heap
+        evicted = 0
+        while heap and heap[0][0] <= now:
+            _, _, info_hash, peer = heapq.heappop(heap)
+            swarm = self.registry.get(info_hash)
+            if swarm is None or swarm.get(peer.peer_id) is not peer:
+                # already gone, or replaced by a new Peer with its own entry.
+                continue
+            expires = peer.last_seen + self.timeout
+            if expires > now:
+                heapq.heappush(heap, (expires, next(self.counter),
+                                      info_hash, peer))
+            else:
+                self.evict(info_hash, peer.peer_id)
+                evicted += 1
+        return evicted
+
+    def start(self, interval):
+        """Run a pass every `interval` seconds on the IOLoop.
+        """
+        self.callback = tornado.ioloop.PeriodicCallback(self.reap,
+                                                        interval * 1000)
+        self.callback.start()
+
+    def stop(self):
+        if self.callback is not None:
+            self.callback.stop()
+            self.callback = None
+
+
+class TableReaper(Reaper):
+    """A Reaper for a TableRegistry, which has no Peer objects to keep in
+    a heap: its peer table files the rows by last-seen time instead, and
+    a pass only takes the rows filed at the cutoff or before.
+    """
+
+    def watch(self, registry):
+        pass
+
+    def __len__(self):
+        return self.registry.table.entries
+
+    def sweep(self, now):
+        expired = self.registry.expired(now - self.timeout)
+        for info_hash, peer_id in expired:
+            self.evict(info_hash, peer_id)
+        return len(expired)
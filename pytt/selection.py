@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+#
+# Peer selection for announce responses.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+import random
+
+
+# Sampling strategies.
+WINDOW = 'window'
+RANDOM = 'random'
+STRATEGIES = (WINDOW, RANDOM)
+
+# How many candidates are drawn for every wanted peer when same-subnet
+# peers are preferred.
+SUBNET_CANDIDATES = 4
+
+
+def split(numwant, sizes):
+    """Share numwant between groups of the given sizes, in proportion to
+    their size.
+    """
+    total = sum(sizes)
+    if total <= numwant:
+        return list(sizes)
+    shares = [numwant * size // total for size in sizes]
+    left = numwant - sum(shares)
+    for i in sorted(range(len(sizes)), key=sizes.__getitem__, reverse=True):
+        extra = min(left, sizes[i] - shares[i])
+        shares[i] += extra
+        left -= extra
+    return shares
+
+
+def window(group, n):
+    """n consecutive slots of the group starting at random, as a list of
+    (start, stop) ranges: the window wraps around the end of the list.
+    """
+    count = len(group)
+    if n >= count:
+        return [(0, count)]
+    start = random.randrange(count)
+    stop = start + n
+    if stop <= count:
+        return [(start, stop)]
+    return [(start, count), (0, stop - count)]
+
+
+def sample(group, n):
+    """n distinct slots of the group picked uniformly, as 1-slot ranges.
+    """
+    count = len(group)
+    if n >= count:
+        return [(0, count)]
+    return [(slot, slot + 1) for slot in random.sample(range(count), n)]
+
+
+def subnet(peer):
+    """The /24 (IPv4) or /64 (IPv6) network of a peer.
+    """
+    return peer.compact[:3] if peer.family == 4 else peer.compact[:8]
+
+
+class Selection(object):
+    """Peers picked from a swarm, as (group, start, stop) slot ranges of
+    its PeerLists so compact responses are plain buffer slices.
+    """
+    __slots__ = ['ranges']
+
+    def __init__(self, ranges):
+        self.ranges = ranges
+
+    def __len__(self):
+        return sum(stop - start for _, start, stop in self.ranges)
+
+    def compact(self):
+        """The packed addresses of the selected peers, sliced from views
+        of the buffers and copied once by the join.
+        """
+        views = [memoryview(group.packed)[start * group.width:
+                                          stop * group.width]
+                 for group, start, stop in self.ranges]
+        try:
+            return b''.join(views)
+        finally:
+            # a buffer can't be resized while a view of it is alive.
+            for view in views:
+                view.release()
+
+    def peers(self):
+        """The selected Peer objects.
+        """
+        peers = []
+        for group, start, stop in self.ranges:
+            peers.extend(group.peers[start:stop])
+        return peers
+
+
+class PeerSelector(object):
+    """Picks the peers returned to an announcing peer.
+
+    `strategy` is either `window`, a contiguous run of peers starting at
+    random (a single slice per group, the cheapest), or `random`, a
+    uniform sample without replacement in O(numwant). With
+    `complementary`, seeders only get leechers and leechers get seeders
+    first, topped up with other leechers. With `prefer_subnet`, peers of
+    the requester's /24 or /64 come first among a few extra candidates.
+    The requesting peer is never part of its own list.
+    """
+
+    def __init__(self, strategy=WINDOW, complementary=False,
+                 prefer_subnet=False):
+        if strategy not in STRATEGIES:
+            raise ValueError('Unknown peer selection strategy %r' % strategy)
+        self.pick = window if strategy == WINDOW else sample
+        self.complementary = complementary
+        self.prefer_subnet = prefer_subnet
+
+    def groups(self, swarm, family, seeder):
+        """The PeerLists to pick from, most wanted first.
+        """
+        seeds = swarm.groups[(family, True)]
+        leeches = swarm.groups[(family, False)]
+        if not self.complementary:
+            return [[seeds, leeches]]
+        if seeder:
+            return [[leeches]]
+        return [[seeds], [leeches]]
+
+    def draw(self, groups, n, requester):
+        """Pick n slot ranges from groups, skipping the requester.
+        """
+        own = None
+        if requester is not None and requester.slot is not None:
+            own = next((group for group in groups
+                        if requester.slot < len(group) and
+                        group.peers[requester.slot] == requester), None)
+        wanted = n + 1 if own is not None else n
+        ranges = []
+        shares = split(wanted, [len(group) for group in groups])
+        for group, share in zip(groups, shares):
+            if not share:
+                continue
+            for start, stop in self.pick(group, share):
+                if group is own and start <= requester.slot < stop:
+                    ranges.append((group, start, requester.slot))
+                    ranges.append((group, requester.slot + 1, stop))
+                else:
+                    ranges.append((group, start, stop))
+        return trim([r for r in ranges if r[2] > r[1]], n)
+
+    def select(self, swarm, numwant, family=4, requester=None, left=None,
+               event=''):
+        """Select up to numwant peers of the address family for the
+        requesting Peer, given the `left` and `event` it announced.
+        """
+        seeder = event == 'completed' or left == 0
+        want = numwant
+        if self.prefer_subnet and requester is not None:
+            want = numwant * SUBNET_CANDIDATES
+        ranges = []
+        for groups in self.groups(swarm, family, seeder):
+            missing = want - sum(stop - start for _, start, stop in ranges)
+            if missing <= 0:
+                break
+            ranges.extend(self.draw(groups, missing, requester))
+        if want != numwant:
+            ranges = self.by_subnet(ranges, requester, numwant)
+        return Selection(ranges)
+
+    def by_subnet(self, ranges, requester, numwant):
+        """Keep numwant of the candidates, same-subnet peers first.
+        """
+        net = subnet(requester)
+        candidates = []
+        for group, start, stop in ranges:
+            for slot in range(start, stop):
+                candidates.append((subnet(group.peers[slot]) != net,
+                                   group, slot))
+        candidates.sort(key=lambda candidate: candidate[0])
+        return [(group, slot, slot + 1)
+                for _, group, slot in candidates[:numwant]]
+
+
+def trim(ranges, n):
+    """Cut the ranges down to n slots in total.
+    """
+    trimmed = []
+    for group, start, stop in ranges:
+        if n <= 0:
+            break
+        stop = min(stop, start + n)
+        trimmed.append((group, start, stop))
+        n -= stop - start
+    return trimmed
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+#
+# Typed configuration snapshots for Pytt.
+#
+# pytt.conf is parsed once into a Settings: a namedtuple of sections, each
+# a namedtuple of its options already converted to their types, so the
+# request handlers read `settings.tracker.interval` instead of going
+# through RawConfigParser. The response fields that only depend on the
+# config are bencoded along with it.
+#
+# A Settings is never modified. Reloading the config builds a new one and
+# swaps it in with a single assignment, so a request always sees one
+# consistent snapshot, the old one or the new one.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+from collections import namedtuple
+
+try:
+    from configparser import Error as ParserError, RawConfigParser
+except ImportError:
+    from ConfigParser import Error as ParserError, RawConfigParser
+
+from .bencode import bencode
+
+
+# Failure reason of the announces for torrents missing from the whitelist.
+NOT_REGISTERED = 'Requested download is not authorized for use with ' \
+    'this tracker.'
+
+
+class ConfigError(Exception):
+    """Raised when config error occurs.
+    """
+
+
+def to_bool(value):
+    """Convert a config value such as yes/no or 1/0 to a bool.
+    """
+    return value.strip().lower() in ('1', 'yes', 'true', 'on')
+
+
+def to_addresses(value):
+    """Convert a comma separated list of host:port, [IPv6]:port for IPv6
+    hosts, to a tuple of (host, port) pairs.
+    """
+    addresses = []
+    for address in value.split(','):
+        address = address.strip()
+        if not address:
+            continue
+        host, sep, port = address.rpartition(':')
+        if not sep or not host:
+            raise ValueError('no port in %r' % address)
+        addresses.append((host.strip('[]'), int(port)))
+    return tuple(addresses)
+
+
+# The options of every section, with their type and their value when the
+# config doesn't set them.
+SCHEMA = [
+    ('tracker', [
+        ('port', int, 8080),
+        ('udp_port', int, 0),
+        ('workers', int, 1),
+        ('shard_port', int, 18080),
+        ('interval', int, 5),
+        ('min_interval', int, 1),
+        ('reap_factor', int, 3),
+        ('peer_selection', str, 'window'),
+        ('complementary_peers', to_bool, False),
+        ('prefer_subnet', to_bool, False),
+        ('uvloop', to_bool, True),
+        ('peer_table', str, 'objects'),
+        ('config_check_interval', int, 10),
+    ]),
+    ('storage', [
+        ('engine', str, 'journal'),
+        ('sync_interval', int, 5),
+        ('snapshot_interval', int, 300),
+        ('write_behind', to_bool, True),
+        ('queue_size', int, 100000),
+        ('flush_interval', float, 0.5),
+    ]),
+    ('cache', [
+        ('max_bytes', int, 16 * 1024 * 1024),
+    ]),
+    ('stats', [
+        ('sample_interval', int, 60),
+        ('history', int, 1440),
+    ]),
+    ('whitelist', [
+        ('enabled', to_bool, False),
+        ('torrent_dir', str, ''),
+        ('hash_list', str, ''),
+        ('reload_interval', int, 60),
+    ]),
+    ('logging', [
+        ('access_sample', int, 1000),
+        ('error_interval', float, 60.0),
+        ('queue_size', int, 10000),
+    ]),
+    ('federation', [
+        ('enabled', to_bool, False),
+        ('node_id', str, ''),
+        ('address', str, ''),
+        ('port', int, 18180),
+        ('nodes', to_addresses, ()),
+        ('interval', float, 5.0),
+        ('batch_size', int, 10000),
+        ('secret', str, ''),
+    ]),
+    ('ratelimit', [
+        ('enabled', to_bool, True),
+        ('ip_rate', float, 20.0),
+        ('ip_burst', float, 100.0),
+        ('peer_burst', float, 2.0),
+        ('max_entries', int, 100000),
+        ('cleanup_interval', int, 60),
+    ]),
+]
+
+SECTIONS = dict((section, namedtuple(section.capitalize() + 'Settings',
+                                     [name for name, _, _ in options]))
+                for section, options in SCHEMA)
+
+# The bencoded response fields that only depend on the config.
+Responses = namedtuple('Responses', ['intervals', 'ip_limited',
+                                     'peer_limited', 'not_registered'])
+
+Settings = namedtuple('Settings',
+                      [section for section, _ in SCHEMA] + ['responses'])
+
+
+def encode_responses(tracker):
+    """Bencode the static parts of the responses.
+    """
+    return Responses(
+        # Interval in seconds that the client should wait between sending
+        #    regular requests to the tracker, and the minimum announce
+        #    interval. Sorted after complete and incomplete, so they go
+        #    right after them in an announce response.
+        intervals=bencode({'interval': tracker.interval,
+                           'min interval': tracker.min_interval})[1:-1],
+        ip_limited=bencode({'failure reason':
+                            'Too many announces, slow down',
+                            'interval': tracker.interval,
+                            'min interval': tracker.min_interval}),
+        peer_limited=bencode({'interval': tracker.interval,
+                              'min interval': tracker.min_interval,
+                              'peers': b'',
+                              'warning message':
+                              'Announced before min interval'}),
+        not_registered=bencode({'failure reason': NOT_REGISTERED}))
+
+
+def parse_settings(config):
+    """Build the Settings of a RawConfigParser. Raises ConfigError for an
+    option of the wrong type.
+    """
+    sections = {}
+    for section, options in SCHEMA:
+        values = []
+        for name, convert, default in options:
+            if not config.has_option(section, name):
+                values.append(default)
+                continue
+            value = config.get(section, name)
+            try:
+                values.append(convert(value))
+            except ValueError:
+                raise ConfigError('Invalid %s.%s: %r' % (section, name,
+                                                         value))
+        sections[section] = SECTIONS[section](*values)
+    return Settings(responses=encode_responses(sections['tracker']),
+                    **sections)
+
+
+def load_settings(path):
+    """Read the config at path. Returns the (RawConfigParser, Settings)
+    pair, raises ConfigError if it is missing or invalid.
+    """
+    config = RawConfigParser()
+    try:
+        if config.read(path) == []:
+            raise ConfigError('No config at %s' % path)
+    except ParserError as ex:
+        raise ConfigError('Invalid config at %s: %s' % (path, ex))
+    return config, parse_settings(config)
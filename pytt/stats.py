@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# Swarm statistics for Pytt.
+#
+# The totals a tracker reports are kept up to date as the announces come
+# in, each announce costing a couple of additions: how many times every
+# torrent was completed, the bytes its peers transferred, and a history
+# of the active peers sampled at a fixed interval. Nothing is ever
+# recomputed by walking the swarms.
+#
+# Clients report the bytes they uploaded and downloaded since they
+# started, so every peer remembers its last report and only the
+# difference is added to the totals. A report lower than the previous
+# one means the client restarted, and is counted as a whole.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+from collections import deque
+import time
+
+
+class TorrentStats(object):
+    """The running totals of a single torrent.
+    """
+    __slots__ = ['completed', 'uploaded', 'downloaded']
+
+    def __init__(self):
+        self.completed = 0
+        self.uploaded = 0
+        self.downloaded = 0
+
+
+def transferred(previous, reported):
+    """The bytes transferred since the previous report of a peer.
+    """
+    if reported >= previous:
+        return reported - previous
+    return reported
+
+
+class SwarmStatistics(object):
+    """Totals of every torrent and of the whole tracker, with a history
+    of the number of active peers.
+
+    Torrents only get an entry once they have something to count. Once
+    their swarm is gone, only the ones completed keep it: the times
+    completed are reported by the scrapes for as long as the tracker
+    runs, the bytes transferred are still in the tracker totals.
+    """
+
+    def __init__(self, history=1440):
+        self.torrents = {}
+        self.completed = 0
+        self.uploaded = 0
+        self.downloaded = 0
+        # (time, seeders, leechers) samples, the oldest first.
+        self.history = deque(maxlen=history)
+
+    def __len__(self):
+        return len(self.torrents)
+
+    def get(self, info_hash):
+        """Get the totals of a torrent or None.
+        """
+        return self.torrents.get(info_hash)
+
+    def torrent(self, info_hash):
+        stats = self.torrents.get(info_hash)
+        if stats is None:
+            stats = self.torrents[info_hash] = TorrentStats()
+        return stats
+
+    def times_completed(self, info_hash):
+        stats = self.torrents.get(info_hash)
+        return stats.completed if stats is not None else 0
+
+    def forget(self, info_hash):
+        """Drop the totals of a torrent whose swarm is gone, unless it
+        was ever completed.
+        """
+        stats = self.torrents.get(info_hash)
+        if stats is not None and not stats.completed:
+            del self.torrents[info_hash]
+
+    def complete(self, info_hash):
+        """Count a download completed.
+        """
+        self.torrent(info_hash).completed += 1
+        self.completed += 1
+
+    def transfer(self, info_hash, peer, uploaded, downloaded):
+        """Count the bytes a peer transferred since its previous report.
+        """
+        up = transferred(peer.uploaded, uploaded)
+        down = transferred(peer.downloaded, downloaded)
+        peer.uploaded = uploaded
+        peer.downloaded = downloaded
+        if up or down:
+            stats = self.torrent(info_hash)
+            stats.uploaded += up
+            stats.downloaded += down
+            self.uploaded += up
+            self.downloaded += down
+
+    def sample(self, seeders, leechers, now=None):
+        """Record the number of active peers.
+        """
+        self.history.append((time.time() if now is None else now,
+                             seeders, leechers))
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+#
+# Storage engines for Pytt.
+#
+# The swarm registry lives in memory; a storage engine only has to persist
+# individual peer records and hand them back on startup. Pick one with the
+# `engine` option of the `[storage]` section in pytt.conf:
+#
+#   memory  Nothing is persisted. Fastest, loses every swarm on restart.
+#   shelve  The original Pytt database. Rewrites the whole peer dict of a
+#           torrent on every change, so writes cost O(swarm size). Only
+#           kept to read existing databases.
+#   sqlite  SQLite in WAL mode. Writes are grouped into transactions of
+#           `batch_size` rows, committed on every sync. A crash loses at
+#           most the uncommitted batch. Tens of thousands of writes/s.
+#   log     Append-only log of peer changes, compacted on sync once it
+#           grows past twice the live data. Writes are buffered appends
+#           (hundreds of thousands/s); the log is fsynced on every sync,
+#           so a crash loses at most one `sync_interval` of changes.
+#   journal Write-behind journal fsynced off the IOLoop, folded into
+#           compact binary snapshots by a background thread every
+#           `snapshot_interval` seconds. See persistence.py.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+import binascii
+import os
+import shelve
+import sqlite3
+import struct
+
+
+class StorageError(Exception):
+    """Raised when a storage engine can't be used.
+    """
+
+
+def raw_info_hash(info_hash):
+    """A raw 20-byte info_hash, from the hex ones of older databases.
+    """
+    if len(info_hash) == 40:
+        return binascii.unhexlify(info_hash)
+    return info_hash
+
+
+def raw_peer_id(peer_id):
+    """A peer_id as bytes, from the text ones of older databases.
+    """
+    if isinstance(peer_id, bytes):
+        return peer_id
+    return peer_id.encode('utf-8')
+
+
+class StorageEngine(object):
+    """Interface implemented by all the storage engines.
+
+    Peers are keyed by their raw info_hash and peer_id bytes, a peer
+    record is the tuple (ip, port, status).
+    """
+    name = None
+
+    def load(self):
+        """Yield (info_hash, peer_id, record) for every stored peer.
+        """
+        raise NotImplementedError
+
+    def put(self, info_hash, peer_id, record):
+        """Insert or replace a peer record.
+        """
+        raise NotImplementedError
+
+    def delete(self, info_hash, peer_id):
+        """Delete a peer record if it exists.
+        """
+        raise NotImplementedError
+
+    def sync(self):
+        """Make the pending changes durable.
+        """
+
+    def close(self):
+        """Sync and release the underlying resources.
+        """
+        self.sync()
+
+
+class MemoryEngine(StorageEngine):
+    """Keeps nothing beyond the in-memory registry.
+    """
+    name = 'memory'
+
+    def __init__(self, path=None):
+        pass
+
+    def load(self):
+        return iter(())
+
+    def put(self, info_hash, peer_id, record):
+        pass
+
+    def delete(self, info_hash, peer_id):
+        pass
+
+
+class ShelveEngine(StorageEngine):
+    """The legacy shelve database, one peer dict per info_hash.
+    """
+    name = 'shelve'
+
+    def __init__(self, path):
+        self.db = shelve.open(path)
+
+    def load(self):
+        for key in list(self.db.keys()):
+            peers = self.db[key]
+            if isinstance(peers, list):
+                # older databases keep a list of (peer_id, ip, port, status).
+                peers = dict((p[0], tuple(p[1:])) for p in peers)
+            if any(not isinstance(peer_id, bytes) for peer_id in peers):
+                # and text peer_ids.
+                peers = dict((raw_peer_id(peer_id), record)
+                             for peer_id, record in peers.items())
+                self.db[key] = peers
+            info_hash = binascii.unhexlify(key)
+            for peer_id, record in peers.items():
+                yield info_hash, peer_id, tuple(record)
+
+    def put(self, info_hash, peer_id, record):
+        # shelve keys are text.
+        key = binascii.hexlify(info_hash).decode('ascii')
+        peers = self.db.get(key, {})
+        peers[peer_id] = record
+        self.db[key] = peers
+
+    def delete(self, info_hash, peer_id):
+        key = binascii.hexlify(info_hash).decode('ascii')
+        peers = self.db.get(key)
+        if peers is None or peer_id not in peers:
+            return
+        del peers[peer_id]
+        if peers:
+            self.db[key] = peers
+        else:
+            del self.db[key]
+
+    def sync(self):
+        self.db.sync()
+
+    def close(self):
+        self.db.close()
+
+
+class SQLiteEngine(StorageEngine):
+    """SQLite in WAL mode with batched transactions.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path, batch_size=1000):
+        self.batch_size = batch_size
+        self.pending = 0
+        # used by the storage writer thread once loaded.
+        self.conn = sqlite3.connect(path + '.sqlite',
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS peers ('
+                          'info_hash BLOB NOT NULL, peer_id BLOB NOT NULL, '
+                          'ip TEXT, port TEXT, status TEXT, '
+                          'PRIMARY KEY (info_hash, peer_id)) WITHOUT ROWID')
+        self.migrate()
+        self.conn.commit()
+
+    def migrate(self):
+        """Convert the hex info_hashes and text peer_ids of older
+        databases to raw bytes.
+        """
+        legacy = self.conn.execute(
+            "SELECT info_hash, peer_id, ip, port, status FROM peers "
+            "WHERE typeof(info_hash) = 'text' OR typeof(peer_id) = 'text'"
+            ).fetchall()
+        for info_hash, peer_id, ip, port, status in legacy:
+            self.conn.execute('DELETE FROM peers WHERE info_hash=? AND '
+                              'peer_id=?', (info_hash, peer_id))
+            self.conn.execute(
+                'INSERT OR REPLACE INTO peers VALUES (?,?,?,?,?)',
+                (raw_info_hash(info_hash), raw_peer_id(peer_id), ip, port,
+                 status))
+
+    def _written(self):
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.sync()
+
+    def load(self):
+        cursor = self.conn.execute('SELECT info_hash, peer_id, ip, port, '
+                                   'status FROM peers')
+        for info_hash, peer_id, ip, port, status in cursor:
+            yield info_hash, peer_id, (ip, port, status)
+
+    def put(self, info_hash, peer_id, record):
+        self.conn.execute('INSERT OR REPLACE INTO peers VALUES (?,?,?,?,?)',
+                          (info_hash, peer_id) + tuple(record))
+        self._written()
+
+    def delete(self, info_hash, peer_id):
+        self.conn.execute('DELETE FROM peers WHERE info_hash=? AND '
+                          'peer_id=?', (info_hash, peer_id))
+        self._written()
+
+    def sync(self):
+        if self.pending:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        self.sync()
+        self.conn.close()
+
+
+# Log record: op, then every field as a 2-byte length and utf-8 bytes.
+OP_PUT = b'P'
+OP_DELETE = b'D'
+_field_len = struct.Struct('>H')
+
+
+def _pack_fields(op, fields):
+    chunks = [op]
+    for field in fields:
+        if not isinstance(field, bytes):
+            data = str(field).encode('utf-8')
+        else:
+            data = field
+        chunks.append(_field_len.pack(len(data)))
+        chunks.append(data)
+    return b''.join(chunks)
+
+
+def _read_log(path):
+    """Yield (op, key, record) for every complete record of the log, the
+    key being the (info_hash, peer_id) bytes and the record None for a
+    deletion.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    pos, end = 0, len(data)
+    while pos < end:
+        op = data[pos:pos + 1]
+        nfields = 5 if op == OP_PUT else 2
+        pos += 1
+        fields = []
+        for _ in range(nfields):
+            if pos + 2 > end:
+                return
+            (size,) = _field_len.unpack_from(data, pos)
+            pos += 2
+            if pos + size > end:
+                # torn write at the tail, drop it.
+                return
+            fields.append(data[pos:pos + size])
+            pos += size
+        key = (raw_info_hash(fields[0]), fields[1])
+        if op == OP_PUT:
+            yield op, key, tuple(field.decode('utf-8')
+                                 for field in fields[2:])
+        else:
+            yield op, key, None
+
+
+class LogEngine(StorageEngine):
+    """Append-only log of peer changes with periodic compaction.
+    """
+    name = 'log'
+
+    def __init__(self, path, compact_min=10000):
+        self.path = path + '.log'
+        self.compact_min = compact_min
+        self.state = {}
+        self.records = 0
+        if os.path.exists(self.path):
+            for op, key, record in _read_log(self.path):
+                self.records += 1
+                if op == OP_PUT:
+                    self.state[key] = record
+                else:
+                    self.state.pop(key, None)
+        self.log = open(self.path, 'ab')
+
+    def load(self):
+        for (info_hash, peer_id), record in list(self.state.items()):
+            yield info_hash, peer_id, record
+
+    def put(self, info_hash, peer_id, record):
+        self.state[(info_hash, peer_id)] = record
+        self.log.write(_pack_fields(OP_PUT, (info_hash, peer_id) + record))
+        self.records += 1
+
+    def delete(self, info_hash, peer_id):
+        if self.state.pop((info_hash, peer_id), None) is None:
+            return
+        self.log.write(_pack_fields(OP_DELETE, (info_hash, peer_id)))
+        self.records += 1
+
+    def sync(self):
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        if self.records > max(self.compact_min, 2 * len(self.state)):
+            self.compact()
+
+    def compact(self):
+        """Rewrite the log with only the live records.
+        """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for (info_hash, peer_id), record in self.state.items():
+                f.write(_pack_fields(OP_PUT, (info_hash, peer_id) + record))
+            f.flush()
+            os.fsync(f.fileno())
+        self.log.close()
+        os.rename(tmp_path, self.path)
+        self.log = open(self.path, 'ab')
+        self.records = len(self.state)
+
+    def close(self):
+        self.sync()
+        self.log.close()
+
+
+ENGINES = dict((engine.name, engine) for engine in
+               [MemoryEngine, ShelveEngine, SQLiteEngine, LogEngine])
+
+
+def open_engine(name, path, **options):
+    """Open the storage engine called `name` at `path`.
+    """
+    try:
+        engine = ENGINES[name]
+    except KeyError:
+        raise StorageError('Unknown storage engine %r' % name)
+    return engine(path, **options)
+
+
+# the write-behind engine lives in its own module.
+from .persistence import JournalEngine  # noqa: E402
+ENGINES[JournalEngine.name] = JournalEngine
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+#
+# In-memory swarm registry for Pytt.
+#
+# Every torrent tracked by Pytt has a Swarm, which indexes its peers by
+# peer_id so that an announce costs the same whether the swarm holds ten
+# peers or a hundred thousand.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+import itertools
+import socket
+import struct
+import time
+
+
+# Peer status values, as sent in the `event` announce parameter.
+STARTED = 'started'
+COMPLETED = 'completed'
+STOPPED = 'stopped'
+
+# Bytes taken by a packed address of each IP version: the IP and port.
+COMPACT_WIDTH = {4: 6, 6: 18}
+
+_port = struct.Struct('>H')
+
+# Swarm versions are drawn from a single counter, so a swarm recreated
+# after it emptied never reuses the version of its predecessor.
+_versions = itertools.count(1)
+
+
+def unmap(ip):
+    """The IPv4 address of an IPv4-mapped IPv6 address (::ffff:a.b.c.d),
+    as dual-stack sockets report IPv4 clients. Any other ip is returned
+    unchanged.
+    """
+    if ip[:7].lower() == '::ffff:' and '.' in ip:
+        return ip[7:]
+    return ip
+
+
+def family_of(ip):
+    """4 or 6, the IP version of an address.
+    """
+    return 6 if ':' in unmap(ip) else 4
+
+
+def pack_address(ip, port):
+    """Pack an address the way compact peer lists carry it: the IP in
+    network byte order followed by the 2-byte port. IPv4 addresses take
+    6 bytes and IPv6 addresses 18 bytes.
+    """
+    try:
+        packed_ip = socket.inet_aton(ip) if ':' not in ip else None
+    except socket.error:
+        packed_ip = None
+    if packed_ip is None:
+        packed_ip = socket.inet_pton(socket.AF_INET6, ip)
+    return packed_ip + _port.pack(int(port))
+
+
+class Peer(object):
+    """A single peer of a swarm.
+    """
+    __slots__ = ['peer_id', 'ip', 'port', 'status', 'last_seen',
+                 'compact', 'slot', 'uploaded', 'downloaded']
+
+    def __init__(self, peer_id, ip, port, status, last_seen=None):
+        self.peer_id = peer_id
+        self.ip = ip
+        self.port = port
+        self.status = status
+        self.last_seen = time.time() if last_seen is None else last_seen
+        self.compact = pack_address(ip, port)
+        self.slot = None
+        # the byte counts of the peer's last announce.
+        self.uploaded = 0
+        self.downloaded = 0
+
+    @property
+    def is_seeder(self):
+        return self.status == COMPLETED
+
+    @property
+    def family(self):
+        """4 or 6, the IP version of the peer's address.
+        """
+        return 4 if len(self.compact) == COMPACT_WIDTH[4] else 6
+
+    @property
+    def record(self):
+        """The (ip, port, status) tuple kept by the storage engines.
+        """
+        return (self.ip, self.port, self.status)
+
+    def __repr__(self):
+        return 'Peer(%r, %r, %r, %r)' % (self.peer_id, self.ip,
+                                         self.port, self.status)
+
+
+class PeerList(object):
+    """Peers of the same address family and status, with their compact
+    addresses packed side by side in a bytearray.
+
+    Peer n of the list occupies bytes [n * width, (n + 1) * width) of the
+    buffer. A removed peer is replaced by the last one, so every change
+    only moves a single entry and compact responses are plain slices.
+    """
+    __slots__ = ['width', 'peers', 'packed']
+
+    def __init__(self, width):
+        self.width = width
+        self.peers = []
+        self.packed = bytearray()
+
+    def __len__(self):
+        return len(self.peers)
+
+    def add(self, peer):
+        peer.slot = len(self.peers)
+        self.peers.append(peer)
+        self.packed += peer.compact
+
+    def remove(self, peer):
+        slot, width = peer.slot, self.width
+        last = self.peers.pop()
+        if last is not peer:
+            self.peers[slot] = last
+            last.slot = slot
+            self.packed[slot * width:(slot + 1) * width] = last.compact
+        del self.packed[-width:]
+        peer.slot = None
+
+    def repack(self, peer):
+        """Refresh the packed address of a peer that moved.
+        """
+        width = self.width
+        self.packed[peer.slot * width:(peer.slot + 1) * width] = peer.compact
+
+
+class Swarm(object):
+    """All the peers sharing a single torrent.
+
+    Peers are keyed by peer_id, and the seeder and leecher counters are
+    kept up to date on every change so they never need a scan. Each
+    combination of address family and seeder status has its own PeerList.
+    `version` changes on every mutation of the swarm, so anything derived
+    from its state can be cached until the version moves.
+    """
+    __slots__ = ['info_hash', 'peers', 'seeders', 'leechers', 'groups',
+                 'version']
+
+    def __init__(self, info_hash):
+        self.info_hash = info_hash
+        self.peers = {}
+        self.seeders = 0
+        self.leechers = 0
+        self.version = next(_versions)
+        self.groups = dict(((family, seeder), PeerList(width))
+                           for family, width in COMPACT_WIDTH.items()
+                           for seeder in (True, False))
+
+    def __len__(self):
+        return len(self.peers)
+
+    def __contains__(self, peer_id):
+        return peer_id in self.peers
+
+    def __iter__(self):
+        return iter(self.peers.values())
+
+    def _add(self, peer):
+        self.version = next(_versions)
+        if peer.is_seeder:
+            self.seeders += 1
+        else:
+            self.leechers += 1
+        self.groups[(peer.family, peer.is_seeder)].add(peer)
+
+    def _remove(self, peer):
+        self.version = next(_versions)
+        if peer.is_seeder:
+            self.seeders -= 1
+        else:
+            self.leechers -= 1
+        self.groups[(peer.family, peer.is_seeder)].remove(peer)
+
+    def get(self, peer_id):
+        """Get the peer with this peer_id or None.
+        """
+        return self.peers.get(peer_id)
+
+    def upsert(self, peer_id, ip, port, status, now=None):
+        """Add the peer or update it in place. Returns the Peer.
+        """
+        peer = self.peers.get(peer_id)
+        if peer is None:
+            peer = Peer(peer_id, ip, port, status, now)
+            self.peers[peer_id] = peer
+            self._add(peer)
+            return peer
+        peer.last_seen = time.time() if now is None else now
+        if ip == peer.ip and port == peer.port:
+            if status != peer.status:
+                self._remove(peer)
+                peer.status = status
+                self._add(peer)
+            return peer
+        compact = pack_address(ip, port)
+        if len(compact) == len(peer.compact) and status == peer.status:
+            peer.ip, peer.port, peer.compact = ip, port, compact
+            self.groups[(peer.family, peer.is_seeder)].repack(peer)
+            self.version = next(_versions)
+        else:
+            self._remove(peer)
+            peer.ip, peer.port, peer.compact = ip, port, compact
+            peer.status = status
+            self._add(peer)
+        return peer
+
+    def remove(self, peer_id):
+        """Remove the peer. Returns the removed Peer or None.
+        """
+        peer = self.peers.pop(peer_id, None)
+        if peer is not None:
+            self._remove(peer)
+        return peer
+
+
+class SwarmRegistry(object):
+    """Index of all the swarms, keyed by info_hash.
+
+    The seeders and leechers of all the swarms are counted as they
+    change, like the counters of every swarm.
+    """
+
+    def __init__(self):
+        self.swarms = {}
+        self.seeders = 0
+        self.leechers = 0
+        # called with (info_hash, peer) whenever a new peer joins.
+        self.on_add = []
+        # called with the info_hash of every swarm dropped once empty.
+        self.on_drop = []
+
+    def __len__(self):
+        return len(self.swarms)
+
+    def __contains__(self, info_hash):
+        return info_hash in self.swarms
+
+    def __iter__(self):
+        return iter(self.swarms.values())
+
+    def get(self, info_hash):
+        """Get the swarm for this info_hash or None.
+        """
+        return self.swarms.get(info_hash)
+
+    def new_swarm(self, info_hash):
+        return Swarm(info_hash)
+
+    def update(self, info_hash, peer_id, ip, port, status=None, now=None):
+        """Apply an announce to the registry.
+
+        A `stopped` peer is removed, any other status is inserted or
+        updated. A regular announce (no status) keeps the peer's status,
+        or starts a new peer. Returns the Peer, or None if it was removed.
+        """
+        if status == STOPPED:
+            self.remove(info_hash, peer_id)
+            return None
+        ip = unmap(ip)
+        swarm = self.swarms.get(info_hash)
+        if swarm is None:
+            swarm = self.swarms[info_hash] = self.new_swarm(info_hash)
+        peer = swarm.get(peer_id)
+        if status is None:
+            status = peer.status if peer is not None else STARTED
+        new = peer is None
+        seeders, leechers = swarm.seeders, swarm.leechers
+        peer = swarm.upsert(peer_id, ip, port, status, now)
+        self.seeders += swarm.seeders - seeders
+        self.leechers += swarm.leechers - leechers
+        if new:
+            for callback in self.on_add:
+                callback(info_hash, peer)
+        return peer
+
+    def remove(self, info_hash, peer_id):
+        """Remove a peer, and its swarm once it becomes empty.
+        """
+        swarm = self.swarms.get(info_hash)
+        if swarm is None:
+            return None
+        peer = swarm.remove(peer_id)
+        if peer is not None:
+            if peer.is_seeder:
+                self.seeders -= 1
+            else:
+                self.leechers -= 1
+        if not swarm.peers:
+            del self.swarms[info_hash]
+            for callback in self.on_drop:
+                callback(info_hash)
+        return peer
+
+    def no_of_peers(self):
+        """Total number of peers across all the swarms.
+        """
+        return self.seeders + self.leechers
@@ -5,145 +5,384 @@
 # @author: Sreejith K <sreejithemk@gmail.com>
 # Created on 12th May 2011
 # http://foobarnbaz.com
+import asyncio
+import binascii
+import itertools
 import logging
 from optparse import OptionParser
+import os
+import signal
 import sys
+import time
 
+import tornado.escape
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
 import tornado.web
 import tornado.httpserver
 
-from .bencode import bencode
+from .bencode import bencode, Bencached
+from .query import QueryError, parse_announce, parse_scrape
+from .logs import AccessSampler
+from .metrics import STAGE_LATENCY, clock, registry, summary
+from .reaper import Reaper, TableReaper
+from .swarm import family_of
+from .udp import UDPTracker
 from .utils import *
+from .workers import (LocalListing, REMOTE_PORT_HEADER, ShardListing, Shards,
+                      ShardUnavailable, merge_listings, scrape_files,
+                      scrape_uri)
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 
 logger = logging.getLogger('tornado.access')
 
 
+# Samples of the active peers shown on the stats page.
+HISTORY_ROWS = 60
+
+STATS_PAGE = """<!DOCTYPE html>
+<html>
+<head><title>Pytt statistics</title></head>
+<body>
+<h1>Pytt statistics</h1>
+<table>
+<tr><th>metric</th><th>labels</th><th>value</th></tr>
+%s
+</table>
+<h2>Active peers</h2>
+<table>
+<tr><th>time</th><th>seeders</th><th>leechers</th></tr>
+%s
+</table>
+</body>
+</html>
+"""
+
+
 class TrackerStats(BaseHandler):
     """Shows the Tracker statistics on this page.
     """
-    @tornado.web.asynchronous
+    metric = 'stats'
+
+    def get(self):
+        rows = '\n'.join(
+            '<tr><td>%s</td><td>%s</td><td>%s</td></tr>' % tuple(
+                tornado.escape.xhtml_escape(cell) for cell in row)
+            for row in summary())
+        # the latest samples first.
+        history = '\n'.join(
+            '<tr><td>%s</td><td>%d</td><td>%d</td></tr>' % (
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when)),
+                seeders, leechers)
+            for when, seeders, leechers in
+            itertools.islice(reversed(get_stats().history), HISTORY_ROWS))
+        self.write(STATS_PAGE % (rows, history))
+
+
+class MetricsHandler(BaseHandler):
+    """Serves the metrics in the Prometheus text exposition format.
+    """
+    metric = 'metrics'
+
     def get(self):
-        self.send_error(404)
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(registry.exposition())
 
 
 class AnnounceHandler(BaseHandler):
     """Track the torrents. Respond with the peer-list.
     """
-    @tornado.web.asynchronous
-    def get(self):
-        failure_reason = ''
-        warning_message = ''
-
-        # get all the required parameters from the HTTP request.
-        info_hash = self.get_argument('info_hash')
-        peer_id = self.get_argument('peer_id')
-        ip = self.request.remote_ip
-        port = self.get_argument('port')
-
-        # send appropirate error code.
-        if not info_hash:
-            return self.send_error(MISSING_INFO_HASH)
-        if not peer_id:
-            return self.send_error(MISSING_PEER_ID)
-        if not port:
-            return self.send_error(MISSING_PORT)
-        if len(info_hash) != INFO_HASH_LEN:
-            return self.send_error(INVALID_INFO_HASH)
-        if len(peer_id) != PEER_ID_LEN:
-            return self.send_error(INVALID_PEER_ID)
-
-        # Shelve in Python2 doesn't support unicode
-        info_hash = str(info_hash)
-
-        # get the optional parameters.
-        # FIXME: these parameters will be used in future versions
-        # uploaded = int(self.get_argument('uploaded', 0))
-        # downloaded = int(self.get_argument('downloaded', 0))
-        # left = int(self.get_argument('left', 0))
-        compact = int(self.get_argument('compact', 0))
-        no_peer_id = int(self.get_argument('no_peer_id', 0))
-        event = self.get_argument('event', '')
-        numwant = int(self.get_argument('numwant', DEFAULT_ALLOWED_PEERS))
-        if numwant > MAX_ALLOWED_PEERS:
-            # XXX: cannot request more than MAX_ALLOWED_PEERS.
-            return self.send_error(INVALID_NUMWANT)
-
-        # key = self.get_argument('key', '')
-        tracker_id = self.get_argument('trackerid', '')
-
-        # store the peer info
-        if event:
-            store_peer_info(info_hash, peer_id, ip, port, event)
+    metric = 'announce'
+
+    async def get(self):
+        started = clock()
+
+        # parse and check all the parameters in a single pass.
+        try:
+            request = parse_announce(self.request.query)
+        except QueryError as ex:
+            return self.fail(ex.code)
+        info_hash = request.info_hash
+        peer_id = request.peer_id
+        ip = self.remote_ip
+
+        # with a whitelist, unknown torrents are turned away right here.
+        unregistered = self.not_registered(info_hash)
+        if unregistered is not None:
+            self.set_header('Content-Type', 'text/plain')
+            self.write(unregistered)
+            return
+
+        # in multi-process mode, the worker owning the swarm answers.
+        if self.shards is not None and not self.shards.is_local(info_hash):
+            await self.forward(self.shards.owner(info_hash))
+            return
+
+        left = request.left
+        compact = request.compact
+        no_peer_id = request.no_peer_id
+        event = request.event
+        numwant = request.numwant
+        tracker_id = request.trackerid
+
+        # clients announcing too often only get a canned response.
+        limited = self.rate_limit(info_hash, peer_id, event)
+        if limited is not None:
+            self.set_header('Content-Type', 'text/plain')
+            self.write(limited)
+            return
+
+        now = clock()
+        STAGE_LATENCY['validate'].observe(now - started)
+        started = now
+        # store the peer info, a regular announce just keeps it alive.
+        await announce_peer(info_hash, peer_id, ip, str(request.port),
+                            event or None, request.uploaded,
+                            request.downloaded)
+        now = clock()
+        STAGE_LATENCY['store_peer_info'].observe(now - started)
+        started = now
 
         # generate response
         response = {}
-        # Interval in seconds that the client should wait between sending
-        #    regular requests to the tracker.
-        response['interval'] = get_config().getint('tracker', 'interval')
-        # Minimum announce interval. If present clients must not re-announce
-        #    more frequently than this.
-        response['min interval'] = get_config().getint('tracker',
-                                                       'min_interval')
-        # FIXME
         response['tracker id'] = tracker_id
-        response['complete'] = no_of_seeders(info_hash)
-        response['incomplete'] = no_of_leechers(info_hash)
 
-        # get the peer list for this announce
-        response['peers'] = get_peer_list(info_hash,
-                                          numwant,
-                                          compact,
-                                          no_peer_id)
-
-        # set error and warning messages for the client if any.
-        if failure_reason:
-            response['failure reason'] = failure_reason
-        if warning_message:
-            response['warning message'] = warning_message
+        # get the peer list for this announce, compact lists come as
+        # `peers` and `peers6` (BEP 7).
+        response.update(await select_peers(info_hash, numwant, compact,
+                                           no_peer_id, peer_id, left, event,
+                                           family_of(ip)))
+        now = clock()
+        STAGE_LATENCY['get_peer_list'].observe(now - started)
+        started = now
 
+        # complete, incomplete, interval and min interval come bencoded
+        # from the cache. They sort before the other keys, so the header
+        # simply goes in front of the rest of the dict.
+        header = announce_header(info_hash)
+        response = b'd' + header + bencode(response)[1:]
+        STAGE_LATENCY['bencode'].observe(clock() - started)
         # send the bencoded response as text/plain document.
         self.set_header('Content-Type', 'text/plain')
-        self.write(bencode(response))
-        self.finish()
+        self.write(response)
 
 
 class ScrapeHandler(BaseHandler):
     """Returns the state of all torrents this tracker is managing.
+
+    Without info_hash, every torrent is listed. The response is written
+    in chunks as the swarms are walked, flushing each one to the client,
+    so its memory use stays bounded however many torrents are tracked.
     """
-    @tornado.web.asynchronous
-    def get(self):
-        info_hashes = self.get_arguments('info_hash')
-        response = {}
-        for info_hash in info_hashes:
-            info_hash = str(info_hash)
-            response[info_hash] = {}
-            response[info_hash]['complete'] = no_of_seeders(info_hash)
-            # FIXME: number of times clients have registered completion.
-            response[info_hash]['downloaded'] = no_of_seeders(info_hash)
-            response[info_hash]['incomplete'] = no_of_leechers(info_hash)
-            # this is possible typo:
-            # response[info_hash]['name'] = bdecode(info_hash).get(name, '')
+    metric = 'scrape'
 
+    async def get(self):
         # send the bencoded response as text/plain document.
         self.set_header('content-type', 'text/plain')
-        self.write(bencode(response))
-        self.finish()
+        if self.settings.get('internal') and \
+                'after' in self.request.query_arguments:
+            self.write_listing_page()
+            return
+        info_hashes = parse_scrape(self.request.query)
+        if info_hashes is not None:
+            if get_whitelist() is not None:
+                # only the whitelisted torrents are reported.
+                info_hashes = [info_hash for info_hash in info_hashes
+                               if is_allowed(info_hash)]
+            if not info_hashes:
+                # none of the info_hashes is valid or tracked here.
+                self.write(SCRAPE_PREFIX + SCRAPE_SUFFIX)
+                return
+        if self.shards is not None:
+            await self.sharded_scrape(info_hashes)
+            return
+        for chunk in scrape_chunks(info_hashes):
+            self.write(chunk)
+            await self.flush()
 
+    def write_listing_page(self):
+        """A page of this worker's listing, for another worker merging
+        the listings of every shard.
+        """
+        after = binascii.unhexlify(self.get_query_argument('after'))
+        limit = int(self.get_query_argument('limit'))
+        for chunk in scrape_chunks(listing_page(after, limit),
+                                   cached=False):
+            self.write(chunk)
 
-def run_app(port):
-    """Start Tornado IOLoop for this application.
+    async def sharded_scrape(self, info_hashes):
+        """Scrape the torrents of every shard.
+
+        The listings of the shards are merged in info_hash order and
+        written in chunks, holding a page of each at a time. A shard that
+        can't be reached fails the scrape with a 503.
+        """
+        shards = self.shards
+        try:
+            if info_hashes is None:
+                await self.merged_scrape()
+                return
+            entries = {}
+            for shard, hashes in shards.split(set(info_hashes)).items():
+                if shard == shards.task_id:
+                    for info_hash in hashes:
+                        entries[info_hash] = Bencached(
+                            scrape_entry(info_hash))
+                    continue
+                response = await shards.fetch(shard, scrape_uri(hashes),
+                                              self.remote_ip)
+                entries.update(scrape_files(response))
+        except ShardUnavailable as ex:
+            logging.warning('scrape failed: %s', ex)
+            self.send_error(503)
+            return
+        self.write(bencode({'files': entries}))
+
+    async def merged_scrape(self):
+        shards = self.shards
+        listings = [LocalListing(sorted(get_swarms().swarms),
+                                 lambda info_hash: scrape_entry(info_hash,
+                                                                False))]
+        listings.extend(ShardListing(shards, shard, self.remote_ip)
+                        for shard in range(shards.workers)
+                        if shard != shards.task_id)
+        entries = await merge_listings(listings)
+        chunk = [SCRAPE_PREFIX]
+        size = 0
+        async for info_hash, entry in entries:
+            chunk.append(b'%d:' % len(info_hash) + info_hash + entry)
+            size += len(info_hash) + len(entry)
+            if size >= SCRAPE_CHUNK_SIZE:
+                self.write(b''.join(chunk))
+                await self.flush()
+                chunk = []
+                size = 0
+        chunk.append(SCRAPE_SUFFIX)
+        self.write(b''.join(chunk))
+
+
+class UDPRelayHandler(BaseHandler):
+    """Handles the UDP tracker datagrams forwarded by other workers.
+    """
+    def post(self):
+        addr = (self.remote_ip,
+                int(self.request.headers.get(REMOTE_PORT_HEADER, 0)))
+        response = self.settings['udp'].handle_datagram(self.request.body,
+                                                         addr, forward=False)
+        if response is not None:
+            self.write(response)
+
+
+def make_app(internal=False, **settings):
+    """The tracker application. The internal one, serving the other
+    workers, also relays their UDP datagrams.
     """
-    tracker = tornado.web.Application([
+    handlers = [
         (r"/announce.*", AnnounceHandler),
         (r"/scrape.*", ScrapeHandler),
+        (r"/metrics", MetricsHandler),
         (r"/", TrackerStats),
-    ])
-    logging.info('Starting Pytt on port %d' % port)
+    ]
+    if internal:
+        handlers.append((r"/udp", UDPRelayHandler))
+    # only a sample of the requests goes to the access log.
+    settings.setdefault('log_function',
+                        AccessSampler(get_settings().logging.access_sample))
+    return tornado.web.Application(handlers, internal=internal,
+                                   compress_response=True, **settings)
+
+
+def use_uvloop():
+    """Run the IOLoop on uvloop if it is installed, unless the config
+    says otherwise. Returns whether it is used.
+    """
+    if uvloop is None or not get_settings().tracker.uvloop:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+def run_app(port, udp_port=0, workers=1, shard_port=0):
+    """Start Tornado IOLoop for this application.
+
+    The UDP tracker is served on the same IOLoop if udp_port is set.
+    With several workers, the processes are forked here and each serves
+    its shard of the swarms to the others on shard_port + its number.
+    """
+    secret = os.urandom(16)
+    shards = None
+    if workers > 1:
+        # only the workers reload the config on SIGHUP.
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        sockets = tornado.netutil.bind_sockets(port)
+        task_id = tornado.process.fork_processes(workers)
+        use_shard_db(task_id)
+        shards = Shards(workers, task_id, shard_port)
+
+    # rebuild the swarms from the database before serving any request.
+    get_swarms()
+    # evict the peers silent for reap_factor announce intervals.
+    settings = get_settings()
+    interval = settings.tracker.interval
+    swarms = get_swarms()
+    # a peer table has no Peer objects to schedule, its column is scanned.
+    reaper_class = TableReaper if hasattr(swarms, 'expired') else Reaper
+    reaper = reaper_class(swarms, interval * settings.tracker.reap_factor,
+                          expire_peer)
+    reaper.start(interval)
+    registry.gauge('pytt_reaped_peers', 'Silent peers evicted.',
+                   lambda: reaper.evicted)
+    registry.gauge('pytt_reaper_duration_seconds',
+                   'Time spent by the last reaper pass.',
+                   lambda: reaper.last_duration)
+
+    tracker = make_app(reaper=reaper, shards=shards)
+    logging.info('Starting Pytt on port %d', port)
     http_server = tornado.httpserver.HTTPServer(tracker)
-    http_server.listen(port)
-    tornado.ioloop.IOLoop.instance().start()
+    udp = UDPTracker(secret, shards)
+    if shards is None:
+        http_server.listen(port)
+    else:
+        http_server.add_sockets(sockets)
+        internal = make_app(internal=True, reaper=reaper, udp=udp)
+        tornado.httpserver.HTTPServer(internal).listen(
+            shards.port(shards.task_id), '127.0.0.1')
+    if udp_port:
+        udp.listen(udp_port, reuse_port=shards is not None)
+    # replicate the swarms with the other nodes, worker by worker.
+    federation = get_federation()
+    if federation is not None:
+        federation.start(settings.federation.port,
+                         settings.federation.address,
+                         shards.task_id if shards is not None else 0)
+        logging.info('Federating as %s with %d nodes', federation.node_id,
+                     len(federation.nodes))
+    # forget the rate limits of the clients gone quiet.
+    tornado.ioloop.PeriodicCallback(
+        cleanup_limiter, settings.ratelimit.cleanup_interval * 1000).start()
+    # keep a history of the active peers.
+    sample_stats()
+    tornado.ioloop.PeriodicCallback(
+        sample_stats, settings.stats.sample_interval * 1000).start()
+    # pick up the changes to the torrent whitelist.
+    tornado.ioloop.PeriodicCallback(
+        reload_whitelist, settings.whitelist.reload_interval * 1000).start()
+    # make the database changes durable every sync_interval seconds.
+    tornado.ioloop.PeriodicCallback(
+        sync_db, settings.storage.sync_interval * 1000).start()
+    # reload the config when it changes, or on SIGHUP.
+    tornado.ioloop.PeriodicCallback(
+        reload_config, settings.tracker.config_check_interval * 1000).start()
+    io_loop = tornado.ioloop.IOLoop.current()
+    io_loop.asyncio_loop.add_signal_handler(signal.SIGHUP, reload_config,
+                                            True)
+    io_loop.start()
 
 
 def start_tracker():
@@ -152,6 +391,10 @@ def start_tracker():
     # parse commandline options
     parser = OptionParser()
     parser.add_option('-p', '--port', help='Tracker Port', default=0)
+    parser.add_option('-u', '--udp-port', help='UDP Tracker Port, 0 to '
+                      'disable', default=None)
+    parser.add_option('-w', '--workers', help='Number of worker processes, '
+                      '0 for one per CPU', default=None)
     parser.add_option('-b', '--background', action='store_true',
                       default=False, help='Start in background')
     parser.add_option('-d', '--debug', action='store_true',
@@ -162,16 +405,30 @@ def start_tracker():
     create_pytt_dirs()
     # setup logging
     setup_logging(options.debug)
+    if use_uvloop():
+        logging.info('Using the uvloop event loop')
 
     try:
         # start the torrent tracker
-        run_app(int(options.port) or get_config().getint('tracker', 'port'))
+        tracker = get_settings().tracker
+        if options.udp_port is None:
+            udp_port = tracker.udp_port
+        else:
+            udp_port = int(options.udp_port)
+        if options.workers is None:
+            workers = tracker.workers
+        else:
+            workers = int(options.workers)
+        if workers == 0:
+            workers = tornado.process.cpu_count()
+        run_app(int(options.port) or tracker.port, udp_port, workers,
+                tracker.shard_port)
     except KeyboardInterrupt:
         logging.info('Tracker Stopped.')
         close_db()
         sys.exit(0)
     except Exception as ex:
-        logging.fatal('%s' % str(ex))
+        logging.fatal('%s', ex)
         close_db()
         sys.exit(-1)
 
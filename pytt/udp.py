@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+#
+# UDP tracker protocol (BEP 15) for Pytt.
+#
+# Shares the swarms and the peer selection of the HTTP announce path, at
+# a fraction of its cost: one datagram in, one datagram out, no HTTP
+# parsing and no bencoding.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+import errno
+import hashlib
+import hmac
+import inspect
+import logging
+import os
+import socket
+import struct
+import time
+
+import tornado.gen
+import tornado.ioloop
+
+from .metrics import (ERRORS, LATENCY, REQUESTS, STORAGE_BACKPRESSURE,
+                      UNREGISTERED, clock)
+from .swarm import family_of
+from .utils import (DEFAULT_ALLOWED_PEERS, MAX_ALLOWED_PEERS,
+                    get_peer_list, get_settings, is_allowed, no_of_leechers,
+                    no_of_seeders, scrape_counts, storage_backlog,
+                    store_peer_info)
+
+
+PROTOCOL_ID = 0x41727101980
+
+# Actions
+CONNECT = 0
+ANNOUNCE = 1
+SCRAPE = 2
+ERROR = 3
+
+# Announce events, by their number in the request.
+EVENTS = {0: None, 1: 'completed', 2: 'started', 3: 'stopped'}
+
+# A connection id is valid for the minute it was issued in and the next.
+CONNECTION_ID_LIFETIME = 60
+# At most this many info_hashes fit in a scrape datagram.
+MAX_SCRAPE_HASHES = 74
+# Datagrams read per IOLoop wakeup, to leave room for the other sockets.
+MAX_DATAGRAMS = 64
+MAX_DATAGRAM_SIZE = 2048
+
+connect_request = struct.Struct('>QII')
+connect_response = struct.Struct('>IIQ')
+announce_request = struct.Struct('>QII20s20sQQQIIIiH')
+announce_response = struct.Struct('>IIIII')
+header = struct.Struct('>QII')
+response_header = struct.Struct('>II')
+scrape_entry = struct.Struct('>III')
+
+
+class UDPTracker(object):
+    """Serves the BEP 15 connect, announce and scrape actions.
+
+    Connection ids are an HMAC of the client address and the current
+    minute, so they can be checked without keeping any per-client state.
+    In multi-process mode, all the workers share the secret and the
+    requests for info_hashes of other shards are forwarded to them.
+    """
+
+    def __init__(self, secret=None, shards=None):
+        self.secret = secret or os.urandom(16)
+        self.shards = shards
+        self.socket = None
+        self.io_loop = None
+
+    def connection_id(self, addr, epoch=None):
+        """The connection id of a client address for the given minute.
+        """
+        if epoch is None:
+            epoch = int(time.time()) // CONNECTION_ID_LIFETIME
+        message = ('%s:%d:%d' % (addr[0], addr[1], epoch)).encode('utf-8')
+        digest = hmac.new(self.secret, message, hashlib.sha1).digest()
+        return struct.unpack('>Q', digest[:8])[0]
+
+    def valid_connection_id(self, connection_id, addr):
+        epoch = int(time.time()) // CONNECTION_ID_LIFETIME
+        return connection_id in (self.connection_id(addr, epoch),
+                                 self.connection_id(addr, epoch - 1))
+
+    def error(self, transaction_id, message):
+        return response_header.pack(ERROR, transaction_id) + \
+            message.encode('utf-8')
+
+    def handle_datagram(self, data, addr, forward=True):
+        """Handle a request datagram from addr. Returns the response
+        datagram, or None if the request is to be ignored. A request
+        forwarded to another shard returns an awaitable of the response.
+        """
+        if len(data) < header.size:
+            return None
+        connection_id, action, transaction_id = header.unpack_from(data)
+        if action == CONNECT:
+            if connection_id != PROTOCOL_ID:
+                return None
+            return connect_response.pack(CONNECT, transaction_id,
+                                         self.connection_id(addr))
+        if not self.valid_connection_id(connection_id, addr):
+            return self.error(transaction_id, 'Invalid connection id')
+        shards = self.shards if forward else None
+        if action == ANNOUNCE:
+            if shards is not None and len(data) >= announce_request.size:
+                owner = shards.owner(data[16:36])
+                if owner != shards.task_id:
+                    return shards.forward_udp(owner, data, addr)
+            return self.announce(data, addr, transaction_id)
+        if action == SCRAPE:
+            if shards is not None:
+                hashes = data[header.size:]
+                owners = set(shards.owner(hashes[i:i + 20])
+                             for i in range(0, len(hashes), 20))
+                if owners and owners != set([shards.task_id]):
+                    return self.sharded_scrape(data, addr, transaction_id)
+            return self.scrape(data, transaction_id)
+        return self.error(transaction_id, 'Invalid action')
+
+    def announce(self, data, addr, transaction_id):
+        if len(data) < announce_request.size:
+            return self.error(transaction_id, 'Truncated announce')
+        (_, _, _, info_hash, peer_id, downloaded, left, uploaded, event,
+         ip, key, numwant, port) = announce_request.unpack_from(data)
+        if event not in EVENTS:
+            return self.error(transaction_id, 'Invalid event')
+        if not is_allowed(info_hash):
+            UNREGISTERED.inc()
+            return self.error(transaction_id, 'Torrent not registered')
+        if numwant < 0:
+            numwant = DEFAULT_ALLOWED_PEERS
+        numwant = min(numwant, MAX_ALLOWED_PEERS)
+
+        event = EVENTS[event]
+        if storage_backlog() is not None:
+            # the storage writer lags behind, the client will retry.
+            STORAGE_BACKPRESSURE['drop'].inc()
+            return None
+        store_peer_info(info_hash, peer_id, addr[0], str(port), event,
+                        uploaded, downloaded)
+
+        family = family_of(addr[0])
+        interval = get_settings().tracker.interval
+        return announce_response.pack(
+            ANNOUNCE, transaction_id, interval, no_of_leechers(info_hash),
+            no_of_seeders(info_hash)) + \
+            get_peer_list(info_hash, numwant, 1, 0, peer_id, left,
+                          event or '', family)
+
+    def scrape(self, data, transaction_id):
+        hashes = data[header.size:]
+        if not hashes or len(hashes) % 20:
+            return self.error(transaction_id, 'Invalid scrape')
+        chunks = [response_header.pack(SCRAPE, transaction_id)]
+        for i in range(0, min(len(hashes), MAX_SCRAPE_HASHES * 20), 20):
+            chunks.append(scrape_entry.pack(
+                *scrape_counts(hashes[i:i + 20])))
+        return b''.join(chunks)
+
+    async def sharded_scrape(self, data, addr, transaction_id):
+        """Scrape info_hashes spread over several shards: each shard gets
+        a scrape of its own info_hashes and the entries are put back in
+        the order of the request.
+        """
+        hashes = data[header.size:header.size + MAX_SCRAPE_HASHES * 20]
+        if not hashes or len(hashes) % 20:
+            return self.error(transaction_id, 'Invalid scrape')
+        hashes = [hashes[i:i + 20] for i in range(0, len(hashes), 20)]
+        entries = [None] * len(hashes)
+        by_shard = {}
+        for index, info_hash in enumerate(hashes):
+            by_shard.setdefault(self.shards.owner(info_hash),
+                                []).append(index)
+        responses = {}
+        for shard, indexes in by_shard.items():
+            if shard == self.shards.task_id:
+                for index in indexes:
+                    entries[index] = scrape_entry.pack(
+                        *scrape_counts(hashes[index]))
+            else:
+                request = data[:header.size] + b''.join(
+                    hashes[index] for index in indexes)
+                responses[shard] = self.shards.forward_udp(shard, request,
+                                                           addr)
+        for shard, future in responses.items():
+            response = await future
+            if response is None or \
+                    response_header.unpack_from(response)[0] != SCRAPE:
+                return response
+            offset = response_header.size
+            for index in by_shard[shard]:
+                entries[index] = response[offset:offset + scrape_entry.size]
+                offset += scrape_entry.size
+        return response_header.pack(SCRAPE, transaction_id) + \
+            b''.join(entries)
+
+    def listen(self, port, address='', reuse_port=False):
+        """Bind the UDP socket and serve it on the current IOLoop. With
+        reuse_port, every worker process binds the same port.
+        """
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.setblocking(False)
+        sock.bind((address, port))
+        self.socket = sock
+        self.io_loop = tornado.ioloop.IOLoop.current()
+        self.io_loop.add_handler(sock.fileno(), self.on_readable,
+                                 tornado.ioloop.IOLoop.READ)
+        logging.info('Starting Pytt UDP tracker on port %d', port)
+
+    def on_readable(self, fd, events):
+        for _ in range(MAX_DATAGRAMS):
+            try:
+                data, addr = self.socket.recvfrom(MAX_DATAGRAM_SIZE)
+            except socket.error as ex:
+                if ex.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN):
+                    return
+                raise
+            started = clock()
+            REQUESTS['udp'].inc()
+            try:
+                response = self.handle_datagram(data, addr)
+            except Exception:
+                ERRORS['udp'].inc()
+                logging.exception('error handling UDP request')
+                continue
+            LATENCY['udp'].observe(clock() - started)
+            if inspect.isawaitable(response):
+                self.io_loop.add_future(tornado.gen.convert_yielded(response),
+                                        self.on_forwarded(addr))
+            else:
+                self.send(response, addr)
+
+    def on_forwarded(self, addr):
+        def callback(future):
+            try:
+                self.send(future.result(), addr)
+            except Exception:
+                logging.exception('error forwarding UDP request')
+        return callback
+
+    def send(self, response, addr):
+        if response is None or self.socket is None:
+            return
+        try:
+            self.socket.sendto(response, addr)
+        except socket.error:
+            # UDP is best effort, the client will retry.
+            pass
+
+    def close(self):
+        if self.socket is not None:
+            self.io_loop.remove_handler(self.socket.fileno())
+            self.socket.close()
+            self.socket = None
@@ -7,14 +7,29 @@
 # http://foobarnbaz.com
 
 
+import atexit
+import bisect
 import os
 import logging
 import logging.handlers
-import shelve
-from socket import inet_aton
-from struct import pack
 import tornado.web
-import binascii
+
+from .bencode import bencode
+from .cache import ResponseCache
+from .federation import FederationNode
+from .logs import LogPipeline
+from .metrics import (ERRORS, LATENCY, RATE_LIMITED, REQUESTS,
+                      STORAGE_BACKPRESSURE, UNREGISTERED, registry)
+from .peertable import make_registry
+from .ratelimit import AnnounceLimiter
+from .selection import PeerSelector
+from .settings import NOT_REGISTERED, ConfigError, load_settings, to_bool
+from .stats import SwarmStatistics
+from .storage import open_engine
+from .swarm import COMPACT_WIDTH, COMPLETED
+from .whitelist import TorrentRegistry
+from .workers import REMOTE_IP_HEADER
+from .writer import StorageWriter
 try:
     from ConfigParser import RawConfigParser
     from httplib import responses
@@ -32,8 +47,12 @@ LOG_PATH = os.path.expanduser('~/.pytt/log/pytt.log')
 PEER_INCREASE_LIMIT = 30
 DEFAULT_ALLOWED_PEERS = 50
 MAX_ALLOWED_PEERS = 55
-INFO_HASH_LEN = 20 * 2  # info_hash is hexified.
+INFO_HASH_LEN = 20
 PEER_ID_LEN = 20
+SCRAPE_CHUNK_SIZE = 64 * 1024
+# Around the entries of a bencoded scrape response.
+SCRAPE_PREFIX = b'd5:filesd'
+SCRAPE_SUFFIX = b'ee'
 
 # HTTP Error Codes for BitTorrent Tracker
 INVALID_REQUEST_TYPE = 100
@@ -43,6 +62,7 @@ MISSING_PORT = 103
 INVALID_INFO_HASH = 150
 INVALID_PEER_ID = 151
 INVALID_NUMWANT = 152
+INVALID_PORT = 153
 GENERIC_ERROR = 900
 
 # Pytt response messages
@@ -54,16 +74,23 @@ PYTT_RESPONSE_MESSAGES = {
     INVALID_INFO_HASH: 'info_hash is not %d bytes' % INFO_HASH_LEN,
     INVALID_PEER_ID: 'peer_id is not %d bytes' % PEER_ID_LEN,
     INVALID_NUMWANT: 'Peers more than %d is not allowed.' % MAX_ALLOWED_PEERS,
+    INVALID_PORT: 'Invalid port',
     GENERIC_ERROR: 'Error in request',
 }
 # add our response codes to httplib.responses
 responses.update(PYTT_RESPONSE_MESSAGES)
+# and the bencoded failure reasons sent for them.
+FAILURES = dict((code, bencode({'failure reason': message}))
+                for code, message in PYTT_RESPONSE_MESSAGES.items())
 
 logger = logging.getLogger('tornado.access')
 
 
 def setup_logging(debug=False):
     """Setup application logging.
+
+    The records are queued and written to the log file by a background
+    thread. Returns the LogPipeline.
     """
     if debug:
         level = logging.DEBUG
@@ -77,18 +104,77 @@ def setup_logging(debug=False):
     format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     formatter = logging.Formatter(format)
     log_handler.setFormatter(formatter)
-    root_logger.addHandler(log_handler)
+    # the handlers already set up, such as the console's, are fed by the
+    # queue too.
+    handlers = [log_handler] + root_logger.handlers
+    for handler in handlers[1:]:
+        root_logger.removeHandler(handler)
+    settings = get_settings().logging
+    pipeline = LogPipeline(handlers, settings.queue_size,
+                           settings.error_interval)
+    root_logger.addHandler(pipeline.handler)
+    pipeline.start()
+    atexit.register(pipeline.stop)
+    return pipeline
 
 
 def create_config(path):
     """Create default config file.
     """
-    logging.info('creating default config at %s' % CONFIG_PATH)
+    logging.info('creating default config at %s', CONFIG_PATH)
     config = RawConfigParser()
     config.add_section('tracker')
     config.set('tracker', 'port', '8080')
+    config.set('tracker', 'udp_port', '8080')
+    config.set('tracker', 'workers', '1')
+    config.set('tracker', 'shard_port', '18080')
     config.set('tracker', 'interval', '5')
     config.set('tracker', 'min_interval', '1')
+    config.set('tracker', 'reap_factor', '3')
+    config.set('tracker', 'peer_selection', 'window')
+    config.set('tracker', 'complementary_peers', 'no')
+    config.set('tracker', 'prefer_subnet', 'no')
+    config.set('tracker', 'uvloop', 'yes')
+    config.set('tracker', 'peer_table', 'objects')
+    config.set('tracker', 'config_check_interval', '10')
+    config.add_section('storage')
+    config.set('storage', 'engine', 'journal')
+    config.set('storage', 'sync_interval', '5')
+    config.set('storage', 'snapshot_interval', '300')
+    config.set('storage', 'write_behind', 'yes')
+    config.set('storage', 'queue_size', '100000')
+    config.set('storage', 'flush_interval', '0.5')
+    config.add_section('cache')
+    config.set('cache', 'max_bytes', str(16 * 1024 * 1024))
+    config.add_section('stats')
+    config.set('stats', 'sample_interval', '60')
+    config.set('stats', 'history', '1440')
+    config.add_section('whitelist')
+    config.set('whitelist', 'enabled', 'no')
+    config.set('whitelist', 'torrent_dir',
+               os.path.expanduser('~/.pytt/torrents'))
+    config.set('whitelist', 'hash_list', '')
+    config.set('whitelist', 'reload_interval', '60')
+    config.add_section('ratelimit')
+    config.set('ratelimit', 'enabled', 'yes')
+    config.set('ratelimit', 'ip_rate', '20')
+    config.set('ratelimit', 'ip_burst', '100')
+    config.set('ratelimit', 'peer_burst', '2')
+    config.set('ratelimit', 'max_entries', '100000')
+    config.set('ratelimit', 'cleanup_interval', '60')
+    config.add_section('federation')
+    config.set('federation', 'enabled', 'no')
+    config.set('federation', 'node_id', '')
+    config.set('federation', 'address', '')
+    config.set('federation', 'port', '18180')
+    config.set('federation', 'nodes', '')
+    config.set('federation', 'interval', '5')
+    config.set('federation', 'batch_size', '10000')
+    config.set('federation', 'secret', '')
+    config.add_section('logging')
+    config.set('logging', 'access_sample', '1000')
+    config.set('logging', 'error_interval', '60')
+    config.set('logging', 'queue_size', '10000')
     with open(path, 'w') as f:
         config.write(f)
 
@@ -109,20 +195,99 @@ def create_pytt_dirs():
 class BaseHandler(tornado.web.RequestHandler):
     """Since I dont like some tornado craps :-)
     """
-    def decode_argument(self, value, name):
-        # info_hash is raw_bytes, hexify it.
-        if name == 'info_hash':
-            value = binascii.hexlify(value)
-        return super(BaseHandler, self).decode_argument(value, name)
+    # the handler label of the request metrics.
+    metric = None
+    # set by fail(), counted as an error.
+    failed = False
 
+    @property
+    def shards(self):
+        """The Shards router in multi-process mode, else None.
 
-class ConfigError(Exception):
-    """Raised when config error occurs.
-    """
+        Requests from the other workers are always served locally.
+        """
+        if self.settings.get('internal'):
+            return None
+        return self.settings.get('shards')
+
+    @property
+    def remote_ip(self):
+        """The client IP, as forwarded by another worker if need be.
+        """
+        if self.settings.get('internal'):
+            return self.request.headers.get(REMOTE_IP_HEADER,
+                                            self.request.remote_ip)
+        return self.request.remote_ip
+
+    def on_finish(self):
+        # forwarded requests were already counted by the first worker.
+        if self.metric is None or self.settings.get('internal'):
+            return
+        REQUESTS[self.metric].inc()
+        LATENCY[self.metric].observe(self.request.request_time())
+        if self.failed or self.get_status() >= 400:
+            ERRORS[self.metric].inc()
+
+    def fail(self, code):
+        """Turn the request down with the failure reason of a Pytt error
+        code. The codes aren't HTTP statuses: clients expect a bencoded
+        `failure reason` (BEP 3) in a 200 response.
+        """
+        self.failed = True
+        self.set_header('Content-Type', 'text/plain')
+        self.write(FAILURES[code])
+
+    def rate_limit(self, info_hash, peer_id, event=''):
+        """The response to a client announcing too often, or None if the
+        announce is to be served.
+
+        An IP over its rate gets a failure reason, a peer announcing
+        again before min_interval gets a warning and no peers. Both are
+        bencoded once, so turning a client down costs next to nothing.
+        """
+        limiter = get_limiter()
+        if limiter is None:
+            return None
+        limit = limiter.check(self.remote_ip, info_hash, peer_id, event)
+        if limit is None:
+            return None
+        RATE_LIMITED[limit].inc()
+        responses = get_settings().responses
+        if limit == limiter.IP_LIMITED:
+            return responses.ip_limited
+        return responses.peer_limited
+
+    def not_registered(self, info_hash):
+        """The response to an announce for a torrent missing from the
+        whitelist, or None if the torrent is tracked.
+        """
+        whitelist = get_whitelist()
+        if whitelist is None or info_hash in whitelist:
+            return None
+        UNREGISTERED.inc()
+        return get_settings().responses.not_registered
+
+    async def forward(self, shard):
+        """Relay this request to the worker owning the shard.
+        """
+        response = await self.shards.fetch(shard, self.request.uri,
+                                           self.remote_ip)
+        if response.code == 599:
+            # the worker couldn't be reached.
+            self.send_error(503)
+            return
+        self.set_status(response.code)
+        self.set_header('Content-Type', response.headers.get(
+            'Content-Type', 'text/plain'))
+        if response.body:
+            self.write(response.body)
 
 
 class Config:
     """Provide a single entry point to the Configuration.
+
+    The config is read once, into a RawConfigParser and an immutable
+    Settings snapshot. reload() replaces both at once.
     """
     __shared_state = {}
 
@@ -131,21 +296,47 @@ class Config:
         """
         self.__dict__ = self.__shared_state
 
+    def load(self):
+        if not hasattr(self, '_Config__settings') or \
+                self.__path != CONFIG_PATH:
+            self.__config, self.__settings = load_settings(CONFIG_PATH)
+            self.__path = CONFIG_PATH
+            self.__mtime = config_mtime()
+
     def get(self):
         """Get the config object.
         """
-        if not hasattr(self, '__config'):
-            self.__config = RawConfigParser()
-            if self.__config.read(CONFIG_PATH) == []:
-                raise ConfigError('No config at %s' % CONFIG_PATH)
+        self.load()
         return self.__config
 
+    def settings(self):
+        """Get the Settings snapshot of the config.
+        """
+        self.load()
+        return self.__settings
+
+    def reload(self, force=False):
+        """Read the config again if it changed since it was loaded, or
+        if forced. Returns the previous Settings, or None if the config
+        was left as it is.
+        """
+        self.load()
+        mtime = config_mtime()
+        if not force and mtime == self.__mtime:
+            return None
+        self.__mtime = mtime
+        previous = self.__settings
+        # a single assignment, the handlers see either snapshot whole.
+        self.__config, self.__settings = load_settings(CONFIG_PATH)
+        return previous
+
     def close(self):
         """Close config connection
         """
-        if not hasattr(self, '__config'):
+        if not hasattr(self, '_Config__settings'):
             return 0
         del self.__config
+        del self.__settings
 
 
 class Database:
@@ -159,99 +350,658 @@ class Database:
         self.__dict__ = self.__shared_state
 
     def get(self):
-        """Get the shelve object.
+        """Get the storage engine selected in the config.
         """
-        if not hasattr(self, '__db'):
-            self.__db = shelve.open(DB_PATH, writeback=True)
+        if not hasattr(self, '_Database__db'):
+            storage = get_settings().storage
+            options = {}
+            if storage.engine == 'journal':
+                options['snapshot_interval'] = storage.snapshot_interval
+            self.__db = open_engine(storage.engine, DB_PATH, **options)
+            # have the changes written by a background thread.
+            if storage.engine != 'memory' and storage.write_behind:
+                self.__db = StorageWriter(
+                    self.__db, storage.queue_size,
+                    flush_interval=storage.flush_interval)
         return self.__db
 
     def close(self):
         """Close db connection
         """
-        if not hasattr(self, '__db'):
+        if not hasattr(self, '_Database__db'):
             return 0
         self.__db.close()
         del self.__db
 
 
+class Swarms:
+    """Provide a single entry point to the in-memory swarm registry.
+    """
+    __shared_state = {}
+
+    def __init__(self):
+        """Borg pattern. All instances will have same state.
+        """
+        self.__dict__ = self.__shared_state
+
+    def get(self):
+        """Get the registry, loading it from the database the first time.
+        """
+        if not hasattr(self, '_Swarms__registry'):
+            self.__registry = make_registry(get_settings().tracker.peer_table)
+            self.__registry.on_drop.append(forget_torrent)
+            load_swarms(self.__registry, get_db())
+        return self.__registry
+
+    def close(self):
+        """Drop the registry. It will be reloaded from the database.
+        """
+        if not hasattr(self, '_Swarms__registry'):
+            return 0
+        del self.__registry
+
+
+class Statistics:
+    """Provide a single entry point to the swarm statistics.
+    """
+    __shared_state = {}
+
+    def __init__(self):
+        """Borg pattern. All instances will have same state.
+        """
+        self.__dict__ = self.__shared_state
+
+    def get(self):
+        if not hasattr(self, '_Statistics__stats'):
+            self.__stats = SwarmStatistics(get_settings().stats.history)
+        return self.__stats
+
+    def close(self):
+        if hasattr(self, '_Statistics__stats'):
+            del self.__stats
+
+
+class Selector:
+    """Provide a single entry point to the configured PeerSelector.
+    """
+    __shared_state = {}
+
+    def __init__(self):
+        """Borg pattern. All instances will have same state.
+        """
+        self.__dict__ = self.__shared_state
+
+    def get(self):
+        """Get the peer selector built from the config.
+        """
+        if not hasattr(self, '_Selector__selector'):
+            tracker = get_settings().tracker
+            self.__selector = PeerSelector(tracker.peer_selection,
+                                           tracker.complementary_peers,
+                                           tracker.prefer_subnet)
+        return self.__selector
+
+    def close(self):
+        if hasattr(self, '_Selector__selector'):
+            del self.__selector
+
+
+class Cache:
+    """Provide a single entry point to the response cache.
+    """
+    __shared_state = {}
+
+    def __init__(self):
+        """Borg pattern. All instances will have same state.
+        """
+        self.__dict__ = self.__shared_state
+
+    def get(self):
+        """Get the response cache sized from the config.
+        """
+        if not hasattr(self, '_Cache__cache'):
+            self.__cache = ResponseCache(get_settings().cache.max_bytes)
+        return self.__cache
+
+    def close(self):
+        if hasattr(self, '_Cache__cache'):
+            del self.__cache
+
+
+class Listing:
+    """Provide a single entry point to the sorted info_hashes of the
+    scrape listing the other workers page through.
+    """
+    __shared_state = {}
+
+    def __init__(self):
+        """Borg pattern. All instances will have same state.
+        """
+        self.__dict__ = self.__shared_state
+
+    def get(self, fresh=False):
+        """Get the sorted info_hashes of the swarms, sorted again if
+        fresh.
+        """
+        if fresh or not hasattr(self, '_Listing__info_hashes'):
+            self.__info_hashes = sorted(get_swarms().swarms)
+        return self.__info_hashes
+
+    def close(self):
+        if hasattr(self, '_Listing__info_hashes'):
+            del self.__info_hashes
+
+
+class Limiter:
+    """Provide a single entry point to the announce rate limiter.
+    """
+    __shared_state = {}
+
+    def __init__(self):
+        """Borg pattern. All instances will have same state.
+        """
+        self.__dict__ = self.__shared_state
+
+    def get(self):
+        """Get the rate limiter built from the config, None if disabled.
+        """
+        if not hasattr(self, '_Limiter__limiter'):
+            self.__limiter = None
+            settings = get_settings()
+            ratelimit = settings.ratelimit
+            if ratelimit.enabled:
+                self.__limiter = AnnounceLimiter(
+                    settings.tracker.min_interval, ratelimit.ip_rate,
+                    ratelimit.ip_burst, ratelimit.peer_burst,
+                    ratelimit.max_entries)
+        return self.__limiter
+
+    def close(self):
+        if hasattr(self, '_Limiter__limiter'):
+            del self.__limiter
+
+
+class Torrents:
+    """Provide a single entry point to the torrent whitelist.
+    """
+    __shared_state = {}
+
+    def __init__(self):
+        """Borg pattern. All instances will have same state.
+        """
+        self.__dict__ = self.__shared_state
+
+    def get(self):
+        """Get the whitelist built from the config, None if disabled.
+        """
+        if not hasattr(self, '_Torrents__registry'):
+            self.__registry = None
+            whitelist = get_settings().whitelist
+            if whitelist.enabled:
+                self.__registry = TorrentRegistry(
+                    whitelist.torrent_dir or None,
+                    whitelist.hash_list or None)
+        return self.__registry
+
+    def close(self):
+        if hasattr(self, '_Torrents__registry'):
+            del self.__registry
+
+
+class Federation:
+    """Provide a single entry point to the federation with the other
+    nodes.
+    """
+    __shared_state = {}
+
+    def __init__(self):
+        """Borg pattern. All instances will have same state.
+        """
+        self.__dict__ = self.__shared_state
+
+    def get(self):
+        """Get the FederationNode built from the config, None if
+        disabled.
+        """
+        if not hasattr(self, '_Federation__node'):
+            self.__node = None
+            settings = get_settings()
+            federation = settings.federation
+            if federation.enabled:
+                # tombstones are kept until the peers would have expired.
+                self.__node = FederationNode(
+                    get_swarms(), federation.nodes, federation.node_id,
+                    federation.secret, federation.interval,
+                    federation.batch_size,
+                    settings.tracker.interval * settings.tracker.reap_factor,
+                    is_allowed)
+        return self.__node
+
+    def close(self):
+        if not hasattr(self, '_Federation__node'):
+            return 0
+        if self.__node is not None:
+            self.__node.stop()
+        del self.__node
+
+
 def get_config():
     """Get a connection to the configuration.
     """
     return Config().get()
 
 
+def get_settings():
+    """Get the Settings snapshot of the configuration.
+    """
+    return Config().settings()
+
+
+def config_mtime():
+    try:
+        return os.stat(CONFIG_PATH).st_mtime
+    except OSError:
+        return None
+
+
+# The components built from a section of the config, rebuilt when it
+# changes.
+RELOADED = [('tracker', (Selector, Limiter)),
+            ('cache', (Cache,)),
+            ('ratelimit', (Limiter,)),
+            ('whitelist', (Torrents,))]
+
+
+def reload_config(force=False):
+    """Reload the config if it changed, or if forced. The components
+    built from the sections that changed are rebuilt on first use.
+
+    An invalid config is logged and the current one is kept.
+    """
+    try:
+        previous = Config().reload(force)
+    except ConfigError as ex:
+        logging.error('config not reloaded: %s', ex)
+        return
+    if previous is None:
+        return
+    settings = get_settings()
+    for section, components in RELOADED:
+        if getattr(previous, section) != getattr(settings, section):
+            for component in components:
+                component().close()
+    if previous.storage != settings.storage:
+        logging.warning('storage changes take effect on restart')
+    logging.info('config reloaded from %s', CONFIG_PATH)
+
+
+def use_shard_db(task_id):
+    """Give this worker process a database of its own.
+    """
+    global DB_PATH
+    close_db()
+    DB_PATH = '%s.shard%d' % (DB_PATH, task_id)
+
+
 def get_db():
     """Get a persistent connection to the database.
     """
     return Database().get()
 
 
+def sync_db():
+    """Make the pending database changes durable.
+    """
+    Database().get().sync()
+
+
+def storage_backlog():
+    """A Future to wait on before queueing more storage writes, or None
+    if the storage writer keeps up.
+    """
+    db = get_db()
+    if isinstance(db, StorageWriter) and db.full:
+        return db.wait()
+    return None
+
+
 def close_db():
     """Close db connection.
     """
+    Federation().close()
+    Listing().close()
+    Swarms().close()
     Database().close()
 
 
+def get_swarms():
+    """Get the in-memory swarm registry.
+    """
+    return Swarms().get()
+
+
+def load_swarms(registry, db):
+    """Populate the registry from the peers persisted in the database.
+    """
+    for info_hash, peer_id, (ip, port, status) in db.load():
+        registry.update(info_hash, peer_id, ip, port, status)
+
+
 def no_of_seeders(info_hash):
     """Number of peers with the entire file, aka "seeders".
     """
-    db = get_db()
-    count = 0
-    if info_hash in db:
-        for peer_info in db[info_hash]:
-            if peer_info[3] == 'completed':
-                count += 1
-    return count
+    swarm = get_swarms().get(info_hash)
+    return swarm.seeders if swarm is not None else 0
 
 
 def no_of_leechers(info_hash):
     """Number of non-seeder peers, aka "leechers".
     """
-    db = get_db()
-    count = 0
-    if info_hash in db:
-        for peer_info in db[info_hash]:
-            if peer_info[3] == 'started':
-                count += 1
-    return count
+    swarm = get_swarms().get(info_hash)
+    return swarm.leechers if swarm is not None else 0
 
 
-def store_peer_info(info_hash, peer_id, ip, port, status):
-    """Store the information about the peer.
+def get_stats():
+    """Get the swarm statistics.
     """
-    db = get_db()
-    if info_hash in db:
-        if (peer_id, ip, port, status) not in db[info_hash]:
-            db[info_hash].append((peer_id, ip, port, status))
+    return Statistics().get()
+
+
+def forget_torrent(info_hash):
+    """Drop the statistics of a torrent whose swarm is gone, unless it
+    was completed.
+    """
+    get_stats().forget(info_hash)
+
+
+def sample_stats():
+    """Add the number of active peers to the statistics history.
+    """
+    registry = get_swarms()
+    get_stats().sample(registry.seeders, registry.leechers)
+
+
+def get_cache():
+    """Get the cache of bencoded response fragments.
+    """
+    return Cache().get()
+
+
+def get_federation():
+    """Get the federation with the other nodes, None if disabled.
+    """
+    return Federation().get()
+
+
+def get_whitelist():
+    """Get the torrent whitelist, None if every torrent is allowed.
+    """
+    return Torrents().get()
+
+
+def is_allowed(info_hash):
+    """Whether the torrent may be tracked here.
+    """
+    whitelist = get_whitelist()
+    return whitelist is None or info_hash in whitelist
+
+
+def reload_whitelist():
+    """Reload the torrent whitelist if its sources changed.
+    """
+    whitelist = get_whitelist()
+    if whitelist is not None:
+        whitelist.reload()
+
+
+def get_limiter():
+    """Get the announce rate limiter, None if rate limiting is disabled.
+    """
+    return Limiter().get()
+
+
+def cleanup_limiter():
+    """Forget the clients that stayed quiet long enough.
+    """
+    limiter = get_limiter()
+    if limiter is not None:
+        limiter.cleanup()
+
+
+def scrape_counts(info_hash):
+    """The (complete, downloaded, incomplete) scrape stats of a torrent.
+    """
+    swarm = get_swarms().get(info_hash)
+    downloaded = get_stats().times_completed(info_hash)
+    if swarm is None:
+        return (0, downloaded, 0)
+    return (swarm.seeders, downloaded, swarm.leechers)
+
+
+def scrape_entry(info_hash, cached=True):
+    """The bencoded scrape stats of a torrent.
+
+    Cached until the swarm changes, so repeated scrapes cost a lookup.
+    """
+    swarm = get_swarms().get(info_hash)
+
+    def build():
+        complete, downloaded, incomplete = scrape_counts(info_hash)
+        return bencode({'complete': complete,
+                        'downloaded': downloaded,
+                        'incomplete': incomplete})
+    if swarm is None or not cached:
+        return build()
+    return get_cache().fetch(('scrape', info_hash), swarm.version, build)
+
+
+def scrape_chunks(info_hashes=None, chunk_size=SCRAPE_CHUNK_SIZE,
+                  wrap=True, cached=None):
+    """Generate the bencoded scrape response in chunks of about
+    chunk_size bytes.
+
+    With no info_hashes, every tracked torrent is listed. Only the sorted
+    list of info_hash references is held, never the whole response, and
+    the full listing skips the cache so it doesn't flush the hot entries.
+    Without wrap, only the entries of the `files` dict are generated.
+    """
+    if cached is None:
+        cached = info_hashes is not None
+    if info_hashes is not None:
+        info_hashes = sorted(set(info_hashes))
     else:
-        db[info_hash] = [(peer_id, ip, port, status)]
+        info_hashes = sorted(get_swarms().swarms)
+    chunk = [SCRAPE_PREFIX] if wrap else []
+    size = 0
+    for info_hash in info_hashes:
+        entry = scrape_entry(info_hash, cached)
+        chunk.append(b'%d:' % len(info_hash) + info_hash + entry)
+        size += len(info_hash) + len(entry)
+        if size >= chunk_size:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    if wrap:
+        chunk.append(SCRAPE_SUFFIX)
+    yield b''.join(chunk)
+
+
+def listing_page(after, limit):
+    """The info_hashes of a page of this worker's scrape listing: the
+    first `limit` ones sorting after the info_hash `after`.
+
+    The listing is sorted when a page starts it, with an empty `after`,
+    and dropped after its last page.
+    """
+    listing = Listing()
+    info_hashes = listing.get(fresh=not after)
+    start = bisect.bisect_right(info_hashes, after)
+    if start + limit >= len(info_hashes):
+        listing.close()
+    return info_hashes[start:start + limit]
+
+
+def announce_header(info_hash):
+    """The complete, incomplete, interval and min interval entries of an
+    announce response, bencoded without the enclosing dict.
+
+    The intervals come bencoded with the settings.
+    """
+    swarm = get_swarms().get(info_hash)
+    if swarm is None:
+        complete = incomplete = 0
+    else:
+        complete, incomplete = swarm.seeders, swarm.leechers
+    return b'8:completei%de10:incompletei%de' % (complete, incomplete) + \
+        get_settings().responses.intervals
+
 
+def store_peer_info(info_hash, peer_id, ip, port, status=None,
+                    uploaded=None, downloaded=None):
+    """Store the information about the peer.
+
+    A regular announce (no status) only refreshes the peer's last-seen
+    time, unless its address changed. The swarm statistics count the
+    completions and, if given, the bytes transferred since the peer's
+    previous announce.
+    """
+    registry = get_swarms()
+    swarm = registry.get(info_hash)
+    old = swarm.get(peer_id) if swarm is not None else None
+    old_record = old.record if old is not None else None
+    old_status = old.status if old is not None else None
+    peer = registry.update(info_hash, peer_id, ip, port, status)
+    stats = get_stats()
+    if status == COMPLETED and old_status != COMPLETED:
+        stats.complete(info_hash)
+    if uploaded is not None and (peer or old) is not None:
+        stats.transfer(info_hash, peer or old, uploaded, downloaded)
+        if info_hash not in registry:
+            # counted after the swarm of the last peer was dropped.
+            stats.forget(info_hash)
+    record = peer.record if peer is not None else None
+    if peer is None:
+        if old_record is not None:
+            get_db().delete(info_hash, peer_id)
+    elif record != old_record:
+        get_db().put(info_hash, peer_id, record)
+    # the other nodes see every announce, so they keep the peer alive.
+    federation = get_federation()
+    if federation is not None and (peer or old) is not None:
+        federation.record(info_hash, peer_id, record)
+
+
+async def announce_peer(info_hash, peer_id, ip, port, status=None,
+                        uploaded=None, downloaded=None):
+    """Store the information about the peer, from a coroutine.
+
+    Waits for the storage writer to catch up first if it lags behind,
+    the other requests being served meanwhile.
+    """
+    backlog = storage_backlog()
+    if backlog is not None:
+        STORAGE_BACKPRESSURE['wait'].inc()
+        await backlog
+    store_peer_info(info_hash, peer_id, ip, port, status, uploaded,
+                    downloaded)
+
+
+def expire_peer(info_hash, peer_id):
+    """Forget a peer that went silent.
+    """
+    get_swarms().remove(info_hash, peer_id)
+    get_db().delete(info_hash, peer_id)
+    federation = get_federation()
+    if federation is not None:
+        federation.expire(info_hash, peer_id)
 
-# TODO: add ipv6 support
-def get_peer_list(info_hash, numwant, compact, no_peer_id):
+
+def get_peer_list(info_hash, numwant, compact, no_peer_id, peer_id=None,
+                  left=None, event='', family=4):
     """Get all the peer's info with peer_id, ip and port.
     Eg: [{'peer_id':'#1223&&IJM', 'ip':'162.166.112.2', 'port': '7887'}, ...]
+
+    Peers are picked by the configured PeerSelector, never returning the
+    requesting peer_id. A compact list holds the peers of one address
+    family, sliced out of the swarm's packed peer buffers.
     """
-    db = get_db()
+    swarm = get_swarms().get(info_hash)
+    if swarm is None:
+        return b'' if compact else []
+    selector = Selector().get()
+    requester = swarm.get(peer_id)
     if compact:
-        byteswant = numwant * 6
-        compact_peers = b''
-        # make a compact peer list
-        if info_hash in db:
-            for peer_info in db[info_hash]:
-                ip = inet_aton(peer_info[1])
-                port = pack('>H', int(peer_info[2]))
-                compact_peers += (ip+port)
-        logging.debug('compact peer list: %r' % compact_peers[:byteswant])
-        return compact_peers[:byteswant]
+        selection = selector.select(swarm, numwant, family, requester, left,
+                                    event)
+        compact_peers = selection.compact()
+        logging.debug('compact peer list: %r', compact_peers)
+        return compact_peers
     else:
-        peers = []
-        if info_hash in db:
-            for peer_info in db[info_hash]:
-                p = {}
-                p['peer_id'], p['ip'], p['port'], _ = peer_info
-                if no_peer_id:
-                    del p['peer_id']
-                peers.append(p)
-        logging.debug('peer list: %r' % peers[:numwant])
-        return peers[:numwant]
+        peer_list = []
+        for family in (4, 6):
+            selection = selector.select(swarm, numwant - len(peer_list),
+                                        family, requester, left, event)
+            for peer in selection.peers():
+                p = {'ip': peer.ip, 'port': peer.port}
+                if not no_peer_id:
+                    p['peer_id'] = peer.peer_id
+                peer_list.append(p)
+        logging.debug('peer list: %r', peer_list)
+        return peer_list
+
+
+def get_compact_peers(info_hash, numwant, peer_id=None, left=None,
+                      event='', family=4):
+    """The compact `peers` (IPv4) and `peers6` (IPv6, BEP 7) lists of an
+    announce, as a dict. Peers of the requester's address family come
+    first, the other family gets what is left of numwant.
+    """
+    other = 6 if family == 4 else 4
+    first = get_peer_list(info_hash, numwant, 1, 0, peer_id, left, event,
+                          family)
+    numwant -= len(first) // COMPACT_WIDTH[family]
+    second = get_peer_list(info_hash, numwant, 1, 0, peer_id, left, event,
+                           other) if numwant > 0 else b''
+    lists = {family: first, other: second}
+    return {'peers': lists[4], 'peers6': lists[6]}
+
+
+async def select_peers(info_hash, numwant, compact, no_peer_id,
+                       peer_id=None, left=None, event='', family=4):
+    """The peer lists of an announce response, from a coroutine: the
+    compact `peers` and `peers6` or the dicts of `peers`.
+
+    The swarms are in memory, so this never waits, but a peer source
+    that has to is free to.
+    """
+    if compact:
+        return get_compact_peers(info_hash, numwant, peer_id, left, event,
+                                 family)
+    return {'peers': get_peer_list(info_hash, numwant, compact, no_peer_id,
+                                   peer_id, left, event)}
+
+
+# gauges of the swarms and the response cache, read on collection.
+registry.gauge('pytt_swarms', 'Torrents tracked.',
+               lambda: len(get_swarms()))
+registry.gauge('pytt_peers', 'Peers tracked, by kind.',
+               lambda: get_swarms().seeders, kind='seeder')
+registry.gauge('pytt_peers', 'Peers tracked, by kind.',
+               lambda: get_swarms().leechers, kind='leecher')
+registry.gauge('pytt_completed_downloads',
+               'Downloads completed since the tracker started.',
+               lambda: get_stats().completed)
+registry.gauge('pytt_transferred_bytes',
+               'Bytes reported transferred by the peers, by direction.',
+               lambda: get_stats().uploaded, direction='up')
+registry.gauge('pytt_transferred_bytes',
+               'Bytes reported transferred by the peers, by direction.',
+               lambda: get_stats().downloaded, direction='down')
+registry.gauge('pytt_storage_queue_depth',
+               'Peer changes waiting for the storage writer.',
+               lambda: len(get_db()) if isinstance(get_db(), StorageWriter)
+               else 0)
+for _stat in ('entries', 'bytes', 'hits', 'misses', 'evictions'):
+    registry.gauge('pytt_cache_' + _stat,
+                   'Response cache %s.' % _stat,
+                   lambda stat=_stat: get_cache().stats()[stat])
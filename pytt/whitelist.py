@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+#
+# Torrent whitelist for Pytt.
+#
+# By default Pytt tracks any info_hash it is announced. With a whitelist,
+# only the torrents found in a directory of .torrent files and/or a file
+# of hex info_hashes (one per line, `#` starts a comment) are tracked,
+# and the announces for any other info_hash are turned away before they
+# reach the swarms or the storage.
+#
+# Lookups go through a Bloom filter first: info_hashes are SHA1 digests,
+# so their own bytes serve as the hash functions and most unknown hashes
+# are rejected without even hashing the key. The few false positives are
+# caught by the exact set behind it.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+import binascii
+import glob
+import hashlib
+import logging
+import math
+import os
+import struct
+import threading
+
+from .bencode import BTFailure, bdecode, raw_value
+
+
+# two words of an info_hash, the seeds of its Bloom filter bits.
+_seeds = struct.Struct('<II')
+
+
+class BloomFilter(object):
+    """Bloom filter of 20-byte info_hashes, sized for `capacity` entries
+    at the given false positive rate.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = max(64, int(-capacity * math.log(error_rate) /
+                                math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, info_hash):
+        h1, h2 = _seeds.unpack_from(info_hash)
+        for i in range(self.hashes):
+            bit = (h1 + i * h2) % self.size
+            self.bits[bit >> 3] |= 1 << (bit & 7)
+
+    def __contains__(self, info_hash):
+        # double hashing, with two words of the digest itself.
+        h1, h2 = _seeds.unpack_from(info_hash)
+        bits = self.bits
+        size = self.size
+        for i in range(self.hashes):
+            bit = (h1 + i * h2) % size
+            if not bits[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+
+class Whitelist(object):
+    """The set of info_hashes allowed on the tracker.
+    """
+
+    def __init__(self, info_hashes=()):
+        self.info_hashes = frozenset(info_hashes)
+        self.bloom = BloomFilter(len(self.info_hashes))
+        for info_hash in self.info_hashes:
+            self.bloom.add(info_hash)
+
+    def __len__(self):
+        return len(self.info_hashes)
+
+    def __contains__(self, info_hash):
+        if len(info_hash) != 20 or info_hash not in self.bloom:
+            return False
+        return info_hash in self.info_hashes
+
+
+def torrent_info_hash(path):
+    """The raw info_hash of a .torrent file: the SHA1 of its info dict,
+    as bencoded in the file. Encoding the decoded dict again would change
+    the bytes of a torrent with unsorted or duplicate keys.
+    """
+    with open(path, 'rb') as f:
+        metainfo = f.read()
+    # the whole file must be valid.
+    bdecode(metainfo)
+    info = raw_value(metainfo, b'info')
+    if info is None:
+        raise KeyError('info')
+    return hashlib.sha1(info).digest()
+
+
+def load_torrent_dir(path):
+    """The info_hashes of the .torrent files of a directory.
+    """
+    info_hashes = set()
+    for torrent in glob.glob(os.path.join(path, '*.torrent')):
+        try:
+            info_hashes.add(torrent_info_hash(torrent))
+        except (IOError, KeyError, TypeError, BTFailure) as ex:
+            logging.warning('skipping torrent %s: %s', torrent, ex)
+    return info_hashes
+
+
+def load_hash_list(path):
+    """The info_hashes listed in a file, in hex, one per line.
+    """
+    info_hashes = set()
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            try:
+                info_hash = binascii.unhexlify(line)
+            except (TypeError, ValueError, binascii.Error):
+                info_hash = b''
+            if len(info_hash) != 20:
+                logging.warning('skipping invalid info_hash %r in %s',
+                                line, path)
+                continue
+            info_hashes.add(info_hash)
+    return info_hashes
+
+
+class TorrentRegistry(object):
+    """The whitelist built from a torrent directory and/or a hash list,
+    reloaded when they change.
+
+    `reload()` is meant to be called periodically: it only checks the
+    modification times and rebuilds the whitelist in a background thread
+    when they moved, the previous whitelist serving meanwhile.
+    """
+
+    def __init__(self, torrent_dir=None, hash_list=None):
+        self.torrent_dir = torrent_dir
+        self.hash_list = hash_list
+        self.stamp = self.sources_stamp()
+        self.whitelist = self.build()
+        self.loading = None
+
+    def __contains__(self, info_hash):
+        return info_hash in self.whitelist
+
+    def __len__(self):
+        return len(self.whitelist)
+
+    def sources_stamp(self):
+        """The modification times of the whitelist sources.
+        """
+        stamp = []
+        paths = []
+        if self.torrent_dir:
+            paths.append(self.torrent_dir)
+            paths.extend(glob.glob(os.path.join(self.torrent_dir,
+                                                '*.torrent')))
+        if self.hash_list:
+            paths.append(self.hash_list)
+        for path in sorted(paths):
+            try:
+                stamp.append((path, os.stat(path).st_mtime))
+            except OSError:
+                stamp.append((path, None))
+        return stamp
+
+    def build(self):
+        info_hashes = set()
+        if self.torrent_dir and os.path.isdir(self.torrent_dir):
+            info_hashes.update(load_torrent_dir(self.torrent_dir))
+        if self.hash_list and os.path.exists(self.hash_list):
+            info_hashes.update(load_hash_list(self.hash_list))
+        logging.info('whitelist of %d torrents loaded', len(info_hashes))
+        return Whitelist(info_hashes)
+
+    def reload(self, wait=False):
+        """Rebuild the whitelist if its sources changed.
+        """
+        if self.loading is not None and self.loading.is_alive():
+            return
+        stamp = self.sources_stamp()
+        if stamp == self.stamp:
+            return
+        self.stamp = stamp
+
+        def load():
+            self.whitelist = self.build()
+        self.loading = threading.Thread(target=load,
+                                        name='pytt-whitelist-loader')
+        self.loading.daemon = True
+        self.loading.start()
+        if wait:
+            self.loading.join()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+#
+# Multi-process mode of Pytt.
+#
+# The tracker forks N workers sharing the listening sockets, the kernel
+# spreads the connections between them. Every info_hash belongs to a
+# single worker, its shard, which keeps the whole swarm: a worker that
+# receives a request for another shard forwards it to the owner over a
+# private loopback listener. Seeder and leecher counts stay exact and
+# each worker has its own database.
+#
+# The forwarded requests go over keep-alive HTTP/1.1 connections, pooled
+# by shard, so most of them don't pay for a new connection, with up to
+# MAX_CONNECTIONS of them in flight to every shard.
+#
+# A scrape of every torrent merges the listings of all the shards. Each
+# worker lists its torrents in info_hash order, and the others fetch the
+# listing a page at a time, after the last info_hash they got, so only a
+# page of every shard is held while the merged listing is streamed.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+import binascii
+from collections import deque
+import heapq
+from io import BytesIO
+import logging
+import socket
+import zlib
+
+import tornado.gen
+import tornado.http1connection
+import tornado.httpclient
+import tornado.httputil
+import tornado.iostream
+import tornado.locks
+import tornado.tcpclient
+
+from .bencode import BTFailure, bdecode, bencode
+
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
+
+
+# Headers carrying the client address on forwarded requests. They are
+# only trusted on the loopback listeners.
+REMOTE_IP_HEADER = 'X-Pytt-Remote-IP'
+REMOTE_PORT_HEADER = 'X-Pytt-Remote-Port'
+
+# Torrents in a page of the scrape listing of a shard.
+PAGE_SIZE = 1000
+
+# Most requests in flight to a shard, on as many connections.
+MAX_CONNECTIONS = 64
+
+# Seconds to connect to a shard, or to get each part of its response.
+TIMEOUT = 20.0
+
+
+class ShardUnavailable(Exception):
+    """Raised when a shard can't be reached or sends an invalid response.
+    """
+
+
+def shard_of(info_hash, workers):
+    """The shard a raw info_hash belongs to.
+    """
+    return zlib.crc32(info_hash) % workers
+
+
+class Shards(object):
+    """Routes info_hashes to the worker owning their swarm.
+
+    Worker n serves its shard to the other workers on 127.0.0.1 at
+    `base_port + n`.
+    """
+
+    def __init__(self, workers, task_id, base_port):
+        self.workers = workers
+        self.task_id = task_id
+        self.base_port = base_port
+        # shard: ShardConnections
+        self.connections = {}
+
+    def owner(self, info_hash):
+        return shard_of(info_hash, self.workers)
+
+    def is_local(self, info_hash):
+        return self.owner(info_hash) == self.task_id
+
+    def port(self, shard):
+        """The loopback port of a shard.
+        """
+        return self.base_port + shard
+
+    def url(self, shard, uri):
+        return 'http://127.0.0.1:%d%s' % (self.port(shard), uri)
+
+    async def fetch(self, shard, uri, remote_ip, remote_port=None,
+                    body=None):
+        """Forward a request to a shard. Returns the HTTPResponse,
+        whatever its status code, with the code 599 if the shard couldn't
+        be reached.
+        """
+        headers = {REMOTE_IP_HEADER: remote_ip}
+        if remote_port is not None:
+            headers[REMOTE_PORT_HEADER] = str(remote_port)
+        request = tornado.httpclient.HTTPRequest(
+            self.url(shard, uri), method='GET' if body is None else 'POST',
+            headers=headers, body=body)
+        connections = self.connections.get(shard)
+        if connections is None:
+            connections = self.connections[shard] = ShardConnections(
+                self.port(shard))
+        try:
+            return await connections.fetch(request, uri)
+        except (socket.error, tornado.iostream.StreamClosedError,
+                tornado.gen.TimeoutError) as ex:
+            return tornado.httpclient.HTTPResponse(request, 599, error=ex)
+
+    def split(self, info_hashes):
+        """Group info_hashes by shard, as a {shard: [info_hash]} dict.
+        """
+        shards = {}
+        for info_hash in info_hashes:
+            shards.setdefault(self.owner(info_hash), []).append(info_hash)
+        return shards
+
+    async def forward_udp(self, shard, data, addr):
+        """Have a shard handle a UDP tracker datagram from addr.
+        Returns the response datagram, or None.
+        """
+        response = await self.fetch(shard, '/udp', addr[0], addr[1], data)
+        if response.code != 200 or not response.body:
+            return None
+        return response.body
+
+
+class ResponseReader(tornado.httputil.HTTPMessageDelegate):
+    """Collects the response to a forwarded request.
+    """
+
+    def __init__(self):
+        self.start_line = None
+        self.headers = None
+        self.chunks = []
+        self.finished = False
+
+    def headers_received(self, start_line, headers):
+        self.start_line = start_line
+        self.headers = headers
+
+    def data_received(self, chunk):
+        self.chunks.append(chunk)
+
+    def finish(self):
+        self.finished = True
+
+
+class ShardConnections(object):
+    """Keep-alive connections to the loopback listener of a shard.
+
+    A request takes an idle connection, or opens a new one, and gives it
+    back once the response is read. At most `max_connections` requests
+    are in flight, the others wait for one of them to finish.
+    """
+
+    def __init__(self, port, max_connections=MAX_CONNECTIONS):
+        self.port = port
+        self.idle = []
+        self.slots = tornado.locks.Semaphore(max_connections)
+        self.client = tornado.tcpclient.TCPClient()
+        self.params = tornado.http1connection.HTTP1ConnectionParameters(
+            header_timeout=TIMEOUT, body_timeout=TIMEOUT)
+
+    async def fetch(self, request, uri):
+        """Send an HTTPRequest for uri to the shard. Returns the
+        HTTPResponse, raises socket.error, StreamClosedError or
+        TimeoutError if the shard couldn't be reached.
+        """
+        async with self.slots:
+            if self.idle:
+                try:
+                    return await self.exchange(self.idle.pop(), request, uri)
+                except tornado.iostream.StreamClosedError:
+                    # closed by the shard while idle, try a new one.
+                    pass
+            stream = await self.client.connect('127.0.0.1', self.port,
+                                               timeout=TIMEOUT)
+            stream.set_nodelay(True)
+            return await self.exchange(stream, request, uri)
+
+    async def exchange(self, stream, request, uri):
+        """Send the request over a connection and read the response. The
+        connection is kept for the next requests unless it is closed.
+        """
+        connection = tornado.http1connection.HTTP1Connection(
+            stream, True, self.params)
+        headers = tornado.httputil.HTTPHeaders(request.headers)
+        headers['Host'] = '127.0.0.1:%d' % self.port
+        if request.body is not None:
+            headers['Content-Length'] = str(len(request.body))
+        reader = ResponseReader()
+        try:
+            await connection.write_headers(
+                tornado.httputil.RequestStartLine(request.method, uri,
+                                                  'HTTP/1.1'),
+                headers, request.body)
+            connection.finish()
+            await connection.read_response(reader)
+            if not reader.finished:
+                # timed out or malformed, the connection was closed.
+                raise tornado.iostream.StreamClosedError()
+        except BaseException:
+            stream.close()
+            raise
+        if stream.closed() or \
+                reader.headers.get('Connection', '').lower() == 'close':
+            stream.close()
+        else:
+            self.idle.append(stream)
+        return tornado.httpclient.HTTPResponse(
+            request, reader.start_line.code, reason=reader.start_line.reason,
+            headers=reader.headers, buffer=BytesIO(b''.join(reader.chunks)))
+
+
+def scrape_uri(info_hashes):
+    """The /scrape URI for raw info_hashes.
+    """
+    return '/scrape?' + '&'.join('info_hash=' + quote(info_hash, safe='')
+                                 for info_hash in info_hashes)
+
+
+def listing_uri(after, limit):
+    """The /scrape URI of the page of a shard's listing starting after
+    the raw info_hash `after`.
+    """
+    return '/scrape?after=%s&limit=%d' % (
+        binascii.hexlify(after).decode('ascii'), limit)
+
+
+def scrape_files(response):
+    """The `files` dict of the scrape response of a shard. Raises
+    ShardUnavailable if the shard failed.
+    """
+    if response.code != 200 or response.body is None:
+        raise ShardUnavailable('shard scrape failed: %d %s' %
+                               (response.code, response.reason))
+    try:
+        files = bdecode(response.body)[b'files']
+    except (BTFailure, KeyError, TypeError):
+        raise ShardUnavailable('invalid shard scrape response')
+    if not isinstance(files, dict):
+        raise ShardUnavailable('invalid shard scrape response')
+    return files
+
+
+class LocalListing(object):
+    """The scrape listing of this worker: its sorted info_hashes, with
+    their bencoded entries made by `entry`.
+    """
+
+    def __init__(self, info_hashes, entry):
+        self.info_hashes = iter(info_hashes)
+        self.entry = entry
+
+    async def next(self):
+        """The next (info_hash, bencoded entry), or None at the end.
+        """
+        info_hash = next(self.info_hashes, None)
+        if info_hash is None:
+            return None
+        return info_hash, self.entry(info_hash)
+
+
+class ShardListing(object):
+    """The scrape listing of another shard, fetched a page at a time.
+    """
+    page_size = PAGE_SIZE
+
+    def __init__(self, shards, shard, remote_ip):
+        self.shards = shards
+        self.shard = shard
+        self.remote_ip = remote_ip
+        self.after = b''
+        self.entries = deque()
+        self.done = False
+
+    async def next(self):
+        """The next (info_hash, bencoded entry), or None at the end.
+        Raises ShardUnavailable if a page can't be fetched.
+        """
+        if not self.entries and not self.done:
+            await self.fetch()
+        if not self.entries:
+            return None
+        return self.entries.popleft()
+
+    async def fetch(self):
+        response = await self.shards.fetch(
+            self.shard, listing_uri(self.after, self.page_size),
+            self.remote_ip)
+        files = scrape_files(response)
+        for info_hash in sorted(files):
+            self.entries.append((info_hash, bencode(files[info_hash])))
+        self.done = len(files) < self.page_size
+        if files:
+            self.after = self.entries[-1][0]
+
+
+async def merge_listings(listings):
+    """Merge scrape listings into one in info_hash order, as an async
+    generator of (info_hash, bencoded entry).
+
+    The first entry of every listing is fetched before returning, so a
+    shard that can't be reached raises ShardUnavailable before anything
+    is sent. A listing failing midway is left out of the rest of the
+    merge, to still end the response properly.
+    """
+    heap = []
+    for n, listing in enumerate(listings):
+        item = await listing.next()
+        if item is not None:
+            heap.append((item[0], n, item[1]))
+    heapq.heapify(heap)
+
+    async def merged():
+        last = None
+        while heap:
+            info_hash, n, entry = heap[0]
+            # a torrent left on the wrong shard by an older number of
+            # workers is only listed once.
+            if info_hash != last:
+                yield info_hash, entry
+                last = info_hash
+            try:
+                item = await listings[n].next()
+            except ShardUnavailable as ex:
+                logging.warning('scrape listing incomplete: %s', ex)
+                item = None
+            if item is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (item[0], n, item[1]))
+    return merged()
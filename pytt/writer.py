@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+#
+# Background storage writer for Pytt.
+#
+# The announce handlers only queue their changes: a writer thread applies
+# them to the storage engine in batches, so a slow disk never stalls the
+# IOLoop. Changes to the same peer are coalesced while they wait, only
+# the latest one is written. The queue is bounded: once it holds
+# `max_pending` peers, the HTTP announces wait for the writer to catch up
+# and the UDP ones are dropped, to be retried by the clients.
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+import logging
+import threading
+import time
+
+import tornado.concurrent
+import tornado.ioloop
+
+from .metrics import STORAGE_BATCH_LATENCY, STORAGE_COALESCED, STORAGE_WRITES
+from .storage import StorageEngine
+
+
+class StorageWriter(StorageEngine):
+    """Queues the changes of a storage engine and applies them on a
+    background thread, every `flush_interval` seconds or as soon as
+    `batch_size` peers are waiting.
+    """
+
+    def __init__(self, engine, max_pending=100000, batch_size=1000,
+                 flush_interval=0.5):
+        self.engine = engine
+        self.name = engine.name
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # (info_hash, peer_id): record, or None for a deletion.
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.sync_requested = False
+        self.closed = False
+        self.thread = None
+        # Futures of the requests waiting for room in the queue.
+        self.waiters = []
+        self.io_loop = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    @property
+    def full(self):
+        return len(self.pending) >= self.max_pending
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run,
+                                       name='pytt-storage-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def load(self):
+        return self.engine.load()
+
+    def queue(self, key, record):
+        with self.lock:
+            if key in self.pending:
+                STORAGE_COALESCED.inc()
+            self.pending[key] = record
+            size = len(self.pending)
+        if self.thread is None:
+            self.start()
+        if size >= self.batch_size:
+            self.wakeup.set()
+
+    def put(self, info_hash, peer_id, record):
+        self.queue((info_hash, peer_id), record)
+
+    def delete(self, info_hash, peer_id):
+        self.queue((info_hash, peer_id), None)
+
+    def sync(self):
+        """Have the queued changes written and made durable, without
+        waiting for it.
+        """
+        self.sync_requested = True
+        self.wakeup.set()
+
+    def wait(self):
+        """A Future resolved once the queue has room again.
+        """
+        future = tornado.concurrent.Future()
+        self.io_loop = tornado.ioloop.IOLoop.current()
+        self.waiters.append(future)
+        self.wakeup.set()
+        return future
+
+    def release(self):
+        waiters, self.waiters = self.waiters, []
+        for future in waiters:
+            if not future.done():
+                future.set_result(None)
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            with self.lock:
+                batch, self.pending = self.pending, {}
+                sync, self.sync_requested = self.sync_requested, False
+                closed = self.closed
+            try:
+                self.apply(batch)
+                if sync and not closed:
+                    self.engine.sync()
+            except Exception:
+                logging.exception('error writing to the %s storage',
+                                  self.name)
+            if self.waiters and self.io_loop is not None:
+                self.io_loop.add_callback(self.release)
+            if closed:
+                return
+
+    def apply(self, batch):
+        """Write a batch of changes to the engine.
+        """
+        if not batch:
+            return
+        started = time.time()
+        engine = self.engine
+        for (info_hash, peer_id), record in batch.items():
+            if record is None:
+                engine.delete(info_hash, peer_id)
+            else:
+                engine.put(info_hash, peer_id, record)
+        STORAGE_WRITES.inc(len(batch))
+        STORAGE_BATCH_LATENCY.observe(time.time() - started)
+
+    def close(self):
+        """Write everything still queued and close the engine.
+        """
+        if self.thread is not None:
+            with self.lock:
+                self.closed = True
+            self.wakeup.set()
+            self.thread.join()
+            self.thread = None
+        self.apply(self.pending)
+        self.pending = {}
+        self.engine.close()
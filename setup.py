@@ -11,11 +11,14 @@ from setuptools import setup, find_packages
 setup(
     name = "Pytt",
     version = "0.1.7",
-    packages = find_packages(),
+    packages = find_packages(exclude=['benchmarks', 'benchmarks.*',
+                                      'tests', 'tests.*']),
     install_requires = ['setuptools',
-                        'tornado >= 4.0',
+                        'tornado >= 6.0',
                         ],
-    extras_require = {'test': ['nose']},
+    extras_require = {'test': ['pytest'],
+                      'uvloop': ['uvloop']},
+    python_requires = '>=3.6',
     scripts = ['scripts/pytt'],
 
     # metadata for upload to PyPI
@@ -33,10 +36,7 @@ setup(
         "Programming Language :: Python",
         "Framework :: Tornado"
         "License :: OSI Approved :: Apache Software License",
-        "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.3",
-        "Programming Language :: Python :: 3.4",
     ],
     long_description = """Pytt is a simple BitTorrent tracker written
                         using Tornado non-blocking web server.
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+#
+# Common base of the Pytt TestCases
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from configparser import RawConfigParser
+except ImportError:
+    from ConfigParser import RawConfigParser
+
+from pytt import utils
+
+
+class TrackerTestCase(unittest.TestCase):
+    """Gives every test a config and a database of its own, in a
+    temporary directory, and closes the tracker state after it.
+
+    `options` is a list of (section, option, value) set in the config
+    before the test. Mix it in first with other TestCases.
+    """
+    options = []
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.paths = utils.CONFIG_PATH, utils.DB_PATH
+        utils.CONFIG_PATH = os.path.join(self.tmpdir, 'pytt.conf')
+        utils.DB_PATH = os.path.join(self.tmpdir, 'pytt.db')
+        utils.create_config(utils.CONFIG_PATH)
+        for section, option, value in self.options:
+            self.set_option(section, option, value)
+        utils.close_db()
+        utils.Config().close()
+        utils.Statistics().close()
+        super(TrackerTestCase, self).setUp()
+
+    def tearDown(self):
+        super(TrackerTestCase, self).tearDown()
+        utils.close_db()
+        utils.Config().close()
+        utils.Statistics().close()
+        utils.CONFIG_PATH, utils.DB_PATH = self.paths
+        shutil.rmtree(self.tmpdir)
+
+    def set_option(self, section, option, value):
+        """Change an option of the config file.
+        """
+        config = RawConfigParser()
+        config.read(utils.CONFIG_PATH)
+        config.set(section, option, value)
+        with open(utils.CONFIG_PATH, 'w') as f:
+            config.write(f)
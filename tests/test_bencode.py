@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# TestCases for the Pytt bencode module
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+
+from collections import OrderedDict
+import unittest
+
+from pytt.bencode import (bencode, bdecode, raw_value, key_cache, Bencached,
+                          BTFailure)
+
+
+class TestBencode(unittest.TestCase):
+    """Test cases for the bencode encoder
+    """
+    def test_types(self):
+        self.assertEqual(bencode(42), b'i42e')
+        self.assertEqual(bencode(-3), b'i-3e')
+        self.assertEqual(bencode(True), b'i1e')
+        self.assertEqual(bencode('spam'), b'4:spam')
+        self.assertEqual(bencode(b'\x00\xff'), b'2:\x00\xff')
+        self.assertEqual(bencode(['a', 1, [b'b']]), b'l1:ai1el1:bee')
+        self.assertEqual(bencode(Bencached(b'i7e')), b'i7e')
+
+    def test_utf8_length(self):
+        """String lengths count the encoded bytes.
+        """
+        self.assertEqual(bencode(u'\xe9'), b'2:\xc3\xa9')
+
+    def test_dict_keys(self):
+        """Keys are sorted as raw strings, str and bytes alike.
+        """
+        self.assertEqual(bencode({'b': 1, 'a': 2}), b'd1:ai2e1:bi1ee')
+        self.assertEqual(bencode({b'b': 1, 'a': 2, b'\x00': 3}),
+                         b'd1:\x00i3e1:ai2e1:bi1ee')
+        self.assertEqual(bencode({'peers': Bencached(b'0:')}),
+                         b'd5:peers0:e')
+
+    def test_key_cache(self):
+        """Only the str keys of the responses are cached.
+        """
+        self.assertEqual(bencode({b'\x01' * 20: {'complete': 1}}),
+                         b'd20:' + b'\x01' * 20 + b'd8:completei1eee')
+        self.assertIn('complete', key_cache)
+        self.assertNotIn(b'\x01' * 20, key_cache)
+
+    def test_subclasses(self):
+        """Subclasses of the supported types are encoded like them.
+        """
+        self.assertEqual(bencode(OrderedDict([('b', 1), ('a', 2)])),
+                         b'd1:ai2e1:bi1ee')
+        self.assertRaises(BTFailure, bencode, object())
+
+
+class TestBdecode(unittest.TestCase):
+    """Test cases for the bdecode decoder, recursive and iterative
+    """
+    data = bencode({'announce': 'http://tracker/announce',
+                    'info': {'length': 10 ** 12, 'name': b'\xff',
+                             'files': [{'path': ['a', 'b']}]},
+                    'offsets': [0, -1]})
+
+    def test_roundtrip(self):
+        for iterative in (False, True):
+            r = bdecode(self.data, iterative=iterative)
+            self.assertEqual(r[b'info'][b'length'], 10 ** 12)
+            self.assertEqual(r[b'info'][b'files'][0][b'path'], [b'a', b'b'])
+            self.assertEqual(bencode(r), self.data)
+
+    def test_zero_copy(self):
+        """Strings come back as slices of the input.
+        """
+        r = bdecode(memoryview(self.data), zero_copy=True)
+        name = r[b'info'][b'name']
+        self.assertIsInstance(name, memoryview)
+        self.assertIs(name.obj, self.data)
+        self.assertEqual(name.tobytes(), b'\xff')
+
+    def test_invalid(self):
+        for data in [b'i-0e', b'i03e', b'i 1e', b'ie', b'01:a', b'2:a',
+                     b'l', b'd1:ai1e', b'di1ei1ee', b'i1ei2e', b'x', b'']:
+            for iterative in (False, True):
+                self.assertRaises(BTFailure, bdecode, data,
+                                  iterative=iterative)
+
+    def test_limits(self):
+        deep = b'l' * 100000 + b'e' * 100000
+        for iterative in (False, True):
+            self.assertRaises(BTFailure, bdecode, deep, iterative=iterative)
+        for iterative in (False, True):
+            self.assertEqual(len(bdecode(deep, iterative=iterative,
+                                         max_depth=100000)), 1)
+        self.assertRaises(BTFailure, bdecode, b'5:abcde', max_string=4)
+        self.assertRaises(BTFailure, bdecode, self.data, max_size=10)
+
+    def test_raw_value(self):
+        """Values come back as they are bencoded in the input.
+        """
+        data = b'd4:infod1:bi1e1:ai2ee1:xi3ee'
+        self.assertEqual(raw_value(data, b'info'), b'd1:bi1e1:ai2ee')
+        self.assertEqual(raw_value(data, b'x'), b'i3e')
+        self.assertIsNone(raw_value(data, b'missing'))
+        deep = b'l' * 10000 + b'e' * 10000
+        self.assertEqual(raw_value(b'd4:info' + deep + b'e', b'info',
+                                   max_depth=10001), deep)
+        for data in [b'li1ee', b'd4:info', b'']:
+            self.assertRaises(BTFailure, raw_value, data, b'info')
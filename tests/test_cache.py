@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+#
+# TestCases for the Pytt response cache
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+
+import unittest
+
+from pytt.cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+    """Test cases for the versioned LRU cache of bencoded fragments
+    """
+    def test_versions(self):
+        """An entry is only served for the version it was built from.
+        """
+        cache = ResponseCache()
+        self.assertEqual(cache.fetch('hash', 1, lambda: b'one'), b'one')
+        self.assertEqual(cache.fetch('hash', 1, lambda: b'two'), b'one')
+        self.assertEqual(cache.fetch('hash', 2, lambda: b'two'), b'two')
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertEqual(cache.size, 3)
+
+    def test_lru_eviction(self):
+        """The least recently used entries go past the memory cap.
+        """
+        cache = ResponseCache(max_bytes=10)
+        cache.put('a', 1, b'aaaa')
+        cache.put('b', 1, b'bbbb')
+        cache.get('a', 1)
+        cache.put('c', 1, b'cccc')
+        self.assertIsNone(cache.get('b', 1))
+        self.assertEqual(cache.get('a', 1), b'aaaa')
+        self.assertEqual((cache.size, cache.evictions), (8, 1))
+        cache.put('d', 1, b'd' * 11)
+        self.assertIsNone(cache.get('d', 1))
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+#
+# TestCases for the federation of Pytt trackers
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+
+import asyncio
+import hashlib
+import hmac
+import socket
+import struct
+import unittest
+import zlib
+
+from tornado.tcpclient import TCPClient
+from tornado.testing import AsyncTestCase, bind_unused_port, gen_test
+
+from pytt import utils
+from pytt.bencode import BTFailure, bencode
+from pytt.federation import FederationNode, FederationServer
+from pytt.settings import to_addresses
+from pytt.swarm import SwarmRegistry
+
+from . import TrackerTestCase
+
+
+HASH = b'\x01' * 20
+
+
+def peer_id(n):
+    return b'-PT0001-%012d' % n
+
+
+PEER, PEER_A, PEER_B = peer_id(0), peer_id(10), peer_id(11)
+
+# a change made by a valid announce.
+CHANGE = [HASH, PEER, 1000, b'10.0.0.1', 6881, b'started']
+
+
+def batch(changes, secret=b''):
+    """A frame of changes, as node a would send it.
+    """
+    payload = zlib.compress(bencode({'node': 'a', 'changes': changes}))
+    frame = struct.pack('>I', len(payload)) + payload
+    if secret:
+        frame += hmac.new(secret, payload, hashlib.sha256).digest()
+    return frame
+
+
+class TestMerge(unittest.TestCase):
+    """Changes are merged with last-writer-wins
+    """
+    def setUp(self):
+        self.registry = SwarmRegistry()
+        self.node = FederationNode(self.registry, node_id='b')
+
+    def test_last_writer_wins(self):
+        old = ('10.0.0.1', '6881', 'started')
+        new = ('10.0.0.2', '6881', 'completed')
+        changes = [(HASH, PEER, 2000, new),
+                   (HASH, PEER, 1000, old)]
+        self.assertEqual(self.node.merge('a', changes), 1)
+        peer = self.registry.get(HASH).get(PEER)
+        self.assertEqual(peer.record, new)
+        self.assertEqual(peer.last_seen, 2.0)
+        # a tie goes to the highest node id.
+        self.node.merge('c', [(HASH, PEER, 2000, old)])
+        self.assertEqual(self.registry.get(HASH).get(PEER).record, old)
+
+    def test_tombstone(self):
+        self.node.merge('a', [(HASH, PEER, 1000,
+                               ('10.0.0.1', '6881', 'started'))])
+        self.node.merge('a', [(HASH, PEER, 3000, None)])
+        self.assertNotIn(HASH, self.registry)
+        # a late change doesn't bring the peer back.
+        self.node.merge('c', [(HASH, PEER, 2000,
+                               ('10.0.0.1', '6881', 'started'))])
+        self.assertNotIn(HASH, self.registry)
+        self.node.collect(now=float('inf'))
+        self.assertEqual(self.node.versions, {})
+
+    def test_local_changes_win_over_older_ones(self):
+        self.node.record(HASH, PEER, ('10.0.0.1', '6881', 'started'),
+                         now=5)
+        self.assertEqual(self.node.merge('z', [(HASH, PEER, 4000,
+                                               None)]), 0)
+        self.assertEqual(list(self.node.pending),
+                         [(HASH, PEER)])
+
+    def test_frames(self):
+        self.node.secret = b'secret'
+        self.node.batch_size = 2
+        changes = dict(((HASH, peer_id(i)),
+                        (1000 + i, ('10.0.0.%d' % i, '6881', 'started')))
+                       for i in range(3))
+        changes[(HASH, peer_id(5))] = (1005, None)
+        frames = self.node.encode(changes)
+        self.assertEqual([count for count, _ in frames], [2, 2])
+        decoded = []
+        for _, frame in frames:
+            payload, digest = frame[4:-32], frame[-32:]
+            node_id, batch = self.node.decode(payload, digest)
+            self.assertEqual(node_id, 'b')
+            decoded.extend(batch)
+        self.assertIn((HASH, peer_id(2), 1002,
+                       ('10.0.0.2', '6881', 'started')), decoded)
+        self.assertIn((HASH, peer_id(5), 1005, None), decoded)
+        self.assertRaises(BTFailure, self.node.decode, payload, b'x' * 32)
+
+    def test_invalid_changes(self):
+        """A batch with an invalid change is rejected whole.
+        """
+        for field, value in ((0, b'short'), (1, 'peer'), (2, -1),
+                             (3, b'10.0.0.256'), (3, b'\xff'), (4, 0),
+                             (4, 70000), (5, b'stopped')):
+            change = list(CHANGE)
+            change[field] = value
+            frame = batch([CHANGE, change])
+            self.assertRaises(BTFailure, self.node.decode, frame[4:])
+        self.assertRaises(BTFailure, self.node.decode,
+                          batch([CHANGE[:4]])[4:])
+        node_id, changes = self.node.decode(batch([CHANGE])[4:])
+        self.assertEqual(changes, [(HASH, PEER, 1000,
+                                    ('10.0.0.1', '6881', 'started'))])
+
+    def test_addresses(self):
+        self.assertEqual(to_addresses('node1:18180, [::1]:18181,'),
+                         (('node1', 18180), ('::1', 18181)))
+        self.assertRaises(ValueError, to_addresses, 'node1')
+
+
+class TestFederation(AsyncTestCase):
+    """Several nodes replicating their swarms on localhost
+    """
+    def setUp(self):
+        super(TestFederation, self).setUp()
+        self.nodes = []
+        sockets = [bind_unused_port() for _ in range(3)]
+        self.addresses = addresses = [('127.0.0.1', port)
+                                      for _, port in sockets]
+        for n, (sock, _) in enumerate(sockets):
+            node = FederationNode(SwarmRegistry(),
+                                  addresses[:n] + addresses[n + 1:],
+                                  node_id='node%d' % n, secret='secret')
+            node.server = FederationServer(node)
+            node.server.add_sockets([sock])
+            self.nodes.append(node)
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.stop()
+        super(TestFederation, self).tearDown()
+
+    async def converge(self, check):
+        """Flush every node until check passes.
+        """
+        for _ in range(50):
+            for node in self.nodes:
+                await node.flush()
+            await asyncio.sleep(0.01)
+            if check():
+                return
+        self.fail('the nodes did not converge')
+
+    def peers(self, node):
+        swarm = node.registry.get(HASH)
+        if swarm is None:
+            return {}
+        return dict((peer.peer_id, peer.record) for peer in swarm)
+
+    @gen_test
+    async def test_replication(self):
+        a, b, c = self.nodes
+        for node, peer_id, ip in ((a, PEER_A, '10.0.0.1'),
+                                  (b, PEER_B, '10.0.0.2')):
+            peer = node.registry.update(HASH, peer_id, ip, '6881',
+                                        'started')
+            node.record(HASH, peer_id, peer.record)
+        await self.converge(lambda: all(len(self.peers(node)) == 2
+                                        for node in self.nodes))
+        self.assertEqual(self.peers(c)[PEER_A],
+                         ('10.0.0.1', '6881', 'started'))
+        # the peer moves to another node, which now has the last word.
+        peer = c.registry.update(HASH, PEER_A, '10.0.0.1', '6881',
+                                 'completed')
+        c.record(HASH, PEER_A, peer.record)
+        await self.converge(lambda: self.peers(a).get(PEER_A) ==
+                            ('10.0.0.1', '6881', 'completed'))
+        b.registry.remove(HASH, PEER_B)
+        b.record(HASH, PEER_B, None)
+        await self.converge(lambda: all(PEER_B not in self.peers(node)
+                                        for node in self.nodes))
+
+    @gen_test
+    async def test_snapshot_on_connect(self):
+        """A node joining late gets the peers announced before.
+        """
+        a, b, c = self.nodes
+        for n in range(3):
+            peer = a.registry.update(HASH, peer_id(n), '10.0.0.1',
+                                     str(6881 + n), 'started')
+            a.record(HASH, peer_id(n), peer.record)
+        # c misses the first batch.
+        a.nodes.remove(self.addresses[2])
+        await self.converge(lambda: len(self.peers(b)) == 3)
+        self.assertEqual(self.peers(c), {})
+        a.nodes.append(self.addresses[2])
+        await self.converge(lambda: len(self.peers(c)) == 3)
+
+    @gen_test
+    async def test_unreachable_node(self):
+        """A node that never answers doesn't hold up the others.
+        """
+        a, b, c = self.nodes
+        # a listener with a full accept queue, connecting to it hangs.
+        sock, port = bind_unused_port()
+        sock.listen(0)
+        self.addCleanup(sock.close)
+        filler = socket.create_connection(('127.0.0.1', port))
+        self.addCleanup(filler.close)
+        a.nodes = [('127.0.0.1', port), self.addresses[1]]
+        a.timeout = 0.2
+        for n in range(2):
+            peer = a.registry.update(HASH, peer_id(n), '10.0.0.1', '6881',
+                                     'started')
+            a.record(HASH, peer_id(n), peer.record)
+            await a.flush()
+            await self.converge(lambda: len(self.peers(b)) == n + 1)
+        link = a.links[('127.0.0.1', port)]
+        self.assertEqual(link.failures, 1)
+        self.assertIsNone(link.stream)
+
+    @gen_test
+    async def test_invalid_batch(self):
+        """A node sending an invalid batch is hung up on.
+        """
+        change = list(CHANGE)
+        change[3] = b'nowhere'
+        stream = await TCPClient().connect(*self.addresses[0])
+        await stream.write(batch([CHANGE, change], b'secret'))
+        await stream.read_until_close()
+        # and nothing of the batch is merged.
+        self.assertEqual(self.peers(self.nodes[0]), {})
+
+
+class TestFederatedPeerList(TrackerTestCase):
+    """The announces are replicated and get the federated peers
+    """
+    options = [('federation', 'enabled', 'yes'),
+               ('federation', 'node_id', 'local')]
+
+    def test_federated_peers(self):
+        info_hash, peer_id = b'\x01' * 20, b'-BT0001-000000000001'
+        utils.store_peer_info(info_hash, peer_id, '10.0.0.1', '6881',
+                              'started')
+        federation = utils.get_federation()
+        self.assertEqual(list(federation.pending), [(info_hash, peer_id)])
+        federation.merge('remote', [(info_hash, b'-BT0001-000000000002',
+                                     federation.versions[(
+                                         info_hash, peer_id)][0],
+                                     ('10.0.0.2', '6882', 'completed'))])
+        self.assertEqual(utils.get_peer_list(info_hash, 50, 1, 0, peer_id),
+                         b'\x0a\x00\x00\x02\x1a\xe2')
+        self.assertEqual(utils.scrape_counts(info_hash), (1, 0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
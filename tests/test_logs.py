@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#
+# TestCases for the Pytt logging pipeline
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+
+import logging
+import unittest
+
+from pytt.logs import (AccessSampler, DroppingQueueHandler, LogPipeline,
+                       ThrottlingFilter, access_log)
+from pytt.metrics import LOG_DROPPED
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def make_record(level=logging.ERROR, msg='failed %d', args=(1,),
+                created=0.0, lineno=10):
+    record = logging.LogRecord('pytt', level, 'pytt.py', lineno, msg, args,
+                               None)
+    record.created = created
+    return record
+
+
+class TestThrottlingFilter(unittest.TestCase):
+    """Repeated warnings and errors are counted, not logged
+    """
+
+    def test_throttle(self):
+        throttle = ThrottlingFilter(interval=60)
+        self.assertTrue(throttle.filter(make_record(created=0)))
+        self.assertFalse(throttle.filter(make_record(created=1)))
+        self.assertFalse(throttle.filter(make_record(created=2)))
+        # another call site has its own budget.
+        self.assertTrue(throttle.filter(make_record(created=2, lineno=20)))
+        record = make_record(args=(3,), created=61)
+        self.assertTrue(throttle.filter(record))
+        self.assertEqual(record.getMessage(),
+                         'failed 3 (2 similar messages suppressed)')
+
+    def test_info_is_never_throttled(self):
+        throttle = ThrottlingFilter(interval=60)
+        for created in range(3):
+            self.assertTrue(throttle.filter(make_record(logging.INFO,
+                                                        created=created)))
+
+
+class FakeRequest(object):
+
+    def request_time(self):
+        return 0.001
+
+
+class FakeHandler(object):
+    request = FakeRequest()
+
+    def __init__(self, status):
+        self.status = status
+
+    def get_status(self):
+        return self.status
+
+    def _request_summary(self):
+        return 'GET /announce (127.0.0.1)'
+
+
+class TestAccessSampler(unittest.TestCase):
+    """One request in `sample` is logged, and every error
+    """
+
+    def setUp(self):
+        self.handler = ListHandler()
+        access_log.addHandler(self.handler)
+        self.level = access_log.level
+        access_log.setLevel(logging.INFO)
+
+    def tearDown(self):
+        access_log.removeHandler(self.handler)
+        access_log.setLevel(self.level)
+
+    def test_sample(self):
+        sampler = AccessSampler(sample=10)
+        for _ in range(25):
+            sampler(FakeHandler(200))
+        self.assertEqual(len(self.handler.messages), 2)
+        sampler(FakeHandler(404))
+        self.assertEqual(self.handler.messages[-1],
+                         '404 GET /announce (127.0.0.1) 1.00ms')
+
+
+class TestLogPipeline(unittest.TestCase):
+    """Records are written by the listener, dropped when it lags behind
+    """
+
+    def test_listener(self):
+        target = ListHandler()
+        pipeline = LogPipeline([target])
+        logger = logging.getLogger('pytt.test')
+        logger.addHandler(pipeline.handler)
+        logger.propagate = False
+        pipeline.start()
+        try:
+            logger.warning('queued %s', 'lazily')
+        finally:
+            pipeline.stop()
+            logger.removeHandler(pipeline.handler)
+        self.assertEqual(target.messages, ['queued lazily'])
+
+    def test_full_queue(self):
+        handler = DroppingQueueHandler(queue.Queue(1))
+        dropped = LOG_DROPPED.value
+        handler.handle(make_record())
+        handler.handle(make_record())
+        self.assertEqual(LOG_DROPPED.value, dropped + 1)
+        # the record is queued unformatted.
+        self.assertEqual(handler.queue.get_nowait().args, (1,))
+
+
+if __name__ == '__main__':
+    unittest.main()
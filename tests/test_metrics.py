@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+#
+# TestCases for the Pytt metrics
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+
+import unittest
+
+from pytt.metrics import MetricsRegistry
+
+
+class TestMetrics(unittest.TestCase):
+    """Counters, gauges and histograms in the text exposition format
+    """
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('latency', 'Latency.',
+                                            bounds=(0.1, 1.0), stage='x')
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(0.99), float('inf'))
+        lines = self.registry.exposition().splitlines()
+        self.assertEqual(lines[:5], [
+            '# HELP latency Latency.',
+            '# TYPE latency histogram',
+            'latency_bucket{stage="x",le="0.1"} 2',
+            'latency_bucket{stage="x",le="1"} 3',
+            'latency_bucket{stage="x",le="+Inf"} 4'])
+        self.assertEqual(lines[-1], 'latency_count{stage="x"} 4')
+
+    def test_counters_and_gauges(self):
+        announces = self.registry.counter('requests', 'Requests.',
+                                          handler='announce')
+        self.registry.counter('requests', 'Requests.', handler='scrape')
+        self.registry.gauge('swarms', 'Swarms.', lambda: 3)
+        announces.inc()
+        announces.inc()
+        self.assertEqual(self.registry.exposition(), '\n'.join([
+            '# HELP requests Requests.',
+            '# TYPE requests counter',
+            'requests{handler="announce"} 2',
+            'requests{handler="scrape"} 0',
+            '# HELP swarms Swarms.',
+            '# TYPE swarms gauge',
+            'swarms 3']) + '\n')
+        self.assertRaises(ValueError, self.registry.gauge, 'requests',
+                          'Requests.', lambda: 0)
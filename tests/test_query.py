@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+# TestCases for the Pytt announce and scrape query parsers
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+
+import unittest
+
+from pytt.query import QueryError, parse_announce, parse_scrape
+from pytt.utils import (GENERIC_ERROR, INVALID_INFO_HASH, INVALID_NUMWANT,
+                        INVALID_PORT, MISSING_PEER_ID)
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+
+INFO_HASH = b'\x00\xff+ %&=' + b'\x01' * 13
+PEER_ID = b'-PT0001-' + b'\x80' * 12
+
+
+def query(**params):
+    fields = {'info_hash': INFO_HASH, 'peer_id': PEER_ID, 'port': 6881}
+    fields.update(params)
+    return urlencode(dict((k, v) for k, v in fields.items()
+                          if v is not None))
+
+
+class TestParseAnnounce(unittest.TestCase):
+    """Announce query strings give raw keys and checked numbers
+    """
+    def test_parse(self):
+        request = parse_announce(query(left=0, compact=1, numwant=10,
+                                       event='completed', trackerid='x y'))
+        self.assertEqual(request.info_hash, INFO_HASH)
+        self.assertEqual(request.peer_id, PEER_ID)
+        self.assertEqual((request.port, request.left, request.compact,
+                          request.numwant), (6881, 0, 1, 10))
+        self.assertEqual((request.event, request.trackerid),
+                         ('completed', 'x y'))
+
+    def test_defaults(self):
+        request = parse_announce(query(event='paused'))
+        self.assertEqual((request.left, request.compact, request.event),
+                         (None, 0, ''))
+
+    def assertError(self, code, q):
+        with self.assertRaises(QueryError) as context:
+            parse_announce(q)
+        self.assertEqual(context.exception.code, code)
+
+    def test_invalid(self):
+        self.assertError(MISSING_PEER_ID, query(peer_id=None))
+        self.assertError(INVALID_INFO_HASH, query(info_hash=b'\x01' * 40))
+        self.assertError(INVALID_PORT, query(port='http'))
+        self.assertError(INVALID_PORT, query(port=70000))
+        self.assertError(INVALID_NUMWANT, query(numwant=1000))
+        # the byte counters must fit 64 bits.
+        self.assertError(GENERIC_ERROR, query(uploaded=2 ** 64))
+        self.assertEqual(parse_announce(query(downloaded=2 ** 64 - 1))
+                         .downloaded, 2 ** 64 - 1)
+
+
+class TestParseScrape(unittest.TestCase):
+    def test_parse(self):
+        q = urlencode([('info_hash', INFO_HASH), ('info_hash', b'short'),
+                       ('info_hash', b'\x02' * 20)])
+        self.assertEqual(parse_scrape(q), [INFO_HASH, b'\x02' * 20])
+
+    def test_no_valid_info_hash(self):
+        self.assertEqual(parse_scrape('info_hash=abc'), [])
+        self.assertIsNone(parse_scrape(''))
+        self.assertIsNone(parse_scrape('key=abc'))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#
+# TestCases for the Pytt announce rate limiter
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+
+import unittest
+
+from pytt.ratelimit import AnnounceLimiter, TokenBuckets
+
+
+class TestTokenBuckets(unittest.TestCase):
+    """Buckets refill over time, expire in bulk and stay under the cap
+    """
+    def test_refill(self):
+        buckets = TokenBuckets(rate=1, burst=2)
+        self.assertTrue(buckets.allow('a', now=0))
+        self.assertTrue(buckets.allow('a', now=0))
+        self.assertFalse(buckets.allow('a', now=0.5))
+        self.assertTrue(buckets.allow('a', now=1.1))
+        self.assertFalse(buckets.allow('a', now=1.2))
+
+    def test_cleanup(self):
+        buckets = TokenBuckets(rate=1, burst=2)
+        buckets.allow('a', now=0)
+        buckets.allow('b', now=1)
+        buckets.allow('c', now=5)
+        self.assertEqual(buckets.cleanup(now=3.5), 2)
+        self.assertEqual(list(buckets.buckets), ['c'])
+
+    def test_max_entries(self):
+        buckets = TokenBuckets(rate=1, burst=2, max_entries=2)
+        for key in 'abc':
+            buckets.allow(key, now=0)
+        self.assertEqual(list(buckets.buckets), ['b', 'c'])
+
+
+class TestAnnounceLimiter(unittest.TestCase):
+    """Peers are held to min_interval, IPs to their rate
+    """
+    def test_min_interval(self):
+        limiter = AnnounceLimiter(min_interval=10, peer_burst=1)
+        check = limiter.check
+        self.assertIsNone(check('10.0.0.1', 'hash', 'peer', 'started', 0))
+        self.assertEqual(check('10.0.0.1', 'hash', 'peer', '', 5),
+                         limiter.PEER_LIMITED)
+        # events always go through, other swarms have their own bucket.
+        self.assertIsNone(check('10.0.0.1', 'hash', 'peer', 'stopped', 5))
+        self.assertIsNone(check('10.0.0.1', 'hash2', 'peer', '', 5))
+        self.assertIsNone(check('10.0.0.1', 'hash', 'peer', '', 11))
+
+    def test_ip_rate(self):
+        limiter = AnnounceLimiter(min_interval=10, ip_rate=1, ip_burst=3)
+        for i in range(3):
+            self.assertIsNone(limiter.check('10.0.0.1', 'hash', i, '', 0))
+        self.assertEqual(limiter.check('10.0.0.1', 'hash', 3, '', 0),
+                         limiter.IP_LIMITED)
+        self.assertIsNone(limiter.check('10.0.0.2', 'hash', 4, '', 0))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+# TestCases for the Pytt config snapshots
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+
+import unittest
+
+try:
+    from configparser import RawConfigParser
+except ImportError:
+    from ConfigParser import RawConfigParser
+
+from pytt import utils
+from pytt.bencode import bdecode
+from pytt.settings import ConfigError, parse_settings
+
+from . import TrackerTestCase
+
+
+class TestSettings(unittest.TestCase):
+    """Options are typed, defaulted and pre-encoded
+    """
+
+    def test_types_and_defaults(self):
+        config = RawConfigParser()
+        config.add_section('tracker')
+        config.set('tracker', 'interval', '1800')
+        config.set('tracker', 'prefer_subnet', 'yes')
+        settings = parse_settings(config)
+        self.assertEqual(settings.tracker.interval, 1800)
+        self.assertTrue(settings.tracker.prefer_subnet)
+        self.assertEqual(settings.tracker.min_interval, 1)
+        self.assertEqual(settings.storage.flush_interval, 0.5)
+        self.assertTrue(settings.ratelimit.enabled)
+        self.assertEqual(bdecode(b'd' + settings.responses.intervals + b'e'),
+                         {b'interval': 1800, b'min interval': 1})
+
+    def test_invalid(self):
+        config = RawConfigParser()
+        config.add_section('tracker')
+        config.set('tracker', 'interval', 'often')
+        self.assertRaises(ConfigError, parse_settings, config)
+
+    def test_immutable(self):
+        settings = parse_settings(RawConfigParser())
+        self.assertRaises(AttributeError, setattr, settings.tracker,
+                          'interval', 10)
+
+
+class TestReload(TrackerTestCase):
+    """The config is read once and replaced on reload
+    """
+
+    def tearDown(self):
+        utils.Selector().close()
+        super(TestReload, self).tearDown()
+
+    def test_reload(self):
+        settings = utils.get_settings()
+        selector = utils.Selector().get()
+        self.set_option('tracker', 'interval', '60')
+        self.set_option('tracker', 'peer_selection', 'random')
+        # nothing is read again until the reload.
+        self.assertTrue(utils.get_settings() is settings)
+        utils.reload_config(force=True)
+        self.assertEqual(utils.get_settings().tracker.interval, 60)
+        self.assertFalse(utils.Selector().get() is selector)
+
+    def test_invalid_config_is_not_loaded(self):
+        settings = utils.get_settings()
+        self.set_option('tracker', 'interval', 'often')
+        utils.reload_config(force=True)
+        self.assertTrue(utils.get_settings() is settings)
+
+
+if __name__ == '__main__':
+    unittest.main()
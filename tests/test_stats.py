@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# TestCases for the Pytt swarm statistics
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+
+import unittest
+
+from pytt import utils
+from pytt.stats import SwarmStatistics
+from pytt.swarm import Peer, SwarmRegistry
+
+from . import TrackerTestCase
+
+
+class TestSwarmStatistics(unittest.TestCase):
+    """Totals follow the reports of the peers
+    """
+
+    def test_transfer(self):
+        stats = SwarmStatistics()
+        peer = Peer(b'peer', '10.0.0.1', '6881', 'started')
+        stats.transfer(b'hash', peer, 100, 1000)
+        stats.transfer(b'hash', peer, 150, 3000)
+        torrent = stats.get(b'hash')
+        self.assertEqual((torrent.uploaded, torrent.downloaded), (150, 3000))
+        # the client restarted, its counts start over.
+        stats.transfer(b'hash', peer, 10, 0)
+        self.assertEqual((stats.uploaded, stats.downloaded), (160, 3000))
+
+    def test_idle_torrents_have_no_entry(self):
+        stats = SwarmStatistics()
+        peer = Peer(b'peer', '10.0.0.1', '6881', 'started')
+        stats.transfer(b'hash', peer, 0, 0)
+        self.assertEqual(len(stats), 0)
+        self.assertEqual(stats.times_completed(b'hash'), 0)
+
+    def test_history(self):
+        stats = SwarmStatistics(history=2)
+        for now in range(3):
+            stats.sample(now * 2, now, now)
+        self.assertEqual(list(stats.history), [(1, 2, 1), (2, 4, 2)])
+
+    def test_registry_totals(self):
+        registry = SwarmRegistry()
+        for i in range(4):
+            registry.update(b'hash', b'peer%d' % i, '10.0.0.1', '6881')
+        registry.update(b'hash', b'peer0', '10.0.0.1', '6881', 'completed')
+        registry.remove(b'hash', b'peer1')
+        self.assertEqual((registry.seeders, registry.leechers), (1, 2))
+        self.assertEqual(registry.no_of_peers(), 3)
+
+
+class TestAnnounceStatistics(TrackerTestCase):
+    """Announces update the statistics the scrapes report
+    """
+
+    def announce(self, peer_id, event=None, uploaded=0, downloaded=0):
+        utils.store_peer_info(b'\x01' * 20, peer_id, '10.0.0.1', '6881',
+                              event, uploaded, downloaded)
+
+    def test_completed(self):
+        self.announce(b'A' * 20, 'started')
+        self.announce(b'A' * 20, 'completed', downloaded=500)
+        # a second completed event of the same peer is not counted.
+        self.announce(b'A' * 20, 'completed', downloaded=500)
+        self.announce(b'B' * 20, 'completed', downloaded=500)
+        self.assertEqual(utils.scrape_counts(b'\x01' * 20), (2, 2, 0))
+        # the count stays after the swarm is gone.
+        self.announce(b'A' * 20, 'stopped', 100, 500)
+        self.announce(b'B' * 20, 'stopped', 0, 500)
+        self.assertEqual(utils.scrape_counts(b'\x01' * 20), (0, 2, 0))
+        stats = utils.get_stats()
+        self.assertEqual((stats.uploaded, stats.downloaded), (100, 1000))
+
+    def test_forget_gone_swarms(self):
+        """Torrents never completed lose their entry with their swarm.
+        """
+        self.announce(b'A' * 20, 'started', 100, 500)
+        self.assertEqual(len(utils.get_stats()), 1)
+        self.announce(b'A' * 20, 'stopped', 200, 500)
+        stats = utils.get_stats()
+        self.assertEqual(len(stats), 0)
+        self.assertEqual((stats.uploaded, stats.downloaded), (200, 500))
+        # and so do the expired ones.
+        self.announce(b'B' * 20, 'started', 100, 0)
+        utils.expire_peer(b'\x01' * 20, b'B' * 20)
+        self.assertEqual(len(stats), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#
+# TestCases for the Pytt storage engines
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pytt import utils
+from pytt.storage import open_engine, ENGINES, MemoryEngine
+from pytt.writer import StorageWriter
+
+from . import TrackerTestCase
+
+
+HASH = b'\x00' * 20
+HASH1 = b'\x01' * 20
+HASH2 = b'\x02' * 20
+
+
+class TestStorageEngines(unittest.TestCase):
+    """Every persistent engine gives back what was stored in it.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'pytt.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def reopen(self, name):
+        engine = open_engine(name, self.path)
+        engine.put(HASH1, b'peer1', ('10.0.0.1', '6881', 'started'))
+        engine.put(HASH1, b'peer2', ('10.0.0.2', '6882', 'started'))
+        engine.put(HASH1, b'peer1', ('10.0.0.1', '6881', 'completed'))
+        engine.put(HASH2, b'peer3', ('10.0.0.3', '6883', 'started'))
+        engine.delete(HASH2, b'peer3')
+        engine.delete(HASH2, b'missing')
+        engine.close()
+        engine = open_engine(name, self.path)
+        try:
+            return sorted(engine.load())
+        finally:
+            engine.close()
+
+    def test_persistent_engines(self):
+        expected = [(HASH1, b'peer1', ('10.0.0.1', '6881', 'completed')),
+                    (HASH1, b'peer2', ('10.0.0.2', '6882', 'started'))]
+        for name in ENGINES:
+            if name != 'memory':
+                self.assertEqual(self.reopen(name), expected, name)
+
+    def test_log_compaction(self):
+        engine = open_engine('log', self.path)
+        engine.compact_min = 10
+        for i in range(100):
+            engine.put(HASH, b'peer', ('10.0.0.1', str(i), 'started'))
+        engine.sync()
+        self.assertEqual(engine.records, 1)
+        engine.close()
+        engine = open_engine('log', self.path)
+        self.assertEqual(list(engine.load()),
+                         [(HASH, b'peer', ('10.0.0.1', '99', 'started'))])
+        engine.close()
+
+    def test_journal_snapshot(self):
+        engine = open_engine('journal', self.path)
+        for i in range(10):
+            engine.put(HASH, b'peer%d' % i, ('10.0.0.1', str(i), 'started'))
+        engine.snapshot()
+        engine.pending_snapshot.result()
+        # the tail, written after the snapshot.
+        engine.delete(HASH, b'peer0')
+        engine.put(HASH, b'peer1', ('10.0.0.1', '1', 'completed'))
+        engine.close()
+        self.assertEqual(engine.generations('snapshot'), [2])
+        self.assertEqual(engine.generations('journal'), [2])
+
+        engine = open_engine('journal', self.path)
+        state = dict(((h, p), r) for h, p, r in engine.load())
+        engine.close()
+        self.assertEqual(len(state), 9)
+        self.assertNotIn((HASH, b'peer0'), state)
+        self.assertEqual(state[(HASH, b'peer1')],
+                         ('10.0.0.1', '1', 'completed'))
+
+    def test_journal_torn_tail(self):
+        engine = open_engine('journal', self.path)
+        engine.put(HASH, b'peer1', ('10.0.0.1', '6881', 'started'))
+        engine.put(HASH, b'peer2', ('10.0.0.2', '6882', 'started'))
+        engine.close()
+        # a crash in the middle of the last record.
+        journal = engine.file('journal', engine.generation)
+        with open(journal, 'r+b') as f:
+            f.truncate(os.path.getsize(journal) - 3)
+        engine = open_engine('journal', self.path)
+        self.assertEqual(list(engine.load()),
+                         [(HASH, b'peer1', ('10.0.0.1', '6881', 'started'))])
+        engine.close()
+
+    def test_sqlite_migration(self):
+        """Older sqlite databases have hex info_hashes and text peer_ids.
+        """
+        engine = open_engine('sqlite', self.path)
+        engine.conn.execute('INSERT INTO peers VALUES (?,?,?,?,?)',
+                            ('01' * 20, 'peer1', '10.0.0.1', '6881',
+                             'started'))
+        engine.conn.commit()
+        engine.close()
+        engine = open_engine('sqlite', self.path)
+        self.assertEqual(list(engine.load()),
+                         [(HASH1, b'peer1', ('10.0.0.1', '6881', 'started'))])
+        engine.close()
+
+
+class TestPeerTableStorage(TrackerTestCase):
+    """The announces to a columnar peer table are persisted
+    """
+    options = [('tracker', 'peer_table', 'columns')]
+
+    def test_columns(self):
+        peer_id = b'-BT0001-000000000001'
+        for name in ('log', 'journal'):
+            self.set_option('storage', 'engine', name)
+            utils.Config().close()
+            utils.store_peer_info(HASH1, peer_id, '10.0.0.1', '6881',
+                                  'started')
+            utils.store_peer_info(HASH1, b'peer2', '::1', '6882', 'started')
+            utils.store_peer_info(HASH1, b'peer2', '::1', '6882', 'stopped')
+            # the storage writer is flushed on close.
+            utils.close_db()
+            engine = open_engine(name, utils.DB_PATH)
+            self.assertEqual(list(engine.load()),
+                             [(HASH1, peer_id,
+                               ('10.0.0.1', '6881', 'started'))], name)
+            engine.close()
+            # and the peers are loaded back on startup.
+            swarm = utils.get_swarms().get(HASH1)
+            self.assertEqual([peer.record for peer in swarm],
+                             [('10.0.0.1', '6881', 'started')], name)
+            utils.close_db()
+
+
+class RecordingEngine(MemoryEngine):
+    """Keeps the list of changes written to it.
+    """
+    def __init__(self, path=None):
+        self.writes = []
+        self.syncs = 0
+
+    def put(self, info_hash, peer_id, record):
+        self.writes.append((info_hash, peer_id, record))
+
+    def delete(self, info_hash, peer_id):
+        self.writes.append((info_hash, peer_id, None))
+
+    def sync(self):
+        self.syncs += 1
+
+
+class TestStorageWriter(unittest.TestCase):
+    """Queued changes are coalesced and written in the background
+    """
+    def test_coalesce(self):
+        engine = RecordingEngine()
+        writer = StorageWriter(engine, max_pending=2, flush_interval=60)
+        writer.put(HASH, b'peer1', ('10.0.0.1', '6881', 'started'))
+        writer.put(HASH, b'peer1', ('10.0.0.1', '6881', 'completed'))
+        self.assertFalse(writer.full)
+        writer.put(HASH, b'peer2', ('10.0.0.2', '6882', 'started'))
+        writer.delete(HASH, b'peer2')
+        self.assertTrue(writer.full)
+        writer.close()
+        self.assertEqual(engine.writes,
+                         [(HASH, b'peer1', ('10.0.0.1', '6881', 'completed')),
+                          (HASH, b'peer2', None)])
+        self.assertEqual(engine.syncs, 1)
+
+    def test_background_writes(self):
+        path = self.path()
+        writer = StorageWriter(open_engine('sqlite', path), batch_size=1)
+        self.addCleanup(writer.close)
+        writer.put(HASH, b'peer1', ('10.0.0.1', '6881', 'started'))
+        writer.sync()
+        expected = [(HASH, b'peer1', ('10.0.0.1', '6881', 'started'))]
+        # the writer thread commits them, seen from another connection.
+        deadline = time.time() + 5
+        while True:
+            engine = open_engine('sqlite', path)
+            try:
+                peers = list(engine.load())
+            finally:
+                engine.close()
+            if peers == expected or time.time() > deadline:
+                break
+            time.sleep(0.01)
+        self.assertEqual(peers, expected)
+
+    def path(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        return os.path.join(self.tmpdir, 'pytt.db')
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+#
+# TestCases for the Pytt swarm registry
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+
+import unittest
+
+from pytt.peertable import TableRegistry
+from pytt.reaper import Reaper, TableReaper
+from pytt.selection import PeerSelector, RANDOM, STRATEGIES, split
+from pytt.swarm import SwarmRegistry, family_of
+
+
+class TestSwarmRegistry(unittest.TestCase):
+    """Test cases for the in-memory swarm registry
+    """
+    def setUp(self):
+        self.registry = SwarmRegistry()
+
+    def test_upsert_replaces_status(self):
+        """A peer changing status is updated, not added twice.
+        """
+        self.registry.update('hash', 'peer1', '10.0.0.1', '6881', 'started')
+        self.registry.update('hash', 'peer1', '10.0.0.1', '6881',
+                             'completed')
+        swarm = self.registry.get('hash')
+        self.assertEqual(len(swarm), 1)
+        self.assertEqual(swarm.seeders, 1)
+        self.assertEqual(swarm.leechers, 0)
+
+    def test_counters(self):
+        """Seeder and leecher counters follow every change.
+        """
+        for i in range(10):
+            status = 'completed' if i % 2 else 'started'
+            self.registry.update('hash', 'peer%d' % i, '10.0.0.1',
+                                 '6881', status)
+        swarm = self.registry.get('hash')
+        self.assertEqual((swarm.seeders, swarm.leechers), (5, 5))
+        self.registry.update('hash', 'peer1', '10.0.0.1', '6881', 'stopped')
+        self.registry.update('hash', 'peer2', '10.0.0.1', '6881', 'stopped')
+        self.assertEqual((swarm.seeders, swarm.leechers), (4, 4))
+
+    def test_stopped_removes_empty_swarm(self):
+        """The swarm goes away with its last peer.
+        """
+        self.registry.update('hash', 'peer1', '10.0.0.1', '6881', 'started')
+        self.registry.update('hash', 'peer1', '10.0.0.1', '6881', 'stopped')
+        self.assertNotIn('hash', self.registry)
+        self.assertIsNone(self.registry.remove('hash', 'peer1'))
+
+    def test_packed_peers(self):
+        """The packed buffers follow joins, moves and leaves.
+        """
+        for i in range(1, 6):
+            self.registry.update('hash', 'peer%d' % i, '10.0.0.%d' % i,
+                                 '6881', 'started')
+        self.registry.update('hash', 'peer2', '10.0.0.2', '6881', 'stopped')
+        self.registry.update('hash', 'peer4', '10.0.0.9', '7000', 'started')
+        self.registry.update('hash', 'peer5', '::1', '6881', 'started')
+        swarm = self.registry.get('hash')
+        group = swarm.groups[(4, False)]
+        self.assertEqual(bytes(group.packed),
+                         b''.join(peer.compact for peer in group.peers))
+        self.assertEqual(len(swarm.groups[(6, False)].packed), 18)
+
+    def test_mapped_ipv4(self):
+        """IPv4-mapped IPv6 addresses are stored as IPv4 addresses.
+        """
+        peer = self.registry.update('hash', 'peer1', '::ffff:10.0.0.1',
+                                    '6881', 'started')
+        self.assertEqual(peer.ip, '10.0.0.1')
+        self.assertEqual(peer.compact, b'\x0a\x00\x00\x01\x1a\xe1')
+        self.assertEqual(family_of('::ffff:10.0.0.1'), 4)
+        self.assertEqual(family_of('2001:db8::1'), 6)
+
+
+class TestPeerSelector(unittest.TestCase):
+    """Test cases for the choice of peers returned to a client
+    """
+    def setUp(self):
+        self.registry = SwarmRegistry()
+        for i in range(20):
+            status = 'completed' if i < 5 else 'started'
+            self.registry.update('hash', 'peer%d' % i, '10.0.%d.1' % i,
+                                 '6881', status)
+        self.swarm = self.registry.get('hash')
+        self.requester = self.swarm.get('peer7')
+
+    def test_strategies(self):
+        """Both strategies return numwant distinct peers, never the
+        requester.
+        """
+        for strategy in STRATEGIES:
+            selector = PeerSelector(strategy)
+            for _ in range(50):
+                selection = selector.select(self.swarm, 10,
+                                            requester=self.requester)
+                peers = selection.peers()
+                self.assertEqual(len(peers), 10)
+                self.assertEqual(len(set(peers)), 10)
+                self.assertNotIn(self.requester, peers)
+                self.assertEqual(selection.compact(),
+                                 b''.join(p.compact for p in peers))
+            everyone = selector.select(self.swarm, 50,
+                                       requester=self.requester)
+            self.assertEqual(len(everyone), 19)
+        # the buffers are not held on to by the responses.
+        self.registry.update('hash', 'peer20', '10.0.20.1', '6881')
+        self.registry.remove('hash', 'peer20')
+
+    def test_complementary(self):
+        """Seeders get leechers only, leechers get seeders first.
+        """
+        selector = PeerSelector(RANDOM, complementary=True)
+        peers = selector.select(self.swarm, 50, left=0).peers()
+        self.assertEqual(len(peers), 15)
+        self.assertFalse(any(p.is_seeder for p in peers))
+        peers = selector.select(self.swarm, 8, requester=self.requester,
+                                left=100).peers()
+        self.assertEqual([p.is_seeder for p in peers], [True] * 5 +
+                         [False] * 3)
+
+    def test_prefer_subnet(self):
+        """Peers of the requester's subnet come first.
+        """
+        self.registry.update('hash', 'near', '10.0.7.99', '6881', 'started')
+        selector = PeerSelector(RANDOM, prefer_subnet=True)
+        # with enough candidates to cover the whole swarm.
+        peers = selector.select(self.swarm, 6,
+                                requester=self.requester).peers()
+        self.assertEqual(peers[0].peer_id, 'near')
+
+    def test_split(self):
+        """numwant is shared without exceeding any group.
+        """
+        self.assertEqual(split(3, [1, 1, 1, 1]), [1, 1, 1, 0])
+        self.assertEqual(split(10, [2, 3]), [2, 3])
+        self.assertEqual(sum(split(50, [100, 30, 7, 0])), 50)
+
+
+class TestReaper(unittest.TestCase):
+    """Test cases for the expiry of silent peers
+    """
+    def setUp(self):
+        self.registry = SwarmRegistry()
+        self.reaper = Reaper(self.registry, 10, self.registry.remove)
+
+    def test_reap_silent_peers(self):
+        """Only the peers not seen within the timeout are evicted.
+        """
+        self.registry.update('hash', 'peer1', '10.0.0.1', '6881',
+                             'started', now=100)
+        self.registry.update('hash', 'peer2', '10.0.0.2', '6881',
+                             'started', now=100)
+        self.registry.update('hash', 'peer2', '10.0.0.2', '6881', now=105)
+        self.assertEqual(self.reaper.reap(now=109), 0)
+        self.assertEqual(self.reaper.reap(now=110), 1)
+        self.assertNotIn('peer1', self.registry.get('hash'))
+        self.assertEqual(self.reaper.reap(now=115), 1)
+        self.assertNotIn('hash', self.registry)
+        self.assertEqual((self.reaper.evicted, self.reaper.passes), (2, 3))
+        self.assertEqual(len(self.reaper), 0)
+
+
+class TestTableRegistry(TestSwarmRegistry):
+    """The swarm registry tests, on a columnar peer table
+    """
+    def setUp(self):
+        self.registry = TableRegistry()
+
+    def test_free_list(self):
+        """Rows of the peers that left are reused.
+        """
+        peer_id = b'-BT0001-000000000001'
+        self.registry.update('hash', peer_id, '10.0.0.1', '6881', 'started')
+        self.registry.update('hash', 'peer2', '10.0.0.2', '6881', 'started')
+        self.registry.update('hash', peer_id, '10.0.0.1', '6881', 'stopped')
+        peer = self.registry.update('other', 'peer3', '::1', '7000',
+                                    'completed')
+        table = self.registry.table
+        self.assertEqual((len(table.ports), len(table)), (2, 2))
+        self.assertEqual(peer.row, 0)
+        self.assertEqual(peer.record, ('::1', '7000', 'completed'))
+        peer = self.registry.update('hash', peer_id, '10.0.0.1', '6881')
+        # 20-byte peer_ids are kept in the fixed-width buffer.
+        self.assertEqual(peer.peer_id, peer_id)
+        self.assertNotIn(peer.row, table.odd_ids)
+
+    def test_expiry_buckets(self):
+        """Rows are filed by last-seen time, and only the due buckets are
+        looked at.
+        """
+        table = self.registry.table
+        peer1 = self.registry.update('hash', 'peer1', '10.0.0.1', '6881',
+                                     'started', now=100)
+        peer2 = self.registry.update('hash', 'peer2', '10.0.0.2', '6881',
+                                     'started', now=105)
+        self.registry.update('hash', 'peer1', '10.0.0.1', '6881', now=108)
+        # peer1 announced since, and is filed again.
+        self.assertEqual(table.expired(104), [])
+        self.assertEqual(sorted(table.buckets), [105, 108])
+        self.assertEqual(table.expired(106), [peer2.row])
+        self.registry.remove('hash', 'peer2')
+        # the stale entries of a row reused over and over go with their
+        # buckets.
+        for now in range(110, 120):
+            self.registry.update('hash', 'peer3', '10.0.0.3', '6881',
+                                 'started', now=now)
+            self.registry.remove('hash', 'peer3')
+        self.assertEqual(table.expired(200), [peer1.row])
+        self.assertEqual((table.entries, table.due), (0, []))
+
+
+class TestTablePeerSelector(TestPeerSelector):
+    """The peer selection tests, on a columnar peer table
+    """
+    def setUp(self):
+        self.registry = TableRegistry()
+        for i in range(20):
+            status = 'completed' if i < 5 else 'started'
+            self.registry.update('hash', 'peer%d' % i, '10.0.%d.1' % i,
+                                 '6881', status)
+        self.swarm = self.registry.get('hash')
+        self.requester = self.swarm.get('peer7')
+
+
+class TestTableReaper(TestReaper):
+    """The reaper tests, on a columnar peer table
+    """
+    def setUp(self):
+        self.registry = TableRegistry()
+        self.reaper = TableReaper(self.registry, 10, self.registry.remove)
@@ -1,23 +1,24 @@
 #!/usr/bin/env python
 #
-# TestCases for Pytt Tracker 
+# TestCases for Pytt Tracker
 #
 # @author: Sreejith K <sreejithemk@gmail.com>
 # Created on 12th May 2011
 # http://foobarnbaz.com
 
 
-import os
-import sys
-from nose import with_setup
-import urllib2
-import urllib
+import gzip
 import hashlib
+from urllib.parse import urlencode
+
 from tornado.testing import AsyncHTTPTestCase
 
-sys.path.append('../')
+from pytt import utils
+from pytt.bencode import bdecode
 from pytt.tracker import *
 
+from . import TrackerTestCase
+
 
 # define application
 app = tornado.web.Application([
@@ -27,44 +28,25 @@ app = tornado.web.Application([
         ])
 
 
-def clear_db():
-    """Clear the tracker db.
-    """
-    try:
-        os.remove(DB_PATH)
-    except:
-        pass
-
-
-class TestHandlerBase(AsyncHTTPTestCase):
-    """Base Test class for all request handlers.
+class TestHandlerBase(TrackerTestCase, AsyncHTTPTestCase):
+    """Base Test class for all request handlers, starting from an empty
+    tracker db.
     """
-    def setUp(self):
-        """Do this before every test
-        """
-        clear_db()
-        super(TestHandlerBase, self).setUp()
-
     def get_app(self):
         """Get the application object
         """
         return app
 
-    def get_http_port(self):
-        """Set Tracker listen port from config or default 8080
-        """
-        return get_config().getint('tracker', 'port') or 8080
-
 
 class TestAnnounceHandler(TestHandlerBase):
     """Test cases for Announce request for the Torrent Tracker
     """
-    def announce_test(self):
+    def test_announce(self):
         """Test response for Announce request.
         """
         # torrent meta info
         info = {'piece length': 1024,
-                'pieces': hashlib.sha1('crap').digest(),
+                'pieces': hashlib.sha1(b'crap').digest(),
                 'private': 0
                 }
         # bencode meta info
@@ -73,17 +55,128 @@ class TestAnnounceHandler(TestHandlerBase):
         info_hash = hashlib.sha1(bencoded_info).digest()
         # check info_hash_length
         self.assertEqual(len(info_hash), INFO_HASH_LEN)
-        # make an announce query
+        # make an announce query, peer_ids are 20 bytes long.
         query = {'info_hash': info_hash,
-                 'peer_id': 'BitTorrent-1.0',
+                 'peer_id': 'BitTorrent-1.0-00001',
                  'ip': '112.113.144.1',
                  'port': '6881'
                  }
         # urlencode this dictionary
-        query = urllib.urlencode(query)
+        query = urlencode(query)
         # send GET request to /announce
-        response = self.fetch('/announce?%s' %query, 
-                            method='GET',
-                            follow_redirects=False)
-        # if successful, should return 200-OK 
-        self.assertEqual(response.code, 200)
\ No newline at end of file
+        response = self.fetch('/announce?%s' % query,
+                              method='GET',
+                              follow_redirects=False)
+        # if successful, should return 200-OK
+        self.assertEqual(response.code, 200)
+
+    def test_invalid_announces(self):
+        """Invalid announces get a bencoded failure reason.
+        """
+        query = {'info_hash': hashlib.sha1(b'torrent').digest(),
+                 'peer_id': 'BitTorrent-1.0-00001',
+                 'port': '6881'}
+        errors = ERRORS['announce'].value
+        for change, code in (({'port': '0'}, INVALID_PORT),
+                             ({'port': 'x'}, INVALID_PORT),
+                             ({'numwant': '100'}, INVALID_NUMWANT),
+                             ({'peer_id': 'short'}, INVALID_PEER_ID),
+                             ({'info_hash': ''}, MISSING_INFO_HASH),
+                             ({'uploaded': 2 ** 64}, GENERIC_ERROR)):
+            params = dict(query, **change)
+            response = self.fetch('/announce?%s' % urlencode(params))
+            self.assertEqual(response.code, 200, change)
+            self.assertEqual(bdecode(response.body), {
+                b'failure reason':
+                    PYTT_RESPONSE_MESSAGES[code].encode('ascii')}, change)
+        self.assertEqual(ERRORS['announce'].value, errors + 6)
+        # none of them reached the swarms.
+        self.assertEqual(len(utils.get_swarms()), 0)
+
+
+class TestScrapeHandler(TestHandlerBase):
+    """Test cases for Scrape request for the Torrent Tracker
+    """
+    def test_scrape(self):
+        """The scrape reports the peers announced.
+        """
+        info_hash = hashlib.sha1(b'torrent').digest()
+        query = urlencode({'info_hash': info_hash,
+                           'peer_id': 'BitTorrent-1.0-00001',
+                           'port': '6881',
+                           'event': 'completed'})
+        self.assertEqual(self.fetch('/announce?%s' % query).code, 200)
+        response = self.fetch('/scrape?%s' % urlencode(
+            {'info_hash': info_hash}))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(bdecode(response.body),
+                         {b'files': {info_hash: {b'complete': 1,
+                                                 b'downloaded': 1,
+                                                 b'incomplete': 0}}})
+
+    def test_invalid_info_hash(self):
+        """Invalid info_hashes don't turn a scrape into a full listing.
+        """
+        utils.store_peer_info(b'\x01' * 20, b'peer', '10.0.0.1', '6881')
+        response = self.fetch('/scrape?info_hash=abc')
+        self.assertEqual(bdecode(response.body), {b'files': {}})
+        response = self.fetch('/scrape')
+        self.assertEqual(list(bdecode(response.body)[b'files']),
+                         [b'\x01' * 20])
+
+
+class TestScrapeChunks(TrackerTestCase):
+    """Scrape responses are generated in chunks
+    """
+    def setUp(self):
+        super(TestScrapeChunks, self).setUp()
+        self.info_hashes = [hashlib.sha1(b'%d' % i).digest()
+                            for i in range(100)]
+        for info_hash in self.info_hashes:
+            utils.store_peer_info(info_hash, b'peer', '10.0.0.1', '6881')
+
+    def test_full_listing(self):
+        chunks = list(scrape_chunks(chunk_size=500))
+        self.assertTrue(chunks[0].startswith(SCRAPE_PREFIX))
+        self.assertTrue(chunks[-1].endswith(SCRAPE_SUFFIX))
+        # every chunk but the last is just past the chunk size.
+        self.assertTrue(all(500 <= len(chunk) < 600
+                            for chunk in chunks[1:-1]))
+        files = bdecode(b''.join(chunks))[b'files']
+        self.assertEqual(list(files), sorted(self.info_hashes))
+        self.assertEqual(files[self.info_hashes[0]],
+                         {b'complete': 0, b'downloaded': 0,
+                          b'incomplete': 1})
+
+    def test_unwrapped(self):
+        entries = b''.join(scrape_chunks(chunk_size=500, wrap=False))
+        self.assertEqual(SCRAPE_PREFIX + entries + SCRAPE_SUFFIX,
+                         b''.join(scrape_chunks()))
+
+    def test_info_hashes(self):
+        info_hashes = self.info_hashes[:3] + [b'\x00' * 20]
+        files = bdecode(b''.join(scrape_chunks(info_hashes)))[b'files']
+        self.assertEqual(list(files), sorted(info_hashes))
+        self.assertEqual(files[b'\x00' * 20],
+                         {b'complete': 0, b'downloaded': 0,
+                          b'incomplete': 0})
+
+
+class TestStreamedScrape(TestHandlerBase):
+    """The full scrape is streamed, gzipped if the client accepts it
+    """
+    def get_app(self):
+        return make_app()
+
+    def test_gzip(self):
+        # enough torrents for several chunks.
+        info_hashes = [hashlib.sha1(b'%d' % i).digest()
+                       for i in range(2000)]
+        for info_hash in info_hashes:
+            utils.store_peer_info(info_hash, b'peer', '10.0.0.1', '6881')
+        response = self.fetch('/scrape', decompress_response=False,
+                              headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Transfer-Encoding'], 'chunked')
+        files = bdecode(gzip.decompress(response.body))[b'files']
+        self.assertEqual(list(files), sorted(info_hashes))
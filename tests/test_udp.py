@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# TestCases for the Pytt UDP tracker
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+
+import struct
+import unittest
+
+from pytt import utils
+from pytt.udp import UDPTracker, PROTOCOL_ID
+
+from . import TrackerTestCase
+
+
+class TestUDPTracker(TrackerTestCase):
+    """Test cases for the BEP 15 connect, announce and scrape actions
+    """
+    addr = ('10.0.0.1', 40000)
+
+    def setUp(self):
+        super(TestUDPTracker, self).setUp()
+        self.tracker = UDPTracker()
+
+    def connect(self, addr=addr):
+        response = self.tracker.handle_datagram(
+            struct.pack('>QII', PROTOCOL_ID, 0, 7), addr)
+        action, transaction_id, connection_id = struct.unpack('>IIQ',
+                                                              response)
+        self.assertEqual((action, transaction_id), (0, 7))
+        return connection_id
+
+    def announce(self, connection_id, peer_id, port, event=2, addr=addr):
+        request = struct.pack('>QII20s20sQQQIIIiH', connection_id, 1, 8,
+                              b'\x01' * 20, peer_id, 0, 100, 0, event, 0,
+                              0, -1, port)
+        return self.tracker.handle_datagram(request, addr)
+
+    def test_announce_and_scrape(self):
+        connection_id = self.connect()
+        self.announce(connection_id, b'A' * 20, 6881)
+        response = self.announce(connection_id, b'B' * 20, 6882)
+        action, _, interval, leechers, seeders = struct.unpack_from(
+            '>IIIII', response)
+        self.assertEqual((action, interval, leechers, seeders), (1, 5, 2, 0))
+        # the other peer only, never the announcing one.
+        self.assertEqual(response[20:], b'\x0a\x00\x00\x01\x1a\xe1')
+
+        response = self.tracker.handle_datagram(
+            struct.pack('>QII', connection_id, 2, 9) + b'\x01' * 20 +
+            b'\x02' * 20, self.addr)
+        self.assertEqual(struct.unpack('>IIIIIIII', response),
+                         (2, 9, 0, 0, 2, 0, 0, 0))
+
+    def test_invalid_connection_id(self):
+        connection_id = self.connect(('10.0.0.2', 40000))
+        response = self.announce(connection_id, b'A' * 20, 6881)
+        self.assertEqual(struct.unpack_from('>I', response)[0], 3)
+        self.assertIsNone(self.tracker.handle_datagram(
+            struct.pack('>QII', 1234, 0, 7), self.addr))
+
+    def test_dual_stack(self):
+        addr6 = ('2001:db8::1', 40000)
+        self.announce(self.connect(addr6), b'A' * 20, 6881, addr=addr6)
+        connection_id = self.connect()
+        response = self.announce(connection_id, b'B' * 20, 6882)
+        # an IPv4 client only gets IPv4 peers over UDP.
+        self.assertEqual(response[20:], b'')
+        response = self.announce(self.connect(addr6), b'C' * 20, 6883,
+                                 addr=addr6)
+        self.assertEqual(len(response[20:]), 18)
+
+        # announces over HTTP get both lists.
+        peers = utils.get_compact_peers(b'\x01' * 20, 50, b'B' * 20)
+        self.assertEqual(peers['peers'], b'')
+        self.assertEqual(len(peers['peers6']), 36)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+#
+# TestCases for the Pytt torrent whitelist
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+
+import binascii
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pytt.bencode import bencode
+from pytt.whitelist import (BloomFilter, TorrentRegistry, Whitelist,
+                            load_hash_list, torrent_info_hash)
+
+
+def info_hash(n):
+    return hashlib.sha1(str(n).encode()).digest()
+
+
+class TestBloomFilter(unittest.TestCase):
+    """No false negatives, few false positives
+    """
+
+    def test_membership(self):
+        bloom = BloomFilter(1000)
+        for n in range(1000):
+            bloom.add(info_hash(n))
+        for n in range(1000):
+            self.assertTrue(info_hash(n) in bloom)
+        false_positives = sum(info_hash(n) in bloom
+                              for n in range(1000, 11000))
+        self.assertTrue(false_positives < 50)
+
+
+class TestWhitelist(unittest.TestCase):
+    """Only the listed info_hashes are allowed
+    """
+
+    def test_contains(self):
+        whitelist = Whitelist([info_hash(1), info_hash(2)])
+        self.assertEqual(len(whitelist), 2)
+        self.assertTrue(info_hash(1) in whitelist)
+        self.assertFalse(info_hash(3) in whitelist)
+        self.assertFalse(b'short' in whitelist)
+
+    def test_empty(self):
+        self.assertFalse(info_hash(1) in Whitelist())
+
+
+class TestTorrentRegistry(unittest.TestCase):
+    """The whitelist is built from .torrent files and hash lists
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.torrent_dir = os.path.join(self.tmpdir, 'torrents')
+        os.mkdir(self.torrent_dir)
+        self.hash_list = os.path.join(self.tmpdir, 'hashes')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_torrent(self, name):
+        info = {'name': name, 'piece length': 16384, 'length': 1,
+                'pieces': b'\x00' * 20}
+        with open(os.path.join(self.torrent_dir, name + '.torrent'),
+                  'wb') as f:
+            f.write(bencode({'announce': 'http://localhost/announce',
+                             'info': info}))
+        return hashlib.sha1(bencode(info)).digest()
+
+    def test_torrent_info_hash(self):
+        expected = self.write_torrent('a')
+        path = os.path.join(self.torrent_dir, 'a.torrent')
+        self.assertEqual(torrent_info_hash(path), expected)
+
+    def test_non_canonical_torrent(self):
+        """The info_hash is taken on the info dict as found in the file.
+        """
+        info = b'd6:lengthi1e4:name1:b4:name1:b12:piece lengthi16384ee'
+        path = os.path.join(self.torrent_dir, 'b.torrent')
+        with open(path, 'wb') as f:
+            f.write(b'd4:info' + info + b'8:announce4:httpe')
+        self.assertEqual(torrent_info_hash(path),
+                         hashlib.sha1(info).digest())
+        with open(path, 'wb') as f:
+            f.write(b'd8:announce4:httpe')
+        self.assertRaises(KeyError, torrent_info_hash, path)
+
+    def test_hash_list(self):
+        with open(self.hash_list, 'w') as f:
+            f.write('# allowed torrents\n')
+            f.write(binascii.hexlify(info_hash(1)).decode() + '\n')
+            f.write(binascii.hexlify(info_hash(2)).decode() + '  # two\n')
+            f.write('not a hash\n\n')
+        self.assertEqual(load_hash_list(self.hash_list),
+                         set([info_hash(1), info_hash(2)]))
+
+    def test_reload(self):
+        first = self.write_torrent('a')
+        registry = TorrentRegistry(self.torrent_dir, self.hash_list)
+        self.assertTrue(first in registry)
+        self.assertFalse(info_hash(1) in registry)
+
+        second = self.write_torrent('b')
+        with open(self.hash_list, 'w') as f:
+            f.write(binascii.hexlify(info_hash(1)).decode() + '\n')
+        # make the change visible whatever the mtime resolution.
+        past = time.time() - 10
+        os.utime(self.torrent_dir, (past, past))
+        registry.reload(wait=True)
+        self.assertEqual(len(registry), 3)
+        for allowed in (first, second, info_hash(1)):
+            self.assertTrue(allowed in registry)
+
+        os.remove(os.path.join(self.torrent_dir, 'a.torrent'))
+        registry.reload(wait=True)
+        self.assertFalse(first in registry)
+
+
+if __name__ == '__main__':
+    unittest.main()
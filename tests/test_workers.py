@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+#
+# TestCases for the multi-process mode of Pytt
+#
+# @author: Sreejith K <sreejithemk@gmail.com>
+# http://foobarnbaz.com
+
+
+import asyncio
+import hashlib
+import multiprocessing
+import struct
+import unittest
+from urllib.parse import urlencode
+
+import tornado.httpserver
+import tornado.ioloop
+from tornado.testing import AsyncHTTPTestCase, bind_unused_port, gen_test
+
+from pytt import utils
+from pytt.bencode import bdecode
+from pytt.tracker import make_app
+from pytt.udp import PROTOCOL_ID, UDPTracker
+from pytt.workers import (LocalListing, ShardListing, Shards, listing_uri,
+                          merge_listings, scrape_uri, shard_of)
+
+from . import TrackerTestCase
+
+
+SECRET = b'0123456789abcdef'
+
+# torrents of each of two shards.
+INFO_HASHES = [hashlib.sha1(b'%d' % i).digest() for i in range(40)]
+SHARDS = dict((shard, [info_hash for info_hash in INFO_HASHES
+                       if shard_of(info_hash, 2) == shard])
+              for shard in (0, 1))
+
+
+def announce(info_hashes, peer_id, ip):
+    for info_hash in info_hashes:
+        utils.store_peer_info(info_hash, peer_id, ip, '6881', 'completed')
+
+
+def serve_shard(sock):
+    """Worker 1, forked from the test: serves its shard to worker 0.
+    """
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    utils.use_shard_db(1)
+    announce(SHARDS[1], b'-PT0001-000000000001', '10.0.0.1')
+    internal = make_app(internal=True, udp=UDPTracker(SECRET))
+    server = tornado.httpserver.HTTPServer(internal)
+    server.add_sockets([sock])
+    tornado.ioloop.IOLoop.current().start()
+
+
+class TestShards(unittest.TestCase):
+    """Info_hashes are routed to their shard
+    """
+    def test_routing(self):
+        shards = Shards(2, 0, 18080)
+        self.assertEqual(sorted(shards.split(INFO_HASHES)[1]),
+                         sorted(SHARDS[1]))
+        self.assertTrue(all(shards.is_local(info_hash)
+                            for info_hash in SHARDS[0]))
+        self.assertEqual(shards.url(1, '/scrape'),
+                         'http://127.0.0.1:18081/scrape')
+
+    def test_uris(self):
+        self.assertEqual(scrape_uri([b'\x00\xff' * 10]),
+                         '/scrape?info_hash=' + '%00%FF' * 10)
+        self.assertEqual(listing_uri(b'\x00\xff', 10),
+                         '/scrape?after=00ff&limit=10')
+
+
+class TestShardedTracker(TrackerTestCase, AsyncHTTPTestCase):
+    """Worker 0 of two, with worker 1 running in a child process
+    """
+    options = [('storage', 'engine', 'memory')]
+
+    def get_app(self):
+        sock, port = bind_unused_port()
+        context = multiprocessing.get_context('fork')
+        self.shard = context.Process(target=serve_shard, args=(sock,))
+        self.shard.daemon = True
+        self.shard.start()
+        sock.close()
+        self.shards = Shards(2, 0, port - 1)
+        announce(SHARDS[0], b'-PT0001-000000000000', '10.0.0.0')
+        return make_app(shards=self.shards)
+
+    def tearDown(self):
+        self.shard.terminate()
+        self.shard.join()
+        super(TestShardedTracker, self).tearDown()
+
+    def scrape(self, info_hashes=()):
+        query = urlencode([('info_hash', info_hash)
+                           for info_hash in info_hashes])
+        return self.fetch('/scrape?' + query)
+
+    def test_full_scrape(self):
+        """The listings of the shards are merged in order, page by page.
+        """
+        page_size = ShardListing.page_size
+        ShardListing.page_size = 3
+        self.addCleanup(setattr, ShardListing, 'page_size', page_size)
+        response = self.scrape()
+        self.assertEqual(response.code, 200)
+        self.assertTrue(response.body.startswith(b'd5:filesd20:'))
+        files = bdecode(response.body)[b'files']
+        self.assertEqual(list(files), sorted(INFO_HASHES))
+        self.assertEqual(files[SHARDS[1][0]], {b'complete': 1,
+                                               b'downloaded': 1,
+                                               b'incomplete': 0})
+
+    def test_scrape(self):
+        info_hashes = SHARDS[0][:2] + SHARDS[1][:2] + [b'\x00' * 20]
+        files = bdecode(self.scrape(info_hashes).body)[b'files']
+        self.assertEqual(sorted(files), sorted(info_hashes))
+        self.assertEqual(files[SHARDS[1][0]][b'complete'], 1)
+        self.assertEqual(files[b'\x00' * 20][b'complete'], 0)
+
+    def test_forwarded_announce(self):
+        query = urlencode({'info_hash': SHARDS[1][0],
+                           'peer_id': '-PT0001-000000000002',
+                           'port': '6882', 'compact': '1'})
+        response = bdecode(self.fetch('/announce?' + query).body)
+        # the peer of worker 1 is in the swarm.
+        self.assertEqual(response[b'peers'], b'\x0a\x00\x00\x01\x1a\xe1')
+        self.assertEqual(response[b'incomplete'], 1)
+        self.assertNotIn(SHARDS[1][0], utils.get_swarms())
+
+    def test_keep_alive(self):
+        """The requests forwarded to a shard share a connection.
+        """
+        streams = set()
+        for n in range(3):
+            query = urlencode({'info_hash': SHARDS[1][n],
+                               'peer_id': '-PT0001-000000000002',
+                               'port': '6882'})
+            self.assertEqual(self.fetch('/announce?' + query).code, 200)
+            idle = self.shards.connections[1].idle
+            self.assertEqual(len(idle), 1)
+            streams.add(idle[0])
+        self.assertEqual(len(streams), 1)
+
+    def test_unreachable_shard(self):
+        self.shard.terminate()
+        self.shard.join()
+        self.assertEqual(self.scrape().code, 503)
+        self.assertEqual(self.scrape(SHARDS[1][:1]).code, 503)
+        query = urlencode({'info_hash': SHARDS[1][0],
+                           'peer_id': '-PT0001-000000000002',
+                           'port': '6882'})
+        self.assertEqual(self.fetch('/announce?' + query).code, 503)
+        # the local torrents are still served.
+        self.assertEqual(self.scrape(SHARDS[0][:1]).code, 200)
+
+    @gen_test
+    async def test_listing_failure(self):
+        """A shard failing midway is left out of the rest of the listing.
+        """
+        remote = ShardListing(self.shards, 1, '127.0.0.1')
+        remote.page_size = 2
+        local = LocalListing(sorted(SHARDS[0]), lambda info_hash: b'de')
+        entries = await merge_listings([local, remote])
+        self.shard.terminate()
+        self.shard.join()
+        info_hashes = [info_hash async for info_hash, _ in entries]
+        self.assertEqual(info_hashes,
+                         sorted(SHARDS[0] + sorted(SHARDS[1])[:2]))
+
+    @gen_test
+    async def test_udp(self):
+        """UDP requests for the other shard are relayed to it.
+        """
+        addr = ('10.0.0.2', 40000)
+        tracker = UDPTracker(SECRET, self.shards)
+        _, _, connection_id = struct.unpack('>IIQ', tracker.handle_datagram(
+            struct.pack('>QII', PROTOCOL_ID, 0, 7), addr))
+        request = struct.pack('>QII', connection_id, 2, 9) + \
+            SHARDS[1][0] + SHARDS[0][0]
+        response = await tracker.handle_datagram(request, addr)
+        self.assertEqual(struct.unpack('>IIIIIIII', response),
+                         (2, 9, 1, 1, 0, 1, 1, 0))
+        request = struct.pack('>QII20s20sQQQIIIiH', connection_id, 1, 8,
+                              SHARDS[1][0], b'B' * 20, 0, 100, 0, 2, 0,
+                              0, -1, 6882)
+        response = await tracker.handle_datagram(request, addr)
+        self.assertEqual(response[20:], b'\x0a\x00\x00\x01\x1a\xe1')
+
+
+if __name__ == '__main__':
+    unittest.main()